@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2013, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Micro-benchmark: interp1d ("Linear Spline" of spectrum.interpolate) on
+## stacked SEDs, i.e. segments on overlapping grids with many duplicate x
+## values, before and after averaging the duplicates with numpy, and with
+## the interpolant taken from an InterpolantCache.  Then Neville's
+## algorithm on all the points against local_neville ("Local Neville").
+##
+##   python benchmarks/bench_interpolation.py [repeat]
+#
+
+import sys
+import timeit
+
+import numpy
+from scipy import interpolate
+
+from sherpa_samp.interpolation import (interp1d, local_neville,
+                                       InterpolantCache)
+
+
+def list_interp1d(xout, xin, yin):
+    # What interp1d used to do
+    xin, yin = (list(x) for x in zip(*sorted(zip(xin, yin),
+                                             key=lambda pair: pair[0])))
+    ds = {}
+    for x, y in zip(xin, yin):
+        if ds.has_key(x):
+            ds[x].append(y)
+        else:
+            ds[x] = [y,]
+    x = []
+    y = []
+    for (k, v) in ds.iteritems():
+        x.append(k)
+        y.append(numpy.mean(v))
+    x = numpy.array(x)
+    y = numpy.array(y)
+    x, y = (list(xin) for xin in zip(*sorted(zip(x, y),
+                                             key=lambda pair: pair[0])))
+    f = interpolate.interp1d(x, y, bounds_error=False, kind='linear')
+    return f(xout)
+
+
+def full_neville(xout, xin, yin):
+    # Neville's algorithm through every point, as sherpa.utils.neville,
+    # vectorized over the output points
+    xin, yin = (numpy.asarray(a, dtype=float) for a in (xin, yin))
+    xout = numpy.asarray(xout, dtype=float)
+    p = numpy.tile(yin, (xout.size, 1))
+    x = xout[:, numpy.newaxis]
+    n = xin.size
+    # high degree polynomials through noisy data overflow, as they do in
+    # spectrum.interpolate
+    with numpy.errstate(all="ignore"):
+        for j in range(1, n):
+            left = xin[:n - j]
+            right = xin[j:]
+            p[:, :n - j] = ((x - right) * p[:, :n - j] +
+                            (left - x) * p[:, 1:n - j + 1]) / (left - right)
+    return p[:, 0]
+
+
+def stacked_sed(npoints, nsegments=10, seed=0):
+    """
+    nsegments segments of npoints / nsegments points each, on the same
+    logarithmic grid but in different orders.
+    """
+    rng = numpy.random.RandomState(seed)
+    grid = numpy.logspace(3, 5, npoints // nsegments)
+    x = numpy.concatenate([rng.permutation(grid)
+                           for ii in range(nsegments)])
+    y = (x / 5000.) ** -1.5 * rng.uniform(0.9, 1.1, x.size)
+    return x, y
+
+
+def main(repeat=3):
+    for npoints in (10 ** 3, 10 ** 4, 10 ** 5):
+        x, y = stacked_sed(npoints)
+        xout = numpy.logspace(3, 5, 1000)
+        assert numpy.allclose(interp1d(xout, x, y), list_interp1d(xout, x, y),
+                              rtol=1.e-12, equal_nan=True)
+        cache = InterpolantCache()
+        cached = lambda xout, x, y: cache.get(interp1d, x, y)(xout)
+        cached(xout, x, y)
+        for label, func in (("before (lists and dict)", list_interp1d),
+                            ("after (unique and bincount)", interp1d),
+                            ("after, cached interpolant", cached)):
+            best = min(timeit.repeat(lambda: func(xout, x, y), number=1,
+                                     repeat=repeat))
+            print "%7d points  %-28s %9.3f ms" % (npoints, label, 1.e3 * best)
+
+    xout = numpy.logspace(3.1, 4.9, 1000)
+    for npoints in (10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5):
+        x, y = stacked_sed(npoints, nsegments=1)
+        x, y = numpy.log10(x), numpy.log10(y)
+        functions = [("local_neville", local_neville)]
+        if npoints <= 10 ** 3:
+            functions.insert(0, ("Neville on all the points", full_neville))
+        for label, func in functions:
+            best = min(timeit.repeat(lambda: func(xout, x, y), number=1,
+                                     repeat=repeat))
+            print "%7d points  %-28s %9.3f ms" % (npoints, label, 1.e3 * best)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,625 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Latency and throughput of every mtype, without a real hub
+#
+## A stand-in hub (sherpa_samp.tests.hub) runs in this process, sherpa-samp
+## in a child process registered with it.  Every mtype of
+## sherpa_samp.mtypes._mtypes is called with payloads of several sizes:
+##
+##   --points    SED length (fits, calc, SED tools)
+##   --segments  number of segments (stacking) or datasets (fit.batch)
+##   --pars      number of free parameters (fits, confidence)
+##   --grid      number of grid points (calc.statistic.values)
+##
+## and with the SEDs of examples/*.xml.  Latencies are measured from the
+## call until the reply reaches the hub.  Fits are given slightly
+## different starting values on every call so that the fit result cache
+## does not answer them, unless --cached is given.
+##
+##   python benchmarks/bench_mtypes.py --save baseline.json
+##   python benchmarks/bench_mtypes.py --compare baseline.json
+##
+## The comparison exits with status 1 when a case got slower than the
+## baseline by more than --threshold.
+#
+
+import os
+import re
+import sys
+import copy
+import glob
+import json
+import time
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+import xml.etree.ElementTree as ElementTree
+
+import numpy
+
+from sherpa_samp.utils import encode_string
+from sherpa_samp.tests.hub import StandInHub
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_examples = os.path.join(_here, os.pardir, "examples")
+_table = os.path.join(_here, os.pardir, "sherpa_samp", "tests",
+                      "sed_index_1.0.dat")
+
+_max = float(numpy.finfo(numpy.float32).max)
+_tiny = float(numpy.finfo(numpy.float32).tiny)
+_eps = float(numpy.finfo(numpy.float32).eps)
+
+# speed of light in Angstrom / s
+_c = 2.99792458e18
+
+
+#
+## Inputs
+#
+
+def read_example(path):
+    """
+    (x, y, yerr) of a NED SED, wavelength in Angstrom and flux density in
+    Jy, sorted by wavelength.  Points without an error get 10%.
+    """
+    ns = "{http://www.ivoa.net/xml/VOTable/v1.2}"
+    table = ElementTree.parse(path).getroot().find(".//%sTABLE" % ns)
+    fields = [field.get("ID") for field in table.findall("%sFIELD" % ns)]
+    ix = fields.index("DataSpectralValue")
+    iy = fields.index("DataFluxValue")
+    ierr = fields.index("DataFluxStatErr")
+
+    points = []
+    for row in table.findall(".//%sTR" % ns):
+        cells = [(cell.text or "").strip() for cell in row.findall("%sTD" % ns)]
+        try:
+            nu = float(cells[ix])
+            flux = float(cells[iy])
+        except (ValueError, IndexError):
+            continue
+        try:
+            err = abs(float(cells[ierr].replace("+/-", "")))
+        except (ValueError, IndexError):
+            err = 0.0
+        if nu <= 0 or flux <= 0:
+            continue
+        points.append((_c / nu, flux, err or 0.1 * flux))
+
+    points.sort()
+    x, y, yerr = [numpy.array(col) for col in zip(*points)]
+    return x, y, yerr
+
+
+def examples():
+    seds = {}
+    for path in sorted(glob.glob(os.path.join(_examples, "*.xml"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        seds[name] = read_example(path)
+    return seds
+
+
+def synthetic_sed(npoints, seed=0):
+    """
+    A noisy power law on [1000, 100000] Angstrom.
+    """
+    rng = numpy.random.RandomState(seed)
+    x = numpy.logspace(3, 5, npoints)
+    y = 1.e-3 * (x / 5000.) ** -1.5
+    yerr = 0.05 * y
+    y = y + rng.normal(0.0, 1.0, npoints) * yerr
+    return x, numpy.abs(y), yerr
+
+
+def polynomial_data(npoints, seed=0):
+    rng = numpy.random.RandomState(seed)
+    x = numpy.linspace(1.0, 10.0, npoints)
+    y = 10.0 + 2.0 * x - 0.3 * x ** 2 + 0.01 * x ** 3
+    return x, y + rng.normal(0.0, 0.1, npoints), numpy.ones(npoints) * 0.1
+
+
+def dataset(name, x, y, yerr):
+    return {"name" : name,
+            "x" : encode_string(x),
+            "y" : encode_string(y),
+            "staterror" : encode_string(yerr)}
+
+
+def _par(name, val, vmin=-_max, vmax=_max, frozen=False):
+    return {"name" : name, "val" : float(val), "min" : float(vmin),
+            "max" : float(vmax), "frozen" : bool(frozen)}
+
+
+def powlaw_model(x, y):
+    ref = float(numpy.median(x))
+    ampl = float(numpy.interp(ref, x, y))
+    p1 = {"name" : "powlaw1d.p1",
+          "pars" : [_par("p1.gamma", 1.0, -10, 10),
+                    _par("p1.ref", ref, frozen=True),
+                    _par("p1.ampl", ampl, 0.0)]}
+    return {"name" : "powlaw1d.p1", "parts" : [p1]}
+
+
+def polynomial_model(npars):
+    """
+    polynom1d components with npars coefficients thawed in all.
+    """
+    parts = []
+    left = npars
+    for ii in range(max(1, (npars + 8) // 9)):
+        name = "p%d" % (ii + 1)
+        pars = []
+        for jj in range(9):
+            pars.append(_par("%s.c%d" % (name, jj), 1.0 if jj == 0 else 0.0,
+                             frozen=(jj >= left)))
+        left -= 9
+        parts.append({"name" : "polynom1d." + name, "pars" : pars})
+    return {"name" : "+".join(part["name"] for part in parts),
+            "parts" : parts}
+
+
+def thawed(model):
+    return [par["name"] for part in model["parts"] for par in part["pars"]
+            if not par["frozen"]]
+
+
+def stat():
+    return {"name" : "chi2"}
+
+
+def method():
+    return {"name" : "levmar",
+            "config" : {"maxfev" : int(10000), "ftol" : _eps,
+                        "epsfcn" : _eps, "gtol" : _eps, "xtol" : _eps,
+                        "factor" : float(100)}}
+
+
+def confidence():
+    return {"name" : "conf",
+            "config" : {"sigma" : float(1.0), "eps" : float(0.01),
+                        "maxiters" : int(200), "soft_limits" : False,
+                        "fast" : True, "max_rstat" : int(100),
+                        "maxfits" : int(5), "numcores" : int(1),
+                        "openinterval" : False, "remin" : float(0.01),
+                        "tol" : float(0.2)}}
+
+
+def fit_params(data, model, **extra):
+    params = {"datasets" : [data], "models" : [model], "stat" : stat(),
+              "method" : method()}
+    params.update(extra)
+    return params
+
+
+def segment(x, y, yerr, **extra):
+    seg = {"x" : encode_string(x), "y" : encode_string(y),
+           "yerr" : encode_string(yerr)}
+    for key, val in extra.items():
+        seg[key] = str(val)
+    return seg
+
+
+def sed_tool_params(mtype, x, y, yerr, method="Linear"):
+    if mtype == "spectrum.redshift.calc":
+        return {"x" : encode_string(x), "y" : encode_string(y),
+                "yerr" : encode_string(yerr), "from-redshift" : "0.0",
+                "to-redshift" : "1.5"}
+    if mtype == "spectrum.integrate":
+        edges = numpy.linspace(x.min(), x.max(), 6)
+        windows = [{"id" : "w%d" % ii, "min" : repr(lo), "max" : repr(hi)}
+                   for ii, (lo, hi) in enumerate(zip(edges[:-1], edges[1:]))]
+        return {"x" : encode_string(x), "y" : encode_string(y),
+                "curves" : [], "windows" : windows}
+    if mtype == "spectrum.interpolate":
+        return {"x" : encode_string(x), "y" : encode_string(y),
+                "x-min" : repr(float(x.min())), "x-max" : repr(float(x.max())),
+                "method" : method, "n-bins" : str(len(x)), "log" : "true",
+                "smooth" : "false", "box-size" : "5", "normalize" : "false"}
+    raise ValueError(mtype)
+
+
+def stack_params(mtype, seds):
+    segments = [segment(x, y, yerr, id="sed%d" % ii, z=0.1 * (ii % 10))
+                for ii, (x, y, yerr) in enumerate(seds)]
+    if mtype == "stack.redshift":
+        return {"segments" : segments, "z0" : "0.0", "correct-flux" : "false"}
+    if mtype == "stack.normalize":
+        return {"segments" : segments, "norm-operator" : "0", "y0" : "1.0",
+                "xmin" : "min", "xmax" : "max", "stats" : "avg",
+                "integrate" : "true"}
+    if mtype == "stack.stack":
+        x = seds[0][0]
+        return {"segments" : segments,
+                "binsize" : repr(float(numpy.diff(numpy.log10(x)).mean())),
+                "statistic" : "avg", "smooth" : "false",
+                "smooth-binsize" : "5", "log-bin" : "true"}
+    raise ValueError(mtype)
+
+
+#
+## Cases
+#
+
+class Case(object):
+
+    def __init__(self, mtype, label, params, sender="bench", vary=False):
+        self.mtype = mtype
+        self.label = label
+        self.params = params
+        self.sender = sender
+        self.vary = vary
+
+    def message(self, index):
+        params = self.params
+        if self.vary:
+            # a different starting point defeats the fit result cache
+            params = copy.deepcopy(params)
+            for model in params.get("models", []):
+                for part in model["parts"]:
+                    for par in part["pars"]:
+                        if not par["frozen"]:
+                            par["val"] += 1.e-9 * (index + 1)
+                            break
+        return {"samp.mtype" : self.mtype, "samp.params" : params}
+
+
+_fits = ("spectrum.fit.fit", "spectrum.fit.fit.batch",
+         "spectrum.fit.confidence")
+
+
+def make_cases(args):
+    seds = examples()
+    cases = []
+
+    def add(mtype, label, params, **kwargs):
+        kwargs.setdefault("vary", mtype in _fits and not args.cached)
+        cases.append(Case(mtype, "%s[%s]" % (mtype, label), params, **kwargs))
+
+    # service mtypes
+    add("sherpa.ping", "-", {})
+    add("sherpa.stats", "-", {})
+    add("spectrum.fit.job.list", "-", {})
+    for mtype in ("spectrum.fit.fit.stop", "spectrum.fit.confidence.stop",
+                  "spectrum.fit.job.stop"):
+        add(mtype, "-", {"msg-id" : "no-such-call"}, sender="bench-stop")
+    add("load.table.votable", "-", {})
+    add("load.table.fits", "sed_index_1.0", {"url" : _table})
+
+    # fits of the example SEDs
+    for name, (x, y, yerr) in sorted(seds.items()):
+        model = powlaw_model(x, y)
+        data = dataset(name, x, y, yerr)
+        add("spectrum.fit.fit", name, fit_params(data, model))
+        add("spectrum.fit.calc.model.values", name, fit_params(data, model))
+        add("spectrum.fit.calc.flux.value", name,
+            fit_params(data, model, type="energy"))
+        for mtype in ("spectrum.redshift.calc", "spectrum.integrate",
+                      "spectrum.interpolate"):
+            add(mtype, name, sed_tool_params(mtype, x, y, yerr))
+
+    # fits by SED length and number of free parameters
+    for npoints in args.points:
+        data = dataset("bench", *polynomial_data(npoints))
+        for npars in args.pars:
+            model = polynomial_model(npars)
+            label = "points=%d,pars=%d" % (npoints, npars)
+            add("spectrum.fit.fit", label, fit_params(data, model))
+            add("spectrum.fit.calc.statistic.value", label,
+                fit_params(data, model))
+            if npars <= args.max_confidence_pars:
+                add("spectrum.fit.confidence", label,
+                    fit_params(data, model, confidence=confidence()))
+        for nsegments in args.segments:
+            params = fit_params(data, polynomial_model(3))
+            params["datasets"] = [data] * nsegments
+            add("spectrum.fit.fit.batch",
+                "points=%d,datasets=%d" % (npoints, nsegments), params)
+
+    # session set up with spectrum.fit.set.*
+    data = dataset("bench", *polynomial_data(args.points[0]))
+    model = polynomial_model(args.pars[-1])
+    label = "points=%d,pars=%d" % (args.points[0], args.pars[-1])
+    add("spectrum.fit.set.data", label, {"datasets" : [data]})
+    add("spectrum.fit.set.model", label, {"models" : [model]})
+    add("spectrum.fit.set.statistic", "chi2", {"stat" : stat()})
+    add("spectrum.fit.set.method", "levmar", {"method" : method()})
+    add("spectrum.fit.set.confidence", "conf",
+        {"confidence" : confidence()})
+
+    # statistic grids
+    for npoints in args.grid:
+        model = polynomial_model(2)
+        names = thawed(model)
+        values = [encode_string(numpy.linspace(0.5, 1.5, npoints)),
+                  encode_string(numpy.linspace(-1.0, 1.0, npoints))]
+        params = fit_params(data, model,
+                            grid={"parnames" : names, "values" : values})
+        add("spectrum.fit.calc.statistic.values", "grid=%d" % npoints, params)
+        params = dict(params, parallel="true")
+        add("spectrum.fit.calc.statistic.values",
+            "grid=%d,parallel" % npoints, params)
+
+    # SED tools and stacking by SED length and number of segments
+    for npoints in args.points:
+        x, y, yerr = synthetic_sed(npoints)
+        label = "points=%d" % npoints
+        add("spectrum.redshift.calc", label,
+            sed_tool_params("spectrum.redshift.calc", x, y, yerr))
+        add("spectrum.integrate", label,
+            sed_tool_params("spectrum.integrate", x, y, yerr))
+        for name in args.methods:
+            add("spectrum.interpolate", "%s,method=%s" % (label, name),
+                sed_tool_params("spectrum.interpolate", x, y, yerr, name))
+        for nsegments in args.segments:
+            sample = [synthetic_sed(npoints, seed) for seed in
+                      range(nsegments)]
+            for mtype in ("stack.redshift", "stack.normalize", "stack.stack"):
+                add(mtype, "%s,segments=%d" % (label, nsegments),
+                    stack_params(mtype, sample))
+
+    # the example SEDs stacked
+    sample = [seds[name] for name in sorted(seds)]
+    for mtype in ("stack.redshift", "stack.normalize"):
+        add(mtype, "examples", stack_params(mtype, sample))
+
+    if args.match:
+        pattern = re.compile(args.match)
+        cases = [case for case in cases if pattern.search(case.label)]
+    return cases
+
+
+def check_coverage(cases):
+    """
+    Warn about mtypes that no case calls.
+    """
+    try:
+        from sherpa_samp.mtypes import _mtypes
+    except ImportError, e:
+        print >> sys.stderr, "cannot check mtype coverage: %s" % str(e)
+        return
+    missing = set(_mtypes) - set(case.mtype for case in cases)
+    for mtype in sorted(missing):
+        print >> sys.stderr, "warning: no benchmark for " + mtype
+
+
+#
+## Running
+#
+
+class Server(object):
+    """
+    A stand-in hub and a sherpa-samp process registered with it.
+    """
+
+    def __init__(self, timeout=120.0):
+        self.hub = StandInHub()
+        lockfile = self.hub.start()
+        env = dict(os.environ)
+        env["SAMP_HUB"] = "std-lockurl:file://" + lockfile
+        self.child = subprocess.Popen(
+            [sys.executable, "-c",
+             "import sherpa_samp.mtypes as m; m.main([])"], env=env)
+        self.id = self.hub.wait_subscribed(timeout)
+        if self.id is None:
+            self.stop()
+            raise RuntimeError("sherpa-samp did not register within %g s" %
+                               timeout)
+
+    def call(self, message, sender, timeout):
+        start = time.time()
+        msg_id = self.hub.call(self.id, message, sender)
+        response = self.hub.wait_reply(msg_id, timeout)
+        elapsed = time.time() - start
+        if response is None:
+            return elapsed, "timeout"
+        if response.get("samp.status") != "samp.ok":
+            result = response.get("samp.result", {})
+            return elapsed, str(result.get("exception", "error"))
+        return elapsed, None
+
+    def stop(self):
+        if self.child.poll() is None:
+            self.child.terminate()
+            self.child.wait()
+        self.hub.stop()
+
+
+def run_case(server, case, repeat, concurrency, timeout):
+    # one call to load the subsystem, start the pool and so on
+    server.call(case.message(-1), case.sender, timeout)
+
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    counter = iter(range(repeat))
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            elapsed, failure = server.call(case.message(index), case.sender,
+                                           timeout)
+            with lock:
+                latencies.append(elapsed)
+                if failure is not None:
+                    errors[failure] = errors.get(failure, 0) + 1
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for ii in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.time() - start
+
+    p50, p95, p99 = numpy.percentile(latencies, [50, 95, 99])
+    return {"mtype" : case.mtype,
+            "calls" : len(latencies),
+            "errors" : errors,
+            "p50" : p50,
+            "p95" : p95,
+            "p99" : p99,
+            "calls_per_s" : len(latencies) / wall}
+
+
+def environment():
+    try:
+        revision = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=_here,
+            stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {"time" : time.strftime("%Y-%m-%d %H:%M:%S"),
+            "host" : socket.gethostname(),
+            "platform" : platform.platform(),
+            "python" : platform.python_version(),
+            "numpy" : numpy.__version__,
+            "cpus" : os.sysconf("SC_NPROCESSORS_ONLN"),
+            "revision" : revision}
+
+
+def report(results):
+    print "%-60s %6s %9s %9s %9s %9s %s" % ("case", "calls", "p50 ms",
+                                            "p95 ms", "p99 ms", "calls/s",
+                                            "errors")
+    for label in sorted(results):
+        res = results[label]
+        errors = ", ".join("%s: %d" % item for item in
+                           sorted(res["errors"].items()))
+        print "%-60s %6d %9.2f %9.2f %9.2f %9.1f %s" % (
+            label, res["calls"], 1.e3 * res["p50"], 1.e3 * res["p95"],
+            1.e3 * res["p99"], res["calls_per_s"], errors)
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of p50, p95 and calls/s of every case against the
+    baseline, returns the labels of the cases that regressed.
+    """
+    regressions = []
+    print
+    print "%-60s %9s %9s %9s" % ("change against baseline", "p50", "p95",
+                                 "calls/s")
+    for label in sorted(results):
+        old = baseline["results"].get(label)
+        if old is None:
+            continue
+        new = results[label]
+        changes = [new[key] / old[key] - 1.0 if old[key] else 0.0
+                   for key in ("p50", "p95", "calls_per_s")]
+        slower = (changes[0] > threshold or changes[1] > threshold or
+                  changes[2] < -threshold)
+        if slower:
+            regressions.append(label)
+        print "%-60s %+8.1f%% %+8.1f%% %+8.1f%% %s" % (
+            label, 100 * changes[0], 100 * changes[1], 100 * changes[2],
+            "REGRESSION" if slower else "")
+    missing = set(baseline["results"]) - set(results)
+    if missing:
+        print "%d baseline cases were not run" % len(missing)
+    return regressions
+
+
+def _sizes(value):
+    return [int(size) for size in value.split(",")]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sherpa-samp "
+                                     "mtypes against a stand-in hub")
+    parser.add_argument("--points", type=_sizes, default=[100, 1000, 10000],
+                        help="SED lengths (default 100,1000,10000)")
+    parser.add_argument("--segments", type=_sizes, default=[1, 10, 40],
+                        help="numbers of segments (default 1,10,40)")
+    parser.add_argument("--pars", type=_sizes, default=[2, 5, 9],
+                        help="numbers of free parameters (default 2,5,9)")
+    parser.add_argument("--grid", type=_sizes, default=[100, 10000],
+                        help="statistic grid sizes (default 100,10000)")
+    parser.add_argument("--methods", type=lambda value: value.split(","),
+                        default=["Linear", "Nearest Neighbor",
+                                 "Linear Spline", "Neville",
+                                 "Local Neville"],
+                        help="interpolation methods")
+    parser.add_argument("--max-confidence-pars", type=int, default=5,
+                        help="skip confidence with more free parameters")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="calls per case (default 20)")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="calls in flight at once (default 1)")
+    parser.add_argument("--timeout", type=float, default=600.0,
+                        help="seconds to wait for a reply")
+    parser.add_argument("--cached", action="store_true",
+                        help="repeat identical fits, i.e. measure the fit "
+                        "result cache")
+    parser.add_argument("--match", metavar="REGEX",
+                        help="only run the cases whose label matches")
+    parser.add_argument("--save", metavar="PATH",
+                        help="store the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH",
+                        help="compare the results with a stored baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown reported as a regression "
+                        "(default 0.2)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cases = make_cases(args)
+    check_coverage(cases)
+
+    results = {}
+    server = Server()
+    try:
+        for case in cases:
+            results[case.label] = run_case(server, case, args.repeat,
+                                           args.concurrency, args.timeout)
+            print >> sys.stderr, "%-60s p50 %.2f ms" % (
+                case.label, 1.e3 * results[case.label]["p50"])
+    finally:
+        server.stop()
+
+    report(results)
+
+    settings = dict((key, getattr(args, key)) for key in
+                    ("repeat", "concurrency", "cached"))
+    if args.save:
+        with open(args.save, "w") as out:
+            json.dump({"environment" : environment(), "settings" : settings,
+                       "results" : results}, out, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            baseline = json.load(baseline)
+        if baseline.get("settings", settings) != settings:
+            print ("warning: the baseline was run with %s" %
+                   baseline["settings"])
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Micro-benchmark: SherpaSession construction with and without the
+## cached model-type registry, and a spectrum.fit.calc.statistic.value
+## call that builds a new session against one that updates the session
+## cached for the client with the model parameters it sends.
+##
+##   python benchmarks/bench_session.py [repeat]
+#
+
+import sys
+import timeit
+import numpy
+
+import sherpa_samp.session as session
+from sherpa_samp.session import SherpaSession
+from sherpa_samp.utils import encode_string
+
+
+def uncached_session():
+    # What SherpaSession.__init__ used to do for every SAMP message
+    ui = session.sherpaUI.utils.Session()
+    for module, baselist in session._model_modules:
+        ui._add_model_types(module, baselist=baselist)
+    ui.set_conf_opt("max_rstat", 1.e+38)
+    ui.set_conf_opt("sigma", 1.6448536269514722)
+    return ui
+
+
+def cached_session():
+    return SherpaSession()
+
+
+def get_spec(npoints=1000):
+    x = numpy.linspace(1.0, 10.0, npoints)
+    y = 3.0 * x ** -1.5
+    data = {'name' : 'power law',
+            'x' : encode_string(x),
+            'y' : encode_string(y),
+            'staterror' : encode_string(y * 0.1)}
+    p1 = {'name' : 'powlaw1d.p1',
+          'pars' : [{'name' : 'p1.gamma', 'val' : 1.0, 'min' : -10.0,
+                     'max' : 10.0, 'frozen' : False},
+                    {'name' : 'p1.ref', 'val' : 1.0, 'min' : -1.e10,
+                     'max' : 1.e10, 'frozen' : True},
+                    {'name' : 'p1.ampl', 'val' : 1.0, 'min' : 0.0,
+                     'max' : 1.e10, 'frozen' : False}]}
+    return {'datasets' : [data],
+            'models' : [{'name' : 'powlaw1d.p1', 'parts' : [p1]}],
+            'stat' : {'name' : 'chi2'},
+            'method' : {'name' : 'levmar'}}
+
+
+_steps = ("data", "parameters", "model", "stat")
+
+
+def rebuilt_call(spec, cached):
+    # What the calc handlers used to do for every call
+    ui = SherpaSession()
+    ui.update(cached.get_spec({'models' : spec['models']}), (), _steps)
+    return ui.session.calc_stat()
+
+
+def cached_call(spec, cached):
+    sent = {'models' : spec['models']}
+    with cached.lock:
+        cached.update(cached.get_spec(sent), sent.keys(), _steps)
+        return cached.session.calc_stat()
+
+
+def main(repeat=200):
+    # build the registry before timing
+    session.get_model_types()
+
+    for label, func in (("before (_add_model_types)", uncached_session),
+                        ("after (cached registry)", cached_session)):
+        best = min(timeit.repeat(func, number=repeat, repeat=3))
+        print "%-28s %8.3f ms per session" % (label, 1.e3 * best / repeat)
+
+    # the client set its data earlier, each call only sends the models
+    spec = get_spec()
+    cached = SherpaSession()
+    cached.update(cached.get_spec(spec), spec.keys(), _steps)
+
+    for label, func in (("before (new session)", rebuilt_call),
+                        ("after (cached session)", cached_call)):
+        best = min(timeit.repeat(lambda: func(spec, cached), number=repeat,
+                                 repeat=3))
+        print "%-28s %8.3f ms per call" % (label, 1.e3 * best / repeat)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Startup benchmark: time from starting sherpa-samp until it is registered
+## with a hub and has declared its subscriptions, i.e. until Iris can call
+## it.  Each run starts a fresh stand-in hub (sherpa_samp.tests.hub) and a
+## fresh sherpa-samp process pointed at it through SAMP_HUB.
+##
+## "lazy" is sherpa-samp as it is, "eager" loads every subsystem before
+## main(), the way sherpa_samp.mtypes used to at import.
+##
+##   python benchmarks/bench_startup.py [repeat]
+#
+
+import os
+import sys
+import time
+import subprocess
+
+from sherpa_samp.tests.hub import StandInHub
+
+_children = {
+    "lazy"  : "import sherpa_samp.mtypes as m; m.main([])",
+    "eager" : ("import sherpa_samp.mtypes as m\n"
+               "for modules in m.subsystems.values():\n"
+               "    for module in modules: module.load()\n"
+               "m.main(['--no-prewarm'])"),
+    }
+
+_import = ("import time; start = time.time(); import sherpa_samp.mtypes as m; "
+           "print time.time() - start")
+
+
+def time_to_registration(mode, timeout=120.0):
+    hub = StandInHub()
+    lockfile = hub.start()
+    env = dict(os.environ)
+    env["SAMP_HUB"] = "std-lockurl:file://" + lockfile
+    start = time.time()
+    child = subprocess.Popen([sys.executable, "-c", _children[mode]], env=env)
+    try:
+        public_id = hub.wait_subscribed(timeout)
+        elapsed = time.time() - start
+    finally:
+        child.terminate()
+        child.wait()
+        hub.stop()
+    if public_id is None:
+        raise RuntimeError("sherpa-samp did not register within %g s" %
+                           timeout)
+    return elapsed
+
+
+def import_time():
+    return float(subprocess.check_output([sys.executable, "-c", _import]))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(repeat=5):
+    times = [import_time() for ii in range(repeat)]
+    print "%-32s %8.3f s (min %.3f s)" % ("import sherpa_samp.mtypes",
+                                         median(times), min(times))
+    for mode in ("eager", "lazy"):
+        times = [time_to_registration(mode) for ii in range(repeat)]
+        print "%-32s %8.3f s (min %.3f s)" % ("time to registration, " + mode,
+                                             median(times), min(times))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import copy
+import glob
+import hashlib
+import tempfile
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+
+import numpy
+
+from sherpa_samp.utils import decode_string
+
+import logging
+logger = logging.getLogger(__name__)
+info = logger.info
+warn = logger.warning
+
+__all__ = ('LRUCache', 'FitResultCache', 'WarmStartStore', 'hash_spec',
+           'fit_keys')
+
+
+class LRUCache(object):
+    """
+    At most maxsize items and, if maxbytes is given, at most maxbytes in
+    all as measured by sizeof(value).  The least recently used items are
+    evicted first.
+    """
+
+    def __init__(self, maxsize=256, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def _discard(self, key):
+        self._items.pop(key, None)
+        self.nbytes -= self._sizes.pop(key, 0)
+
+    def put(self, key, value):
+        size = 0
+        if self.sizeof is not None:
+            size = self.sizeof(value)
+        with self._lock:
+            self._discard(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._items[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            while (len(self._items) > self.maxsize or
+                   (self.maxbytes is not None and
+                    self.nbytes > self.maxbytes)):
+                self._discard(next(iter(self._items)))
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+
+def _update(digest, obj):
+    if isinstance(obj, numpy.ndarray):
+        array = numpy.ascontiguousarray(obj, dtype=numpy.float64)
+        digest.update("array%s:" % str(array.shape))
+        digest.update(array.view(numpy.uint8))
+    elif isinstance(obj, dict):
+        digest.update("dict%d:" % len(obj))
+        for key in sorted(obj.keys()):
+            _update(digest, key)
+            _update(digest, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        digest.update("list%d:" % len(obj))
+        for item in obj:
+            _update(digest, item)
+    else:
+        digest.update("%s:%r;" % (type(obj).__name__, obj))
+
+
+# the parts of a SherpaSession spec that determine the outcome of a fit
+fit_keys = ("datasets", "models", "usermodels", "stat", "method")
+
+
+def hash_spec(spec, keys=fit_keys):
+    """
+    Content hash of the given keys of a session spec: the decoded data
+    arrays, model expressions, parameter values, limits and frozen flags,
+    statistic and method configuration.  User model files are identified
+    by path and modification time.
+    """
+    digest = hashlib.sha1()
+    _update(digest, dict((key, spec[key]) for key in keys
+                         if spec.has_key(key)))
+    for model_info in spec.get("usermodels", []):
+        path = str(model_info.get("file", "")).strip()
+        if os.path.exists(path):
+            _update(digest, (path, os.path.getmtime(path)))
+    return digest.hexdigest()
+
+
+class FitResultCache(object):
+    """
+    get_fit_results() dicts keyed by hash_spec() of the session that was
+    fitted.  Kept in memory with LRU eviction and, when a directory is
+    given, also on disk so that they survive restarts of sherpa-samp.
+    """
+
+    def __init__(self, maxsize=256, directory=None, disk_maxsize=4096):
+        self.memory = LRUCache(maxsize)
+        self.directory = directory
+        self.disk_maxsize = disk_maxsize
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    key = staticmethod(hash_spec)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+    def get(self, key):
+        results = self.memory.get(key)
+        if results is None and self.directory is not None:
+            try:
+                with open(self._path(key), "rb") as fd:
+                    results = pickle.load(fd)
+                self.memory.put(key, results)
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                results = None
+        if results is None:
+            return None
+        return copy.deepcopy(results)
+
+    def put(self, key, results):
+        results = copy.deepcopy(results)
+        self.memory.put(key, results)
+        if self.directory is None:
+            return
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "wb") as tmp:
+                pickle.dump(results, tmp, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpname, self._path(key))
+            self._prune()
+        except (IOError, OSError), e:
+            warn("cannot store fit results on disk: " + str(e))
+
+    def _prune(self):
+        paths = glob.glob(os.path.join(self.directory, "*.pickle"))
+        if len(paths) <= self.disk_maxsize:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.disk_maxsize]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        self.memory.clear()
+        if self.directory is not None:
+            for path in glob.glob(os.path.join(self.directory, "*.pickle")):
+                os.unlink(path)
+
+
+def _model_pars(modelmaps):
+    for model in modelmaps:
+        for component in model["parts"]:
+            for pardict in component["pars"]:
+                yield pardict
+
+
+class WarmStartStore(object):
+    """
+    Last converged parameter values per SAMP client and model expression,
+    used to start the next fit of the same model from the previous optimum
+    rather than from the initial guesses sent by the client.
+    """
+
+    def __init__(self, maxsize=64):
+        self._fits = LRUCache(maxsize)
+
+    def _key(self, sender_id, modelmaps):
+        return (sender_id,
+                tuple(str(model["name"]).strip() for model in modelmaps))
+
+    def _structure(self, modelmaps):
+        return tuple(sorted(str(pardict["name"]).strip()
+                            for pardict in _model_pars(modelmaps)))
+
+    def store(self, sender_id, modelmaps, results):
+        if results.get("succeeded") != "1":
+            return
+        parvals = decode_string(results["parvals"], native=True)
+        best = dict(zip(results["parnames"], parvals.tolist()))
+        self._fits.put(self._key(sender_id, modelmaps),
+                       (self._structure(modelmaps), best))
+
+    def seed(self, sender_id, modelmaps):
+        """
+        Set the thawed parameter values of modelmaps in place to the last
+        converged ones, if the same client fitted a model with the same
+        expression and parameters before.  Returns whether it did.
+        """
+        entry = self._fits.get(self._key(sender_id, modelmaps))
+        if entry is None:
+            return False
+        structure, best = entry
+        if structure != self._structure(modelmaps):
+            return False
+
+        seeded = False
+        for pardict in _model_pars(modelmaps):
+            name = str(pardict["name"]).strip()
+            if bool(int(pardict.get("frozen", 0))) or not best.has_key(name):
+                continue
+            val = best[name]
+            if pardict.has_key("min"):
+                val = max(val, float(pardict["min"]))
+            if pardict.has_key("max"):
+                val = min(val, float(pardict["max"]))
+            pardict["val"] = repr(val)
+            seeded = True
+        return seeded
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import functools
+import threading
+import Queue
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+info = logger.info
+warn = logger.warning
+error = logger.error
+
+from sherpa_samp.utils import capture_exception
+
+__all__ = ('Lane', 'Dispatcher')
+
+
+class Lane(object):
+    """
+    A bounded queue of SAMP calls served by a fixed number of threads.
+    If a gate (threading.Event) is given, calls wait in the queue while
+    it is clear.
+    """
+
+    def __init__(self, name, nthreads, maxsize=0, gate=None):
+        self.name = name
+        self.gate = gate
+        self._calls = Queue.Queue(maxsize)
+        self._threads = []
+        for ii in range(max(1, int(nthreads))):
+            thread = threading.Thread(target=self._serve,
+                                      name="%s-%d" % (name, ii))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, call):
+        self._calls.put_nowait(call)
+
+    def qsize(self):
+        return self._calls.qsize()
+
+    def _serve(self):
+        while True:
+            call = self._calls.get()
+            if call is None:
+                break
+            if self.gate is not None:
+                self.gate.wait()
+            handler, args = call
+            try:
+                handler(*args)
+            except Exception:
+                error(str(capture_exception()))
+
+    def shutdown(self):
+        for thread in self._threads:
+            self._calls.put(None)
+
+
+class Dispatcher(object):
+    """
+    Sits between cli.bindReceiveCall and the mtype handlers.
+
+    Each incoming call is queued at once on one of two lanes and the SAMP
+    callback returns; the handler then runs on a lane thread and sends its
+    own reply.  Mtypes listed in `expensive` (fits, confidence, ...) get a
+    lane of their own, so cheap calls like sherpa.ping never wait behind
+    them.  When a lane is full, `on_reject(msg_id, mtype)` is called
+    instead of queueing the call.  `on_receive(msg_id, mtype)` is called
+    for every call as it arrives.
+
+    The sender of the most recent calls is remembered by msg_id, see
+    sender_of().  While `gate` is clear, e.g. during a reconnection to the
+    hub, calls are kept in the lanes.
+    """
+
+    # msg_ids remembered for sender_of()
+    max_senders = 4096
+
+    def __init__(self, expensive=(), cheap_threads=4, expensive_threads=2,
+                 maxsize=64, on_reject=None, gate=None, on_receive=None):
+        self.expensive = frozenset(expensive)
+        self.on_reject = on_reject
+        self.on_receive = on_receive
+        self.cheap = Lane("sherpa-cheap", cheap_threads, maxsize, gate)
+        self.costly = Lane("sherpa-expensive", expensive_threads, maxsize,
+                           gate)
+        self._senders = OrderedDict()
+        self._senders_lock = threading.Lock()
+
+    def sender_of(self, msg_id, forget=False):
+        """
+        The id of the client that sent the call msg_id, None if unknown.
+        """
+        with self._senders_lock:
+            if forget:
+                return self._senders.pop(msg_id, None)
+            return self._senders.get(msg_id)
+
+    def lane_for(self, mtype):
+        if mtype in self.expensive:
+            return self.costly
+        return self.cheap
+
+    def dispatch(self, handler, private_key, sender_id, msg_id, mtype, params,
+                 extra):
+        with self._senders_lock:
+            self._senders[msg_id] = sender_id
+            while len(self._senders) > self.max_senders:
+                self._senders.popitem(last=False)
+        if self.on_receive is not None:
+            self.on_receive(msg_id, mtype)
+
+        lane = self.lane_for(mtype)
+        try:
+            lane.put((handler, (private_key, sender_id, msg_id, mtype, params,
+                                extra)))
+        except Queue.Full:
+            warn("%s lane is full, rejecting %s %s" % (lane.name, mtype,
+                                                       msg_id))
+            if self.on_reject is not None:
+                self.on_reject(msg_id, mtype)
+
+    def wrap(self, handler):
+        """
+        Returns a SAMP call callback that dispatches to handler.
+        """
+        def receive_call(private_key, sender_id, msg_id, mtype, params, extra):
+            self.dispatch(handler, private_key, sender_id, msg_id, mtype,
+                          params, extra)
+        return functools.wraps(handler)(receive_call)
+
+    def shutdown(self):
+        self.cheap.shutdown()
+        self.costly.shutdown()
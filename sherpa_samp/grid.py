@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Statistic grids for spectrum.fit.calc.statistic.values
+#
+## A grid is a list of parameter names and an (npoints, npars) array of
+## values.  It is sent either as the historical list of maps,
+##
+##   "params" : [ {"p1.gamma" : "1.0", "p1.ampl" : "2.0"}, ... ]
+##
+## where a parameter missing from a map keeps its previous value, or by
+## columns,
+##
+##   "grid" : { "parnames" : ["p1.gamma", "p1.ampl"],
+##              "values"   : [<encoded array>, <encoded array>] }
+#
+
+import numpy
+
+from sherpa_samp.transport import decode_array
+
+__all__ = ('read_grid', 'fill_grid', 'split_grid', 'calc_stat_grid',
+           'map_grid')
+
+
+def read_grid(params):
+    """
+    (parnames, values) of the grid in params, values missing from the
+    list-of-maps form are NaN until fill_grid() is applied.
+    """
+    if params.has_key("grid"):
+        grid = params["grid"]
+        parnames = [str(name) for name in grid["parnames"]]
+        columns = [decode_array(col, native=True) for col in grid["values"]]
+        if not columns:
+            return parnames, numpy.empty((0, 0))
+        return parnames, numpy.column_stack(columns).astype(numpy.float64)
+
+    parnames = []
+    for pardict in params["params"]:
+        for parkey in pardict.keys():
+            if parkey not in parnames:
+                parnames.append(parkey)
+
+    index = dict((name, ii) for ii, name in enumerate(parnames))
+    values = numpy.empty((len(params["params"]), len(parnames)))
+    values.fill(numpy.nan)
+    for row, pardict in enumerate(params["params"]):
+        for parkey in pardict.keys():
+            values[row, index[parkey]] = float(pardict[parkey])
+    return parnames, values
+
+
+def fill_grid(values, initial):
+    """
+    Replace NaN entries by the previous value of the same parameter,
+    starting from initial, like successive set_par calls would.
+    """
+    values = numpy.array(values, dtype=numpy.float64)
+    current = numpy.array(initial, dtype=numpy.float64)
+    for row in values:
+        mask = numpy.isnan(row)
+        row[mask] = current[mask]
+        current = row
+    return values
+
+
+def split_grid(values, chunksize):
+    chunksize = max(1, int(chunksize))
+    return [values[start:start + chunksize]
+            for start in range(0, len(values), chunksize)]
+
+
+def calc_stat_grid(ui, parnames, values):
+    """
+    Statistic of every row of values.  The fit object, and so the filtered
+    data and model expression, is built once for the whole grid.  Runs
+    under the lock of ui and leaves the parameter values as they were.
+    """
+    with ui.lock:
+        session = ui.session
+        pars = [session.get_par(name) for name in parnames]
+        initial = [par.val for par in pars]
+        ids, fit = session._get_fit(None)
+
+        statvals = numpy.empty(len(values))
+        try:
+            for row, parvals in enumerate(values):
+                for par, val in zip(pars, parvals):
+                    par.val = val
+                statvals[row] = fit.calc_stat()
+        finally:
+            for par, val in zip(pars, initial):
+                par.val = val
+    return statvals
+
+
+def map_grid(pool, key, task, argslist):
+    """
+    Results of task over argslist on the worker pool, in order, as they
+    are needed.  The tasks are all submitted with key, once one of them
+    fails the others are cancelled before the error is raised, so that
+    none is left reading the shared arrays of the grid.
+    """
+    pending = [pool.submit(task, args, key) for args in argslist]
+    try:
+        for chunk in pending:
+            yield chunk.get()
+    except Exception:
+        pool.cancel(key)
+        raise
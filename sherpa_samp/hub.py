@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Outbound calls to the SAMP hub
+#
+## SAMPIntegratedClient talks to the hub through one xmlrpclib proxy, and
+## so one httplib connection, for all threads; concurrent use of it is what
+## raises CannotSendRequest and ResponseNotReady.  HubConnection gives every
+## thread a proxy, and a keep-alive HTTP/1.1 connection, of its own.
+#
+
+import socket
+import threading
+import xmlrpclib
+from httplib import CannotSendRequest, ResponseNotReady, HTTPException
+
+import logging
+logger = logging.getLogger(__name__)
+info = logger.info
+warn = logger.warning
+
+__all__ = ('HubConnection',)
+
+# errors after which a connection is dropped and the call made once more
+# on a new one
+_connection_errors = (CannotSendRequest, ResponseNotReady, HTTPException,
+                      socket.error)
+
+
+class HubConnection(object):
+    """
+    The hub methods used to answer calls, with the private key of the
+    client filled in.  Each thread calling them gets its own proxy with a
+    persistent connection to url.
+    """
+
+    def __init__(self, url, private_key):
+        self.url = url
+        self.private_key = private_key
+        self._local = threading.local()
+        self._proxies = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_client(cls, cli):
+        """
+        Connection for a registered SAMPIntegratedClient, to the hub of
+        its lockfile.
+        """
+        return cls(cli.hub.lockfile["samp.hub.xmlrpc.url"],
+                   cli.getPrivateKey())
+
+    def _proxy(self):
+        proxy = getattr(self._local, "proxy", None)
+        if proxy is None:
+            proxy = xmlrpclib.ServerProxy(self.url, allow_none=1)
+            self._local.proxy = proxy
+            with self._lock:
+                self._proxies.append(proxy)
+        return proxy
+
+    def _drop(self):
+        proxy = getattr(self._local, "proxy", None)
+        if proxy is None:
+            return
+        self._local.proxy = None
+        with self._lock:
+            if proxy in self._proxies:
+                self._proxies.remove(proxy)
+        try:
+            proxy("close")()
+        except Exception:
+            pass
+
+    def _invoke(self, method, *args):
+        try:
+            return getattr(self._proxy().samp.hub, method)(*args)
+        except _connection_errors, e:
+            warn("hub connection lost (%s), reconnecting" % str(e))
+            self._drop()
+            return getattr(self._proxy().samp.hub, method)(*args)
+
+    def call(self, method, *args):
+        """
+        samp.hub.<method>(private_key, *args)
+        """
+        return self._invoke(method, self.private_key, *args)
+
+    def ping(self):
+        """
+        samp.hub.ping(), the one hub method without a private key.
+        """
+        return self._invoke("ping")
+
+    def reply(self, msg_id, response):
+        return self.call("reply", msg_id, response)
+
+    def notify(self, recipient_id, message):
+        return self.call("notify", recipient_id, message)
+
+    def notify_all(self, message):
+        return self.call("notifyAll", message)
+
+    def connections(self):
+        with self._lock:
+            return len(self._proxies)
+
+    def close(self):
+        with self._lock:
+            proxies, self._proxies = self._proxies, []
+        for proxy in proxies:
+            try:
+                proxy("close")()
+            except Exception:
+                pass
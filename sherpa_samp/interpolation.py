@@ -19,9 +19,13 @@
 __author__="olaurino"
 __date__ ="$Feb 4, 2013 11:14:06 PM$"
 
+import threading
+
 from scipy import interpolate
-from numpy import array, mean
+from numpy import (asarray, ascontiguousarray, unique, bincount, searchsorted,
+                   clip, arange, empty, nan, newaxis)
 from sherpa_samp.log import logfile
+from sherpa_samp.cache import LRUCache, hash_spec
 
 import logging
 
@@ -40,32 +44,177 @@ def spline_interp(xout, xin, yin):
     tck = interpolate.splrep(xin, yin, s=0.0)
     return interpolate.splev(xout, tck, der=0)
 
+def average_duplicates(xin, yin):
+    """
+    Sorted unique x values and the mean of the y values at each of them.
+    """
+    xin = asarray(xin, dtype=float).ravel()
+    yin = asarray(yin, dtype=float).ravel()
+    x, inverse = unique(xin, return_inverse=True)
+    if x.size == xin.size:
+        # no duplicates, just sort
+        y = yin.copy()
+        y[inverse] = yin
+        return x, y
+    sums = bincount(inverse, weights=yin, minlength=x.size)
+    counts = bincount(inverse, minlength=x.size)
+    return x, sums / counts
+
 def interp1d(xout, xin, yin):
-    info('interp1d: sorting dataset')
-    xin, yin = (list(x) for x in zip(*sorted(zip(xin, yin), key=lambda pair: pair[0])))
-
-    ds={}
-
-    info('interp1d: computing averages')
-    for x,y in zip(xin,yin):
-        if ds.has_key(x):
-            ds[x].append(y)
-        else:
-            ds[x]=[y,]
-
-    x=[]
-    y=[]
-    for (k,v) in ds.iteritems():
-        x.append(k)
-        y.append(mean(v))
-
-    x=array(x)
-    y=array(y)
-
-    x, y = (list(xin) for xin in zip(*sorted(zip(x, y), key=lambda pair: pair[0])))
-    
-    info('interpolating')
-    f=interpolate.interp1d(x,y,bounds_error=False,kind='linear')
-    return f(xout)
-    
-    
+    return LinearSpline(xin, yin)(xout)
+
+def local_neville(xout, xin, yin, order=4):
+    """
+    Neville interpolation on the order input points around each output
+    point, rather than on all of them like sherpa.utils.neville.
+    """
+    return LocalNeville(xin, yin, order)(xout)
+
+#
+## Interpolants
+#
+## An interpolant is the part of an interpolation that only depends on the
+## input data, e.g. the spline coefficients, so that it can be evaluated on
+## several output grids.  InterpolantCache keeps them for repeated
+## spectrum.interpolate calls on the same SED.
+#
+
+class Interpolant(object):
+    """
+    function(xout, xin, yin) with xin and yin bound, for the functions
+    that have nothing to prepare.
+    """
+
+    def __init__(self, function, xin, yin):
+        self.function = function
+        self.xin = ascontiguousarray(xin, dtype=float)
+        self.yin = ascontiguousarray(yin, dtype=float)
+        self.nbytes = self.xin.nbytes + self.yin.nbytes
+
+    def __call__(self, xout):
+        return self.function(xout, self.xin, self.yin)
+
+class LinearSpline(object):
+    """
+    Linear interpolation of the data with duplicate x values averaged.
+    """
+
+    def __init__(self, xin, yin):
+        info('interp1d: computing averages')
+        x, y = average_duplicates(xin, yin)
+        self.f = interpolate.interp1d(x, y, bounds_error=False, kind='linear')
+        # interp1d keeps its own copies of x and y
+        self.nbytes = 2 * (x.nbytes + y.nbytes)
+
+    def __call__(self, xout):
+        info('interpolating')
+        return self.f(xout)
+
+class Spline(object):
+    """
+    The interpolating cubic spline of spline_interp.
+    """
+
+    def __init__(self, xin, yin):
+        self.tck = interpolate.splrep(xin, yin, s=0.0)
+        self.nbytes = self.tck[0].nbytes + self.tck[1].nbytes
+
+    def __call__(self, xout):
+        return interpolate.splev(xout, self.tck, der=0)
+
+class LocalNeville(object):
+    """
+    The interpolating polynomial through the order input points nearest
+    to each output point, evaluated with Neville's algorithm for all the
+    output points at once.  Duplicate x values are averaged, and the
+    windows found with searchsorted on the sorted data, so the cost is
+    O(order**2) per output point whatever the size of the SED.  Output
+    points outside the data are extrapolated from the window at the edge,
+    like sherpa.utils.neville does.
+    """
+
+    def __init__(self, xin, yin, order=4):
+        self.x, self.y = average_duplicates(xin, yin)
+        self.order = min(int(order), self.x.size)
+        self.nbytes = self.x.nbytes + self.y.nbytes
+
+    def __call__(self, xout):
+        xout = asarray(xout, dtype=float)
+        x = xout.ravel()
+        k = self.order
+        if k == 0:
+            result = empty(x.size)
+            result.fill(nan)
+            return result.reshape(xout.shape)
+
+        # the window of each point starts k/2 points before where it would
+        # be inserted in the data
+        start = searchsorted(self.x, x) - k // 2
+        clip(start, 0, self.x.size - k, out=start)
+        index = start[:, newaxis] + arange(k)
+        xs = self.x[index]
+        p = self.y[index]
+        x = x[:, newaxis]
+        for j in range(1, k):
+            left = xs[:, :k - j]
+            right = xs[:, j:]
+            p[:, :k - j] = ((x - right) * p[:, :k - j] +
+                            (left - x) * p[:, 1:k - j + 1]) / (left - right)
+        return p[:, 0].reshape(xout.shape)
+
+_interpolants = {
+    interp1d      : LinearSpline,
+    spline_interp : Spline,
+    local_neville : LocalNeville,
+    }
+
+def make_interpolant(function, xin, yin):
+    """
+    The interpolant of function(xout, xin, yin) for the given data.
+    """
+    cls = _interpolants.get(function)
+    if cls is None:
+        return Interpolant(function, xin, yin)
+    return cls(xin, yin)
+
+class InterpolantCache(object):
+    """
+    Interpolants keyed by a hash of the input data and the function, with
+    LRU eviction beyond maxbytes (by the nbytes of the interpolants) or
+    maxsize entries.
+    """
+
+    def __init__(self, maxbytes=64 << 20, maxsize=256):
+        self.cache = LRUCache(maxsize, maxbytes,
+                              sizeof=lambda interpolant: interpolant.nbytes)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(function, xin, yin):
+        name = "%s.%s" % (function.__module__, function.__name__)
+        return hash_spec({"function" : name,
+                          "x" : asarray(xin, dtype=float),
+                          "y" : asarray(yin, dtype=float)},
+                         keys=("function", "x", "y"))
+
+    def get(self, function, xin, yin):
+        """
+        The interpolant of function for xin and yin, made and stored
+        unless it is cached.
+        """
+        key = self.key(function, xin, yin)
+        interpolant = self.cache.get(key)
+        with self._lock:
+            if interpolant is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if interpolant is None:
+            interpolant = make_interpolant(function, xin, yin)
+            self.cache.put(key, interpolant)
+        return interpolant
+
+    def clear(self):
+        self.cache.clear()
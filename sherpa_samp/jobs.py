@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Registry of the fit and confidence jobs running on the worker pool
+#
+## A job is registered under the id of the client that sent the SAMP call
+## that started it and the msg_id of that call, which is only unique for
+## one client.  Its tasks are submitted with the same key.  Exactly one of the
+## handler running the job and the stop request replies to the call:
+## whichever changes the state of the job first, under the registry lock,
+## from RUNNING to DONE or STOPPED.
+##
+## Jobs may have a Budget.  A watchdog thread stops the jobs running past
+## their wall time or using more resident memory than allowed, the limit
+## on function evaluations is enforced inside the worker (see
+## sherpa_samp.tasks.watch_stat) which raises BudgetExceeded.
+#
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+info = logger.info
+warn = logger.warning
+error = logger.error
+
+__all__ = ('Job', 'JobRegistry', 'Budget', 'BudgetExceeded', 'RUNNING',
+           'DONE', 'STOPPED')
+
+RUNNING = "running"
+DONE = "done"
+STOPPED = "stopped"
+
+
+_page_size = 4096
+if hasattr(os, "sysconf"):
+    try:
+        _page_size = os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError):
+        pass
+
+
+def get_rss(pid):
+    """
+    Resident memory of process pid in bytes, None where /proc is not
+    available.
+    """
+    try:
+        with open("/proc/%d/statm" % pid) as fd:
+            return int(fd.read().split()[1]) * _page_size
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+class BudgetExceeded(Exception):
+
+    def __init__(self, msg=''):
+        Exception.__init__(self, msg)
+
+
+class Budget(object):
+    """
+    Limits of a job, None for no limit: walltime in seconds, nfev
+    evaluations of the statistic and rss megabytes of resident memory for
+    each of the worker processes running it.
+    """
+
+    def __init__(self, walltime=None, nfev=None, rss=None):
+        self.walltime = walltime
+        self.nfev = nfev
+        self.rss = rss
+
+    def __repr__(self):
+        return "Budget(walltime=%r, nfev=%r, rss=%r)" % (self.walltime,
+                                                         self.nfev, self.rss)
+
+    @staticmethod
+    def nfev_message(kind, nfev):
+        return "%s exceeded the budget of %d function evaluations" % (
+            kind.capitalize(), nfev)
+
+    def exceeded(self, job):
+        """
+        Why job is over this budget, None if it is not.
+        """
+        if self.walltime is not None and job.elapsed() > self.walltime:
+            return "%s exceeded the wall time budget of %g s" % (
+                job.kind.capitalize(), self.walltime)
+        if self.rss is not None:
+            for pid in job.pids():
+                rss = get_rss(pid)
+                if rss is not None and rss > self.rss * 1024 * 1024:
+                    return "%s exceeded the memory budget of %g MB" % (
+                        job.kind.capitalize(), self.rss)
+        return None
+
+
+class Job(object):
+    """
+    A call running on the worker pool.  pool is the WorkerPool the job's
+    tasks were submitted to, with key, (sender_id, msg_id), as their key.
+    """
+
+    def __init__(self, msg_id, sender_id, mtype, kind, pool, budget=None):
+        self.msg_id = msg_id
+        self.sender_id = sender_id
+        self.key = (sender_id, msg_id)
+        self.mtype = mtype
+        self.kind = kind
+        self.pool = pool
+        self.budget = budget
+        self.state = RUNNING
+        self.started = time.time()
+
+    @property
+    def stopped(self):
+        return self.state == STOPPED
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def pids(self):
+        return self.pool.pids(self.key)
+
+    def cancel(self):
+        return self.pool.cancel(self.key)
+
+    def describe(self):
+        return {"msg-id"    : self.msg_id,
+                "sender-id" : self.sender_id,
+                "mtype"     : self.mtype,
+                "kind"      : self.kind,
+                "state"     : self.state,
+                "started"   : repr(self.started),
+                "elapsed"   : repr(self.elapsed()),
+                "workers"   : [str(pid) for pid in self.pids()]}
+
+
+class JobRegistry(object):
+
+    def __init__(self):
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._watchdog = None
+
+    def start(self, msg_id, sender_id, mtype, kind, pool, budget=None):
+        job = Job(msg_id, sender_id, mtype, kind, pool, budget)
+        with self._lock:
+            self._jobs[job.key] = job
+        return job
+
+    def finish(self, job):
+        """
+        Mark job as done, unless it has been stopped in the meantime.
+        Returns whether the caller still has to reply.
+        """
+        with self._lock:
+            self._jobs.pop(job.key, None)
+            if job.state == RUNNING:
+                job.state = DONE
+            return job.state == DONE
+
+    def _select(self, sender_id, msg_id, kind):
+        if sender_id is not None and msg_id is not None:
+            jobs = []
+            if (sender_id, msg_id) in self._jobs:
+                jobs.append(self._jobs[(sender_id, msg_id)])
+        else:
+            jobs = self._jobs.values()
+        return [job for job in jobs
+                if (sender_id is None or job.sender_id == sender_id) and
+                   (msg_id is None or job.msg_id == msg_id) and
+                   (kind is None or job.kind == kind)]
+
+    def stop(self, sender_id=None, msg_id=None, kind=None):
+        """
+        Mark the matching running jobs as stopped and return them, the
+        caller replies to them and cancels their tasks.
+        """
+        with self._lock:
+            jobs = self._select(sender_id, msg_id, kind)
+            for job in jobs:
+                self._jobs.pop(job.key, None)
+                job.state = STOPPED
+        for job in jobs:
+            info("stopping %s job %s" % (job.kind, job.msg_id))
+        return jobs
+
+    def check(self):
+        """
+        Stop the jobs over their budget, returns a list of (job, reason).
+        """
+        over = []
+        for job in self.jobs():
+            if job.budget is None:
+                continue
+            reason = job.budget.exceeded(job)
+            if reason is not None:
+                over.append((job, reason))
+
+        stopped = []
+        with self._lock:
+            for job, reason in over:
+                if job.state == RUNNING:
+                    self._jobs.pop(job.key, None)
+                    job.state = STOPPED
+                    stopped.append((job, reason))
+        for job, reason in stopped:
+            warn("stopping %s job %s: %s" % (job.kind, job.msg_id, reason))
+        return stopped
+
+    def watch(self, on_exceeded, interval=1.0):
+        """
+        Start a thread that checks the budgets of the running jobs every
+        interval seconds and calls on_exceeded(job, reason) for each job
+        it stopped, which is then expected to reply and cancel it.
+        """
+        if self._watchdog is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    for job, reason in self.check():
+                        on_exceeded(job, reason)
+                except Exception, e:
+                    error("job watchdog: " + str(e))
+
+        self._watchdog = threading.Thread(target=run, name="sherpa-watchdog")
+        self._watchdog.daemon = True
+        self._watchdog.start()
+
+    def jobs(self, sender_id=None, kind=None):
+        with self._lock:
+            return self._select(sender_id, None, kind)
+
+    def __len__(self):
+        return len(self._jobs)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Deferred imports
+#
+## Importing sherpa.astro, astLib, scipy and sedstacker takes seconds, and
+## sherpa-samp only registers with the hub once its modules are imported.
+## LazyModule stands in for such a module and imports it on first
+## attribute access, Prewarm imports a list of them in a background thread
+## so that they are usually loaded before the first call that needs them.
+#
+
+import time
+import threading
+import importlib
+
+import logging
+logger = logging.getLogger(__name__)
+info = logger.info
+warn = logger.warning
+
+__all__ = ('LazyModule', 'Prewarm')
+
+_lock = threading.RLock()
+
+
+class LazyModule(object):
+    """
+    Module `name`, imported when one of its attributes is first used.
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def load(self):
+        module = self._module
+        if module is None:
+            with _lock:
+                module = self._module
+                if module is None:
+                    start = time.time()
+                    module = importlib.import_module(self._name)
+                    info("imported %s in %.2f s" % (self._name,
+                                                    time.time() - start))
+                    self.__dict__["_module"] = module
+        return module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return "<lazy module '%s' (%s)>" % (self._name, state)
+
+
+class Prewarm(object):
+    """
+    Runs the given steps, in order, in a daemon thread: a step is either a
+    LazyModule, which is loaded, or a callable.  Errors are only logged, an
+    import error is raised again for the call that uses the module.
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.done = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start loading, unless that was done before.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name="sherpa-prewarm")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        start = time.time()
+        try:
+            for step in self.steps:
+                try:
+                    if isinstance(step, LazyModule):
+                        step.load()
+                    else:
+                        step()
+                except Exception, e:
+                    warn("prewarm of %r failed: %s" % (step, str(e)))
+            info("prewarm finished in %.2f s" % (time.time() - start))
+        finally:
+            self.done.set()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
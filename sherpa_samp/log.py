@@ -18,7 +18,11 @@
 #  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 #
 
+import os
 from os.path import expanduser, join
 home = expanduser("~")
 logfile = join(home, ".vao", "iris", "SherpaSAMP.log")
 
+
+# on-disk tier of the fit result cache, disabled unless set
+fit_cache_dir = os.environ.get("SHERPA_SAMP_FIT_CACHE_DIR")
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Per-mtype latency metrics
+#
+## Every call goes through these phases, each of which is recorded in a
+## histogram per mtype:
+##
+##   queue    from its arrival until a dispatcher thread picks it up
+##   decode   decoding arrays of the request (functions marked @timed)
+##   encode   encoding arrays of the reply
+##   compute  the rest of the time spent in the handler
+##   reply    from queueing the reply until the hub accepted it
+##
+## Calls are also counted by outcome: "ok", or the exception class of the
+## error reply.  Decoding and encoding done by worker processes is part of
+## compute, only the handler thread is instrumented.
+#
+
+import os
+import json
+import time
+import bisect
+import tempfile
+import functools
+import threading
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+info = logger.info
+warn = logger.warning
+
+__all__ = ('Histogram', 'Metrics', 'timed', 'phases')
+
+phases = ("queue", "decode", "compute", "encode", "reply")
+
+# upper bounds of the histogram buckets in seconds, 10 us up to ~6 hours
+_bounds = [1.e-5 * 2 ** ii for ii in range(32)]
+
+
+class Histogram(object):
+    """
+    Durations in exponential buckets, percentiles are the upper bound of
+    the bucket they fall in.
+    """
+
+    def __init__(self, bounds=_bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                if index == len(self.bounds):
+                    break
+                return min(self.bounds[index], self.max)
+        return self.max
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def snapshot(self):
+        return {"count" : self.count,
+                "total" : self.total,
+                "mean"  : self.mean(),
+                "p50"   : self.percentile(50),
+                "p95"   : self.percentile(95),
+                "p99"   : self.percentile(99),
+                "max"   : self.max}
+
+
+class _Call(object):
+
+    def __init__(self, mtype):
+        self.mtype = mtype
+        self.times = {"decode" : 0.0, "encode" : 0.0}
+        self.active = False
+
+
+_current = threading.local()
+
+
+def timed(phase):
+    """
+    Decorator adding the time spent in the function to `phase` of the call
+    the thread is handling, if any.  Nested timed functions only count
+    once.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            call = getattr(_current, "call", None)
+            if call is None or call.active:
+                return func(*args, **kwargs)
+            call.active = True
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                call.times[phase] += time.time() - start
+                call.active = False
+        return wrapper
+    return decorate
+
+
+class Metrics(object):
+    """
+    Histograms of the phases and counts of the outcomes of the calls, by
+    mtype.  received() is called when a call arrives, instrument() wraps
+    its handler, replied() and outcome() are called for its reply.
+    """
+
+    # calls remembered between received() and replied()
+    max_calls = 4096
+
+    def __init__(self):
+        self.started = time.time()
+        self._histograms = {}
+        self._outcomes = {}
+        self._calls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, mtype, phase, seconds):
+        with self._lock:
+            key = (mtype, phase)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.add(max(0.0, seconds))
+
+    def received(self, msg_id, mtype):
+        with self._lock:
+            self._calls[msg_id] = (mtype, time.time())
+            while len(self._calls) > self.max_calls:
+                self._calls.popitem(last=False)
+
+    def instrument(self, handler):
+        """
+        Wrap an mtype handler to record its queue wait and the time spent
+        decoding, computing and encoding.
+        """
+        @functools.wraps(handler)
+        def wrapper(private_key, sender_id, msg_id, mtype, params, extra):
+            start = time.time()
+            with self._lock:
+                arrival = self._calls.get(msg_id)
+            if arrival is not None:
+                self.observe(mtype, "queue", start - arrival[1])
+            call = _current.call = _Call(mtype)
+            try:
+                return handler(private_key, sender_id, msg_id, mtype, params,
+                               extra)
+            finally:
+                _current.call = None
+                total = time.time() - start
+                decode, encode = call.times["decode"], call.times["encode"]
+                self.observe(mtype, "decode", decode)
+                self.observe(mtype, "encode", encode)
+                self.observe(mtype, "compute", total - decode - encode)
+        return wrapper
+
+    def replied(self, msg_id, seconds):
+        """
+        The reply to msg_id reached the hub seconds after it was queued.
+        """
+        with self._lock:
+            arrival = self._calls.pop(msg_id, None)
+        if arrival is not None:
+            self.observe(arrival[0], "reply", seconds)
+
+    def outcome(self, mtype, name="ok"):
+        with self._lock:
+            counts = self._outcomes.setdefault(mtype, {})
+            counts[name] = counts.get(name, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._histograms.clear()
+            self._outcomes.clear()
+
+    def snapshot(self):
+        """
+        {"uptime" : seconds, "mtypes" : {mtype : {"calls" : {outcome :
+        count}, phase : histogram snapshot}}}
+        """
+        with self._lock:
+            mtypes = {}
+            for (mtype, phase), histogram in self._histograms.iteritems():
+                mtypes.setdefault(mtype, {})[phase] = histogram.snapshot()
+            for mtype, counts in self._outcomes.iteritems():
+                mtypes.setdefault(mtype, {})["calls"] = dict(counts)
+            return {"uptime" : time.time() - self.started,
+                    "mtypes" : mtypes}
+
+    def dump(self, path, extra=None):
+        """
+        Write the snapshot, and the extra fields, to path as JSON.
+        """
+        snapshot = self.snapshot()
+        snapshot["time"] = time.time()
+        if extra:
+            snapshot.update(extra)
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(prefix=".sherpa-stats-", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as out:
+                json.dump(snapshot, out, indent=1, sort_keys=True)
+            os.rename(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def dump_every(self, path, interval=60.0, extra=None):
+        """
+        Dump to path every interval seconds from a daemon thread, extra is
+        a callable returning more fields to write.
+        """
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path, extra() if extra is not None else None)
+                except Exception, e:
+                    warn("cannot write stats to %s: %s" % (path, str(e)))
+
+        thread = threading.Thread(target=run, name="sherpa-stats")
+        thread.daemon = True
+        thread.start()
+        return thread
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Hub connection monitor
+#
+## A hub announces itself through its lockfile (~/.samp, or the file named
+## by SAMP_HUB).  HubMonitor watches that file, with inotify when pyinotify
+## is installed and by polling its stat() otherwise, and only talks to the
+## hub when the file changes or, while connected, every check_interval
+## seconds.  When the connection is lost it reconnects with exponential
+## backoff.  The `connected` event is set while the client is registered,
+## the dispatcher and the reply threads wait on it.
+#
+
+import os
+import time
+import random
+import threading
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+import logging
+logger = logging.getLogger(__name__)
+info = logger.info
+warn = logger.warning
+
+__all__ = ('HubMonitor', 'lockfile_path')
+
+
+def lockfile_path():
+    """
+    Path of the lockfile of the standard profile hub.
+    """
+    hub = os.environ.get("SAMP_HUB", "")
+    if hub.startswith("std-lockurl:"):
+        url = hub[len("std-lockurl:"):]
+        if url.startswith("file://"):
+            return url[len("file://"):]
+    return os.path.join(os.path.expanduser("~"), ".samp")
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+class HubMonitor(object):
+    """
+    Keeps the client connected.  connect() registers with the hub that is
+    running, is_connected() tells whether that still holds, both are
+    called from the thread running run() only.
+    """
+
+    def __init__(self, connect, is_connected, lockfile=None, connected=None,
+                 poll_interval=2.0, check_interval=30.0, timeout=60.0,
+                 base=0.25, cap=8.0):
+        self.connect = connect
+        self.is_connected = is_connected
+        self.lockfile = lockfile or lockfile_path()
+        self.connected = connected or threading.Event()
+        self.poll_interval = poll_interval
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.base = base
+        self.cap = cap
+        self._wake = threading.Event()
+        self._stopped = False
+        self._notifier = None
+
+    def changed(self):
+        """
+        The lockfile changed, look at the hub now.
+        """
+        self._wake.set()
+
+    def _watch(self):
+        if pyinotify is not None:
+            try:
+                self._inotify()
+                return
+            except Exception, e:
+                warn("cannot watch %s with inotify: %s" % (self.lockfile,
+                                                           str(e)))
+        thread = threading.Thread(target=self._poll, name="sherpa-hub-poll")
+        thread.daemon = True
+        thread.start()
+
+    def _inotify(self):
+        directory, name = os.path.split(self.lockfile)
+        monitor = self
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if event.name == name:
+                    monitor.changed()
+
+        manager = pyinotify.WatchManager()
+        mask = (pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_MOVED_FROM)
+        manager.add_watch(directory, mask)
+        self._notifier = pyinotify.ThreadedNotifier(manager, Handler())
+        self._notifier.daemon = True
+        self._notifier.start()
+
+    def _poll(self):
+        last = _signature(self.lockfile)
+        while not self._stopped:
+            time.sleep(self.poll_interval)
+            current = _signature(self.lockfile)
+            if current != last:
+                last = current
+                self.changed()
+
+    def _wait(self, timeout):
+        self._wake.wait(timeout)
+        self._wake.clear()
+
+    def run(self):
+        """
+        Monitor the hub until stop() is called, or until no hub has been
+        reachable for timeout seconds.  Returns whether it was stopped.
+        """
+        self._watch()
+        attempts = 0
+        lost = time.time()
+        while not self._stopped:
+            if not self.connected.is_set():
+                try:
+                    self.connect()
+                    self.connected.set()
+                    attempts = 0
+                    info("connected to the hub")
+                    continue
+                except Exception, e:
+                    attempts += 1
+                    warn("cannot connect to the hub (attempt %d): %s" %
+                         (attempts, str(e)))
+                if time.time() - lost > self.timeout:
+                    warn("no hub for %g s, giving up" % self.timeout)
+                    return False
+                delay = min(self.cap, self.base * 2 ** attempts)
+                # a new lockfile cuts the wait short
+                self._wait(random.uniform(delay / 2, delay))
+                continue
+
+            self._wait(self.check_interval)
+            if self._stopped:
+                break
+            try:
+                ok = self.is_connected()
+            except Exception, e:
+                warn("hub check failed: " + str(e))
+                ok = False
+            if not ok:
+                warn("lost the hub connection")
+                self.connected.clear()
+                lost = time.time()
+        return True
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._notifier is not None:
+            self._notifier.stop()
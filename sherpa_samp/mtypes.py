@@ -21,24 +21,62 @@ from httplib import CannotSendRequest, ResponseNotReady
 
 import sys
 import time
+import socket
+import difflib
+import argparse
 import numpy
 import signal
+import threading
 import multiprocessing
 
 import sampy as samp
 
 import sherpa_samp.sedexceptions as sedexceptions
 import numpy as np
-from sherpa_samp.session import SherpaSession, check_for_nans
-from sherpa_samp.utils import encode_string, decode_string, capture_exception, DictionaryClass
-# from sherpa_samp.sed import Sed
-from astLib.astSED import Passband
-from sherpa.utils import linear_interp, neville, nearest_interp
-from sherpa_samp.interpolation import interp1d
-from sherpa_samp.sedstacker_iris.sed import normalize, redshift, stack
-from sedstacker.iris.sed import IrisSed, IrisStack
-from sherpa_samp.sed import Sed
-import sedstacker.sed
+from sherpa_samp.utils import encode_string, capture_exception, DictionaryClass
+from sherpa_samp.transport import decode_array, encode_array
+from sherpa_samp.pool import WorkerPool, JobError
+from sherpa_samp.dispatcher import Dispatcher
+from sherpa_samp.progress import ProgressBroadcaster
+from sherpa_samp.jobs import JobRegistry, Budget, BudgetExceeded
+from sherpa_samp.reply import ReplySender
+from sherpa_samp.hub import HubConnection
+from sherpa_samp.monitor import HubMonitor
+from sherpa_samp.cache import FitResultCache, WarmStartStore
+from sherpa_samp.grid import (read_grid, fill_grid, split_grid, calc_stat_grid,
+                              map_grid)
+from sherpa_samp.lazy import LazyModule, Prewarm
+from sherpa_samp.metrics import Metrics
+
+#
+## Subsystems
+#
+## Only the SAMP client and the dispatcher are imported eagerly, so that
+## sherpa-samp registers with the hub quickly.  Sherpa, astLib, scipy and
+## sedstacker are imported on first use, or by the prewarm thread started
+## once registered.
+#
+
+# fitting
+_session = LazyModule("sherpa_samp.session")
+_tasks = LazyModule("sherpa_samp.tasks")
+
+# SED tools
+_sed = LazyModule("sherpa_samp.sed")
+_astsed = LazyModule("astLib.astSED")
+_sherpa_utils = LazyModule("sherpa.utils")
+_interpolation = LazyModule("sherpa_samp.interpolation")
+
+# stacking
+_stacker_iris = LazyModule("sherpa_samp.sedstacker_iris.sed")
+_iris_sed = LazyModule("sedstacker.iris.sed")
+_sedstacker = LazyModule("sedstacker.sed")
+
+subsystems = {
+    "fitting"  : (_session, _tasks),
+    "sed"      : (_sed, _astsed, _sherpa_utils, _interpolation),
+    "stacking" : (_stacker_iris, _iris_sed, _sedstacker),
+    }
 
 #
 ## Logging
@@ -46,7 +84,7 @@ import sedstacker.sed
 
 import logging
 
-from sherpa_samp.log import logfile
+from sherpa_samp.log import logfile, fit_cache_dir
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO,
@@ -67,11 +105,102 @@ metadata = {
     "samp.documentation.url" : "http://cxc.harvard.edu/sherpa"
     }
 
-cli = samp.SAMPIntegratedClient(metadata, addr='localhost')
+# created by main()
+cli = None
+
+
+# fit, confidence and statistic grid calls running on the worker pool, by
+# msg_id
+_jobs = JobRegistry()
+
+# Limits of the jobs of each mtype, the defaults can be given on the
+# command line of sherpa-samp (see main).
+_budgets = {
+    "spectrum.fit.fit"        : Budget(),
+    "spectrum.fit.fit.batch"  : Budget(),
+    "spectrum.fit.confidence" : Budget(),
+    "spectrum.fit.calc.statistic.values" : Budget(),
+    }
+
+# replies to the calls of stopped jobs, by job kind
+_stop_errors = {
+    "fit"        : (sedexceptions.FitException, "Fitting stopped"),
+    "confidence" : (sedexceptions.ConfidenceException, "Confidence stopped"),
+    "grid"       : (sedexceptions.StatisticException, "Statistic grid stopped"),
+    }
+
+# SherpaSession per SAMP client, for the spectrum.fit.set.* mtypes, see
+# get_sessions()
+_sessions = None
+_sessions_lock = threading.Lock()
+
+# interpolants of the SEDs of spectrum.interpolate, see get_interpolants()
+_interpolants = None
+_interpolants_lock = threading.Lock()
+
+# spectrum.interpolate evaluates grids of at least this many bins in chunks,
+# see Sed.iter_interpolate
+interpolate_stream_bins = 1 << 18
+
+# get_fit_results() of previous fits, by content hash of the session
+_fit_cache = FitResultCache(maxsize=256, directory=fit_cache_dir)
+
+# best-fit parameters per client and model, for "warmstart" : "true"
+_warm_starts = WarmStartStore(maxsize=64)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sessions():
+    """
+    The SessionCache of the SAMP clients, made on first use.
+    """
+    global _sessions
+    with _sessions_lock:
+        if _sessions is None:
+            _sessions = _session.SessionCache(maxsize=16, timeout=3600.0)
+    return _sessions
+
+
+def get_interpolants():
+    """
+    The InterpolantCache of spectrum.interpolate, made on first use.
+    """
+    global _interpolants
+    with _interpolants_lock:
+        if _interpolants is None:
+            _interpolants = _interpolation.InterpolantCache()
+    return _interpolants
+
+
+# Progress events of the workers are broadcast at most this many times per
+# second for each job.
+progress_maxrate = 2.0
+_progress = None
+
+
+def get_worker_pool():
+    """
+    The pool of pre-forked workers for fits and confidence, started on
+    first use.
+    """
+    global _pool, _progress
+    with _pool_lock:
+        if _pool is None:
+            # the workers inherit the progress pipe when they are forked
+            _progress = ProgressBroadcaster(send_progress, progress_maxrate)
+            _pool = WorkerPool(initializer=_tasks.warm_up)
+            _jobs.watch(_budget_exceeded)
+    return _pool
 
 
-_fitting_tasks = []
-_confidence_tasks = []
+# Loaded in the background once registered with the hub: fitting first,
+# with the worker pool forked after it so that the workers inherit Sherpa,
+# then the SED tools and stacking.
+_prewarm = Prewarm(subsystems["fitting"] + (get_worker_pool,) +
+                   subsystems["sed"] + subsystems["stacking"])
+prewarm_enabled = True
 
 
 def _sig_handler(signum, frame):
@@ -99,38 +228,105 @@ except ValueError:
     sys.exit(1)
 
 
+# Latency of the phases of every call and counts of their outcomes, by
+# mtype, see sherpa.stats
+_metrics = Metrics()
+
+# Set while registered with a hub, calls and replies wait for it
+_connected = threading.Event()
+
+# Connections of our own to the hub for replies and notifications, one
+# per thread, set up once registered.  Until then cli is used.
+_hub = None
+
+
+def connect_hub():
+    global _hub
+    if _hub is not None:
+        _hub.close()
+        _hub = None
+    try:
+        _hub = HubConnection.from_client(cli)
+    except Exception, e:
+        warn("cannot open hub connections, using the client's: " + str(e))
+
+
+def _send_reply(msg_id, response):
+    if _hub is not None:
+        _hub.reply(msg_id, response)
+    else:
+        cli.reply(msg_id, response)
+
+
+# Replies are sent by threads of their own, the handlers only queue them.
+_replies = ReplySender(_send_reply,
+                       retryable=(CannotSendRequest, ResponseNotReady,
+                                  socket.error),
+                       retries=8, threads=4, gate=_connected,
+                       on_sent=_metrics.replied)
+
+
+def _queue_reply(msg_id, response):
+    _replies.put(msg_id, response, _dispatcher.sender_of(msg_id, forget=True))
+
+
 def reply_success(msg_id, mtype, params={}):
-    for i in range(0, 100):
-        try:
-            cli.reply(msg_id, {"samp.status": samp.SAMP_STATUS_OK,
-                   "samp.result": params,
-                   })
-            info("sent reply_success to " + msg_id)
-        except (CannotSendRequest, ResponseNotReady) as e:
-            warn("cannot send request:")
-            logging.exception(e)
-            continue
-        break
+    _metrics.outcome(mtype)
+    _queue_reply(msg_id, {"samp.status": samp.SAMP_STATUS_OK,
+                          "samp.result": params,
+                          })
+    info("queued reply_success to " + msg_id)
 
 def reply_error(msg_id, exception, e, mtype):
+    _metrics.outcome(mtype, e.__class__.__name__)
 
     errtrace = capture_exception()
     logger.exception(e)
     #error(errtrace)
-    cli.reply(msg_id, {"samp.status": samp.SAMP_STATUS_ERROR,
+    _queue_reply(msg_id, {"samp.status": samp.SAMP_STATUS_ERROR,
     #cli.reply(msg_id, {"samp.status": "samp.notok",
-                       "samp.result": {"exception": str(exception.__name__),
-                                       "message": str(e) #str(errtrace)
-                                       },
-                       "samp.error" : {"samp.errortxt" : "Sherpa exception"},
-                       })
-    info("sent reply_error to " + msg_id)
+                          "samp.result": {"exception": str(exception.__name__),
+                                          "message": str(e) #str(errtrace)
+                                          },
+                          "samp.error" : {"samp.errortxt" : "Sherpa exception"},
+                          })
+    info("queued reply_error to " + msg_id)
     #cli.disconnect()
     #sys.exit(1)
 
 
-def notify(mtype, msg):
-    cli.enotifyAll(mtype, message = msg)
+def broadcast(mtype, params):
+    message = {"samp.mtype": mtype, "samp.params": params}
+    if _hub is not None:
+        _hub.notify_all(message)
+    else:
+        cli.notifyAll(message)
+
+
+def send_progress(record):
+    """
+    Broadcast a record of sherpa_samp.progress.  Fit updates are fit
+    events.  For confidence, the lines Sherpa logged are confidence events
+    with the "message" Iris shows, as before, and statistic updates are
+    confidence progress notifications of their own.
+    """
+    params = {"msg-id": record["key"]}
+    if record.has_key("iteration"):
+        params["iteration"] = str(record["iteration"])
+        params["statval"] = repr(record["statval"])
+    if record.has_key("parvals"):
+        params["parnames"] = record["parnames"]
+        params["parvals"] = encode_string(np.array(record["parvals"]))
+
+    if record["kind"] == "confidence":
+        if record["messages"]:
+            broadcast(MTYPE_SPECTRUM_FIT_CONFIDENCE_EVENT,
+                      {"msg-id": record["key"],
+                       "message": "\n".join(record["messages"])})
+        if record.has_key("iteration"):
+            broadcast(MTYPE_SPECTRUM_FIT_CONFIDENCE_PROGRESS, params)
+    else:
+        broadcast(MTYPE_SPECTRUM_FIT_FIT_EVENT, params)
 
     #cli.notify
 
@@ -192,7 +388,7 @@ def load_table_fits(private_key, sender_id, msg_id, mtype, params, extra):
     """
     try:
         info("load_table_fits()")
-        ui = SherpaSession()
+        ui = _session.SherpaSession()
 
         try:
             # native Sherpa command
@@ -217,10 +413,11 @@ def spectrum_fit_set_data(private_key, sender_id, msg_id, mtype, params, extra):
     """
     try:
         info("spectrum_fit_set_data()")
-        ui = SherpaSession()
+        ui = get_sessions().get(sender_id)
 
         try:
-            ui.set_data(params["datasets"])
+            with ui.lock:
+                ui.set_data(params["datasets"])
 
         except Exception, e:
             reply_error(msg_id, sedexceptions.DataException, e, mtype)
@@ -243,20 +440,22 @@ def spectrum_fit_set_model(private_key, sender_id, msg_id, mtype, params,
     """
     try:
         info("spectrum_fit_set_model()")
-        ui = SherpaSession()
+        ui = get_sessions().get(sender_id)
 
         try:
             usermodels = []
             if (params.has_key("usermodels")):
                 usermodels = params["usermodels"]
-            ui.set_parameters(params["models"], usermodels)
+            with ui.lock:
+                ui.set_parameters(params["models"], usermodels)
 
         except Exception, e:
             reply_error(msg_id, sedexceptions.ParameterException, e, mtype)
             return
 
         try:
-            ui.set_model(params["models"])
+            with ui.lock:
+                ui.set_model(params["models"])
 
         except Exception, e:
             reply_error(msg_id, sedexceptions.ModelException, e, mtype)
@@ -278,10 +477,11 @@ def spectrum_fit_set_statistic(private_key, sender_id, msg_id, mtype, params,
     """
     try:
         info("spectrum_fit_set_statistic()")
-        ui = SherpaSession()
+        ui = get_sessions().get(sender_id)
 
         try:
-            ui.set_stat(params["stat"])
+            with ui.lock:
+                ui.set_stat(params["stat"])
 
         except Exception, e:
             reply_error(msg_id, sedexceptions.StatisticException, e, mtype)
@@ -303,10 +503,11 @@ def spectrum_fit_set_method(private_key, sender_id, msg_id, mtype, params,
     """
     try:
         info("spectrum_fit_set_method()")
-        ui = SherpaSession()
+        ui = get_sessions().get(sender_id)
 
         try:
-            ui.set_method(params["method"])
+            with ui.lock:
+                ui.set_method(params["method"])
 
         except Exception, e:
             reply_error(msg_id, sedexceptions.MethodException, e, mtype)
@@ -328,10 +529,11 @@ def spectrum_fit_set_confidence(private_key, sender_id, msg_id, mtype, params,
     """
     try:
         info("spectrum_fit_set_confidence()")
-        ui = SherpaSession()
+        ui = get_sessions().get(sender_id)
 
         try:
-            ui.set_confidence(params["confidence"])
+            with ui.lock:
+                ui.set_confidence(params["confidence"])
 
         except Exception, e:
             reply_error(msg_id, sedexceptions.ConfidenceException, e, mtype)
@@ -346,34 +548,6 @@ def spectrum_fit_set_confidence(private_key, sender_id, msg_id, mtype, params,
 
 
 
-def fit_worker(func, outq, errq):
-    try:
-        results = func()
-        outq.put(results)
-
-    except Exception:
-        e = capture_exception()
-        errq.put(e)
-        outq.put(None)
-
-
-def conf_worker(func, outq, errq):
-    try:
-
-        #confoutput = logging.StreamHandler()
-        # confoutput = ConfStreamHandler(sys.stderr)
-        # confoutput.setLevel(logging.INFO)
-        # logger.addHandler(confoutput)
-
-        results = func()
-        outq.put(results)
-
-    except Exception:
-        e = capture_exception()
-        errq.put(e)
-        outq.put(None)
-
-
 def spectrum_fit_fit(private_key, sender_id, msg_id, mtype, params, extra):
     """
     spectrum_fit_fit
@@ -382,56 +556,58 @@ def spectrum_fit_fit(private_key, sender_id, msg_id, mtype, params, extra):
     """
     try:
         info("spectrum_fit_fit()")
-        ui = SherpaSession()
-
-        info("ui session _sources: " + str(ui.session._sources))
-        info("ui session _models: " + str(ui.session._models))
-        info("ui session _model_components: " + str(ui.session._model_components))
-        info("ui session _data: " + str(ui.session._data))
-
-        try:
-            ui.set_method(params["method"])
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.MethodException, e, mtype)
-            return
+        # the session the client built up with spectrum.fit.set.* and
+        # earlier calls, brought up to date with what this call sends
+        ui = get_sessions().get(sender_id)
+        sent = params.keys()
+        params = ui.get_spec(params)
 
-        try:
-            ui.set_data(params["datasets"])
+        with ui.lock:
+            info("ui session _sources: " + str(ui.session._sources))
+            info("ui session _models: " + str(ui.session._models))
+            info("ui session _model_components: " + str(ui.session._model_components))
+            info("ui session _data: " + str(ui.session._data))
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.DataException, e, mtype)
-            return
+            try:
+                ui.update(params, sent, filter_nans=True)
 
-        try:
-            usermodels = []
-            if (params.has_key("usermodels")):
-                usermodels = params["usermodels"]
-            ui.set_parameters(params["models"], usermodels)
+            except sedexceptions.SEDException, e:
+                reply_error(msg_id, e.__class__, e, mtype)
+                return
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ParameterException, e, mtype)
+            spec = ui.get_spec()
+
+        # Results are cached by the spec as the client sent it.  A warm
+        # start only changes the initial values of the fit in the worker,
+        # its results are stored under the same key.
+        warmstart = str(params.get("warmstart", "false")).lower() == "true"
+        key = _fit_cache.key(spec)
+        results = _fit_cache.get(key)
+        if results is not None:
+            info("fit results found in cache")
+            if warmstart:
+                results["warmstart"] = "0"
+            reply_success(msg_id, mtype, results)
             return
 
-        try:
-            ui.set_model(params["models"])
-
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ModelException, e, mtype)
-            return
+        seeded = False
+        if warmstart:
+            try:
+                seeded = _warm_starts.seed(sender_id, spec["models"])
+            except Exception, e:
+                reply_error(msg_id, sedexceptions.ParameterException, e, mtype)
+                return
 
+        # The worker rebuilds its own session from the spec recorded by the
+        # set_* calls above, around the decoded data in shared memory.
+        job = None
+        refs = []
         try:
-            ui.set_stat(params["stat"])
-
-            check_for_nans(ui)
-
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.StatisticException, e, mtype)
-            return
+            spec, refs = _session.share_spec(spec)
 
-        results = None
-
-        try:
+            job = _jobs.start(msg_id, sender_id, mtype, "fit",
+                              get_worker_pool(), _budgets[mtype])
 
             # native Sherpa command
             # tt = time.time()
@@ -439,70 +615,32 @@ def spectrum_fit_fit(private_key, sender_id, msg_id, mtype, params, extra):
             # print 'fit in', (time.time() - tt)
             # results = ui.get_fit_results()
 
-            outq = multiprocessing.Queue()
-            errq = multiprocessing.Queue()
-
-            def worker(ui_p):
-                try:
-                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
-                    ui_p.session.fit()
-                    results = ui_p.get_fit_results()
-                    outq.put(results)
-                except Exception, e:
-                    trace = capture_exception()
-                    msg = str(trace)
-                    if e.args:
-                        msg = e.args[0]
-                    errq.put( (msg, trace) )
-                    outq.put(None)
-
-            fit_task = multiprocessing.Process(target=worker, args=(ui,))
-
-            global _fitting_tasks
-            _fitting_tasks.append((fit_task, msg_id, mtype))
-
             tt = time.time()
-            fit_task.start()
-            #print 'fit PID', os.getpid()
-            fit_task.join()
-            print 'fit in', (time.time() - tt)
-
-            #_fitting_tasks.remove((fit_task, msg_id, mtype))
             try:
-                _fitting_tasks.pop(-1)
-            except IndexError:
-                pass
-
-            if not errq.empty():
-                msg, traceback = errq.get()
-                error(traceback)
-                raise Exception(msg)
-
-            results = outq.get()
-
-            # ids, fitobj = sherpa._session._get_fit(None)
-            # fit_task = multiprocessing.Process(target=fit_worker,
-            #                                    args=(fitobj.fit, outq, errq))
-
-            # # FIXME: this needs to be thread safe!
-            # _fitting_tasks.append(fit_task)
-
-            # tt = time.time()
-            # fit_task.start()
-            # #print 'fit PID: ', os.getpid() 
-            # pid = os.getpid()
-            # fit_task.join()
-            # print 'fit', pid, 'in', (time.time()-tt), 'secs'
-
-            # _fitting_tasks.remove(fit_task)
+                results = job.pool.apply(_tasks.fit_task,
+                                         (spec, msg_id, job.budget.nfev),
+                                         job.key)
+            finally:
+                _jobs.finish(job)
+            print 'fit in', (time.time() - tt)
+            _fit_cache.put(key, results)
+            if warmstart:
+                _warm_starts.store(sender_id, spec["models"], results)
+                results["warmstart"] = str(int(seeded))
 
-            # if not errq.empty():
-            #     raise Exception(errq.get())
+        except Exception, e:
+            if job is None:
+                # the arrays could not be shared or the job not started
+                reply_error(msg_id, sedexceptions.SEDException, e, mtype)
+            elif not job.stopped:
+                # a stopped job has already had its reply from the stop mtype
+                reply_error(msg_id, sedexceptions.FitException, e, mtype)
+            return
 
-            # results = get_fit_results(outq.get())
+        finally:
+            _session.release_spec(refs)
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.FitException, e, mtype)
+        if job.stopped:
             return
 
         #thread = threading.Thread(target = run_fit)
@@ -523,149 +661,164 @@ def spectrum_fit_fit(private_key, sender_id, msg_id, mtype, params, extra):
 
 
 
-class ConfidenceHandler(logging.StreamHandler):
-    def emit(self, record):
-        message = record.getMessage()
-        if record.name == 'sherpa' and record.levelname == 'INFO':
-            notify(MTYPE_SPECTRUM_FIT_CONFIDENCE_EVENT, str(message))
-
-
-def spectrum_fit_confidence(private_key, sender_id, msg_id, mtype, params,
-                            extra):
+def spectrum_fit_fit_batch(private_key, sender_id, msg_id, mtype, params,
+                           extra):
     """
-    spectrum_fit_confidence
-
-
+    spectrum_fit_fit_batch
 
+    Fits one model expression, statistic and method to each entry of
+    params["datasets"] independently, in parallel on the fit worker pool.
+    Replies with one get_fit_results() dict per dataset, in order, each
+    with a "status" of "ok", or "error" plus "exception" and "message".
     """
     try:
-        info("spectrum_fit_confidence()")
-        ui = SherpaSession()
+        info("spectrum_fit_fit_batch()")
 
-        try:
-            ui.set_method(params["method"])
-
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.MethodException, e, mtype)
-            return
+        # fill in whatever the client set earlier with spectrum.fit.set.*
+        params = get_sessions().get(sender_id).get_spec(params)
 
         try:
-            ui.set_data(params["datasets"])
+            specs = []
+            for data in params["datasets"]:
+                spec = {}
+                for key in ("models", "usermodels", "stat", "method"):
+                    if params.has_key(key):
+                        spec[key] = params[key]
+                spec["datasets"] = [data]
+                specs.append(spec)
 
         except Exception, e:
             reply_error(msg_id, sedexceptions.DataException, e, mtype)
             return
 
+        job = None
         try:
-            usermodels = []
-            if (params.has_key("usermodels")):
-                usermodels = params["usermodels"]
-            ui.set_parameters(params["models"], usermodels)
-
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ParameterException, e, mtype)
-            return
-
-        try:
-            ui.set_model(params["models"])
+            job = _jobs.start(msg_id, sender_id, mtype, "fit",
+                              get_worker_pool(), _budgets[mtype])
+            tt = time.time()
+            try:
+                tasks = job.pool.map(_tasks.fit_task,
+                                     [(fit_spec, None, job.budget.nfev)
+                                      for fit_spec in specs],
+                                     job.key)
+            finally:
+                _jobs.finish(job)
+            info("%d fits in %g" % (len(specs), time.time() - tt))
 
         except Exception, e:
-            reply_error(msg_id, sedexceptions.ModelException, e, mtype)
+            # a stopped job has already had its reply from the stop mtype
+            if job is None or not job.stopped:
+                reply_error(msg_id, sedexceptions.FitException, e, mtype)
             return
 
-        try:
-            ui.set_stat(params["stat"])
-
-            check_for_nans(ui)
-
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.StatisticException, e, mtype)
+        if job.stopped:
+            # the stop mtype has already replied for this job
             return
 
-        results = None
+        results = []
+        for task in tasks:
+            try:
+                result = task.get()
+                result["status"] = "ok"
+            except JobError, e:
+                result = {"status": "error",
+                          "exception": e.name,
+                          "message": str(e)}
+            results.append(result)
 
-        try:
+        reply_success(msg_id, mtype, {"results": results})
 
-            #ui.set_confidence(params["confidence"])
+    except Exception:
+        error(str(capture_exception()))
 
-            #handler = ConfidenceHandler()
-            #handler.setLevel(logging.INFO)
-            #logger = logging.getLogger('sherpa')
-            #logger.setLevel(logging.INFO)
-            #logger.addHandler(handler)
 
-            #ui.run_confidence(params["confidence"])
 
-            #logger.removeHandler(handler)
+def _parallel_confidence(confidencemap):
+    # covar estimates all parameters at once, only the per-parameter
+    # searches of conf/proj can be spread over workers
+    methodname = confidencemap["name"].strip().lower()
+    return (str(confidencemap.get("parallel", "false")).lower() == "true" and
+            methodname in ("conf", "proj"))
 
-            #results = ui.get_confidence_results(params["confidence"])
 
-            #
-            ##  Multiprocessing 
-            #
+def spectrum_fit_confidence(private_key, sender_id, msg_id, mtype, params,
+                            extra):
+    """
+    spectrum_fit_confidence
 
-            outq = multiprocessing.Queue()
-            errq = multiprocessing.Queue()
 
-            def worker(ui_p, cdict):
-                try:
-                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
-                    ui_p.set_confidence(cdict)
 
-                    handler = ConfidenceHandler()
-                    handler.setLevel(logging.INFO)
-                    logger = logging.getLogger('sherpa')
-                    logger.setLevel(logging.INFO)
-                    logger.addHandler(handler)
+    """
+    try:
+        info("spectrum_fit_confidence()")
 
-                    ui_p.run_confidence(cdict)
+        # the session the client built up with spectrum.fit.set.* and
+        # earlier calls, brought up to date with what this call sends
+        ui = get_sessions().get(sender_id)
+        sent = params.keys()
+        params = ui.get_spec(params)
 
-                    logger.removeHandler(handler)
+        with ui.lock:
+            try:
+                ui.update(params, sent, filter_nans=True)
 
-                    results = ui_p.get_confidence_results(cdict)
-                    outq.put(results)
-                except Exception, e:
-                    trace = capture_exception()
-                    msg = str(trace)
-                    if e.args:
-                        msg = e.args[0]
-                    errq.put( (msg, trace) )
-                    outq.put(None)
+            except sedexceptions.SEDException, e:
+                reply_error(msg_id, e.__class__, e, mtype)
+                return
 
-            #methodobj = get_confidence(params["confidence"])
-            #ids, fitobj = sherpa._session._get_fit(None, estmethod=methodobj)
-            #conf_task = multiprocessing.Process(target=conf_worker,
-            #                             args=(fitobj.est_errors, outq, errq))
+            spec = ui.get_spec()
+            thawed = ui.get_thawed_parnames()
 
-            conf_task = multiprocessing.Process(target=worker,
-                                                args=(ui, params["confidence"]))
+        results = None
+        job = None
+        refs = []
+        try:
+            # the worker rebuilds its own session, see spectrum_fit_fit
+            spec, refs = _session.share_spec(spec)
 
-            global _confidence_tasks
-            # FIXME: this needs to be thread safe!
-            _confidence_tasks.append((conf_task, msg_id, mtype))
+            cdict = params["confidence"]
+            spec["confidence"] = cdict
 
+            job = _jobs.start(msg_id, sender_id, mtype, "confidence",
+                              get_worker_pool(), _budgets[mtype])
             tt = time.time()
-            conf_task.start()
-            #print 'confidence PID', os.getpid()
-            conf_task.join()
-            print 'confidence in', (time.time() - tt)
-
-            #_confidence_tasks.remove((conf_task, msg_id, mtype))
             try:
-                _confidence_tasks.pop(-1)
-            except IndexError:
-                pass
+                pool = job.pool
+
+                # Limits of the thawed parameters are independent searches,
+                # in parallel mode each one gets a worker of its own.
+                parnames = []
+                if _parallel_confidence(cdict):
+                    parnames = thawed
+
+                if len(parnames) > 1:
+                    tasks = pool.map(_tasks.confidence_task,
+                                     [(spec, name, msg_id, job.budget.nfev)
+                                      for name in parnames],
+                                     job.key)
+                    results = _session.SherpaSession.merge_confidence_results(
+                        [task.get() for task in tasks])
+                else:
+                    results = pool.apply(_tasks.confidence_task,
+                                         (spec, None, msg_id, job.budget.nfev),
+                                         job.key)
+            finally:
+                _jobs.finish(job)
+            print 'confidence in', (time.time() - tt)
 
-            if not errq.empty():
-                msg, traceback = errq.get()
-                error(traceback)
-                raise Exception(msg)
+        except Exception, e:
+            # a stopped job has already had its reply from the stop mtype
+            if job is None or not job.stopped:
+                exception = sedexceptions.FitException
+                if getattr(e, "name", None) == "ConfidenceException":
+                    exception = sedexceptions.ConfidenceException
+                reply_error(msg_id, exception, e, mtype)
+            return
 
-            #results = get_confidence_results(params["confidence"], outq.get())
-            results = outq.get()
+        finally:
+            _session.release_spec(refs)
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.FitException, e, mtype)
+        if job.stopped:
             return
 
         reply_success(msg_id, mtype, results)
@@ -673,23 +826,28 @@ def spectrum_fit_confidence(private_key, sender_id, msg_id, mtype, params,
         error(str(capture_exception()))
 
 
+def _stop_jobs(jobs):
+    for job in jobs:
+        exception, message = _stop_errors[job.kind]
+        reply_error(job.msg_id, exception, Exception(message), job.mtype)
+        job.cancel()
+
+
+def _budget_exceeded(job, reason):
+    exception = _stop_errors[job.kind][0]
+    reply_error(job.msg_id, exception, Exception(reason), job.mtype)
+    job.cancel()
+
+
 def spectrum_fit_fit_stop(private_key, sender_id, msg_id, mtype, params, extra):
     """
     spectrum_fit_fit_stop
 
-
+    Stops the fits of the calling client, or only the one started by the
+    call params["msg-id"] if given.
     """
     try:
-        die = (lambda tasks : [task.terminate() for task in tasks
-                               if task.exitcode is None])
-        global _fitting_tasks
-        if _fitting_tasks:
-            for task_pkg in _fitting_tasks:
-                task, fit_msg_id, fit_mtype = task_pkg
-                reply_error(fit_msg_id, sedexceptions.FitException,
-                            Exception("Fitting stopped"), fit_mtype)
-                die([task])
-            _fitting_tasks = []
+        _stop_jobs(_jobs.stop(sender_id, params.get("msg-id"), "fit"))
 
     except Exception, e:
         reply_error(msg_id, sedexceptions.FitException, e, mtype)
@@ -707,20 +865,11 @@ def spectrum_fit_confidence_stop(private_key, sender_id, msg_id, mtype, params,
     """
     spectrum_fit_confidence_stop
 
-
+    Stops the confidence runs of the calling client, or only the one
+    started by the call params["msg-id"] if given.
     """
     try:
-        die = (lambda tasks : [task.terminate() for task in tasks
-                               if task.exitcode is None])
-
-        global _confidence_tasks
-        if _confidence_tasks:
-            for task_pkg in _confidence_tasks:
-                task, conf_msg_id, conf_mtype = task_pkg
-                reply_error(conf_msg_id, sedexceptions.ConfidenceException,
-                            Exception("Confidence stopped"), conf_mtype)
-                die([task])
-            _confidence_tasks = []
+        _stop_jobs(_jobs.stop(sender_id, params.get("msg-id"), "confidence"))
 
     except Exception, e:
         reply_error(msg_id, sedexceptions.ConfidenceException, e, mtype)
@@ -733,59 +882,81 @@ def spectrum_fit_confidence_stop(private_key, sender_id, msg_id, mtype, params,
         return
 
 
+def spectrum_fit_job_stop(private_key, sender_id, msg_id, mtype, params,
+                          extra):
+    """
+    spectrum_fit_job_stop
 
-
-def spectrum_fit_calc_statistic_value(private_key, sender_id, msg_id, mtype, params,
-                                      extra):
+    Stops the fit, confidence or statistic grid job started by the call
+    params["msg-id"] of the calling client.
     """
-    spectrum_fit_calc_statistic_value
+    try:
+        job_id = params["msg-id"]
+        jobs = _jobs.stop(sender_id, job_id)
+        if not jobs:
+            raise Exception("No running job " + str(job_id))
+        _stop_jobs(jobs)
+
+    except Exception, e:
+        reply_error(msg_id, sedexceptions.SEDException, e, mtype)
+        return
+
+    reply_success(msg_id, mtype)
 
 
+def spectrum_fit_job_list(private_key, sender_id, msg_id, mtype, params,
+                          extra):
+    """
+    spectrum_fit_job_list
 
+    Replies with the fit, confidence and statistic grid jobs of the calling
+    client that are running, oldest first.
     """
     try:
-        info("spectrum_fit_calc_statistic_value()")
-        ui = SherpaSession()
+        jobs = [job.describe() for job in _jobs.jobs(sender_id)]
+        reply_success(msg_id, mtype, {"jobs": jobs})
 
-        try:
-            ui.set_data(params["datasets"])
+    except Exception, e:
+        reply_error(msg_id, sedexceptions.SEDException, e, mtype)
+        return
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.DataException, e, mtype)
-            return
 
-        try:
-            usermodels = []
-            if (params.has_key("usermodels")):
-                usermodels = params["usermodels"]
-            ui.set_parameters(params["models"], usermodels)
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ParameterException, e, mtype)
-            return
 
-        try:
-            ui.set_model(params["models"])
+def spectrum_fit_calc_statistic_value(private_key, sender_id, msg_id, mtype, params,
+                                      extra):
+    """
+    spectrum_fit_calc_statistic_value
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ModelException, e, mtype)
-            return
 
-        try:
-            ui.set_stat(params["stat"])
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.StatisticException, e, mtype)
-            return
+    """
+    try:
+        info("spectrum_fit_calc_statistic_value()")
 
-        statval = None
-        try:
-            # native Sherpa command
-            statval = ui.session.calc_stat()
+        # the session the client built up with spectrum.fit.set.* and
+        # earlier calls, brought up to date with what this call sends
+        ui = get_sessions().get(sender_id)
+        sent = params.keys()
+        params = ui.get_spec(params)
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.StatisticException, e, mtype)
-            return
+        with ui.lock:
+            try:
+                ui.update(params, sent,
+                          ("data", "parameters", "model", "stat"))
+
+            except sedexceptions.SEDException, e:
+                reply_error(msg_id, e.__class__, e, mtype)
+                return
+
+            statval = None
+            try:
+                # native Sherpa command
+                statval = ui.session.calc_stat()
+
+            except Exception, e:
+                reply_error(msg_id, sedexceptions.StatisticException, e, mtype)
+                return
 
         reply_success(msg_id, mtype, { 'results' : statval})
 
@@ -804,53 +975,81 @@ def spectrum_fit_calc_statistic_values(private_key, sender_id, msg_id, mtype,
     """
     try:
         info("spectrum_fit_calc_statistic_values()")
-        ui = SherpaSession()
 
-        try:
-            ui.set_data(params["datasets"])
-
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.DataException, e, mtype)
-            return
+        # the session the client built up with spectrum.fit.set.* and
+        # earlier calls, brought up to date with what this call sends
+        ui = get_sessions().get(sender_id)
+        sent = params.keys()
+        params = ui.get_spec(params)
 
         try:
-            usermodels = []
-            if (params.has_key("usermodels")):
-                usermodels = params["usermodels"]
-            ui.set_parameters(params["models"], usermodels)
+            ui.update(params, sent,
+                      ("data", "parameters", "model", "stat"))
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ParameterException, e, mtype)
+        except sedexceptions.SEDException, e:
+            reply_error(msg_id, e.__class__, e, mtype)
             return
 
+        statvals = []
+        refs = []
+        job = None
         try:
-            ui.set_model(params["models"])
-
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ModelException, e, mtype)
-            return
-
-        try:
-            ui.set_stat(params["stat"])
+            parnames, values = read_grid(params)
+            with ui.lock:
+                initial = [ui.session.get_par(name).val for name in parnames]
+            values = fill_grid(values, initial)
+            chunks = split_grid(values, params.get("chunksize",
+                                                   _grid_chunksize))
+
+            # every point of the grid is one evaluation of the statistic
+            nfev = _budgets[mtype].nfev
+            if nfev is not None and len(values) > nfev:
+                raise BudgetExceeded(Budget.nfev_message("grid", nfev))
+
+            if (str(params.get("parallel", "false")).lower() == "true" and
+                len(chunks) > 1):
+                spec, refs = _session.share_spec(ui.get_spec())
+                # registered like fits, for the stop mtypes and the budgets
+                job = _jobs.start(msg_id, sender_id, mtype, "grid",
+                                  get_worker_pool(), _budgets[mtype])
+                results = map_grid(job.pool, job.key, _tasks.grid_task,
+                                   [(spec, parnames, chunk)
+                                    for chunk in chunks])
+            else:
+                results = (calc_stat_grid(ui, parnames, chunk)
+                           for chunk in chunks)
+
+            # with stream=true, every chunk is also broadcast as it is done
+            stream = str(params.get("stream", "false")).lower() == "true"
+            offset = 0
+            for chunk in results:
+                statvals.append(chunk)
+                if stream:
+                    broadcast(MTYPE_SPECTRUM_FIT_CALC_STATISTIC_VALUES_EVENT,
+                              {"msg-id" : msg_id,
+                               "offset" : str(offset),
+                               "results" : encode_string(chunk)})
+                offset += len(chunk)
+
+            if statvals:
+                statvals = numpy.concatenate(statvals)
+            statvals = encode_string(statvals)
 
         except Exception, e:
-            reply_error(msg_id, sedexceptions.StatisticException, e, mtype)
+            if job is not None:
+                # no chunk may still be reading the arrays released below
+                job.cancel()
+            # a stopped job has already had its reply from the stop mtype
+            if job is None or not job.stopped:
+                reply_error(msg_id, sedexceptions.StatisticException, e, mtype)
             return
 
-        statvals = []
-        try:
-            for pardict in params["params"]:
-                for parkey in pardict.keys():
-
-                    # native Sherpa command
-                    ui.session.set_par(parkey, pardict[parkey])
-
-                # native Sherpa command
-                statvals.append(ui.session.calc_stat())
-            statvals = encode_string(statvals)
+        finally:
+            if job is not None:
+                _jobs.finish(job)
+            _session.release_spec(refs)
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.StatisticException, e, mtype)
+        if job is not None and job.stopped:
             return
 
         reply_success(msg_id, mtype, {'results' : statvals})
@@ -870,48 +1069,38 @@ def spectrum_fit_calc_model_values(private_key, sender_id, msg_id, mtype,
     """
     try:
         info("spectrum_fit_calc_model_values()")
-        ui = SherpaSession()
-
-        try:
-            ui.set_data(params["datasets"])
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.DataException, e, mtype)
-            return
+        # the session the client built up with spectrum.fit.set.* and
+        # earlier calls, brought up to date with what this call sends
+        ui = get_sessions().get(sender_id)
+        sent = params.keys()
+        params = ui.get_spec(params)
 
-        try:
-            usermodels = []
-            if (params.has_key("usermodels")):
-                usermodels = params["usermodels"]
-            ui.set_parameters(params["models"], usermodels)
-
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ParameterException, e, mtype)
-            return
-
-        try:
-            ui.set_model(params["models"])
+        with ui.lock:
+            try:
+                ui.update(params, sent,
+                          ("data", "parameters", "model"))
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ModelException, e, mtype)
-            return
+            except sedexceptions.SEDException, e:
+                reply_error(msg_id, e.__class__, e, mtype)
+                return
 
-        modelvals = {}
-        try:
-            # native Sherpa commands
-            data  = ui.session.get_data(0)
-            model = ui.session.get_model(0)
+            modelvals = {}
+            try:
+                # native Sherpa commands
+                data  = ui.session.get_data(0)
+                model = ui.session.get_model(0)
 
-            vals = data.eval_model(model)
-            vals = encode_string(vals)
+                vals = data.eval_model(model)
+                vals = encode_string(vals)
 
-            modelvals["y"] = vals
-            modelvals["x"] = encode_string(ui.session.get_data(0).x)
-            modelvals["staterror"] = encode_string(numpy.ones_like(ui.session.get_data(0).x))
+                modelvals["y"] = vals
+                modelvals["x"] = encode_string(ui.session.get_data(0).x)
+                modelvals["staterror"] = encode_string(numpy.ones_like(ui.session.get_data(0).x))
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ModelException, e, mtype)
-            return
+            except Exception, e:
+                reply_error(msg_id, sedexceptions.ModelException, e, mtype)
+                return
 
         reply_success(msg_id, mtype, modelvals)
 
@@ -930,46 +1119,35 @@ def spectrum_fit_calc_flux_value(private_key, sender_id, msg_id, mtype, params,
     """
     try:
         info("spectrum_fit_calc_flux_value()")
-        ui = SherpaSession()
-
-        try:
-            ui.set_data(params["datasets"])
-
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.DataException, e, mtype)
-            return
-
-        try:
-            usermodels = []
-            if (params.has_key("usermodels")):
-                usermodels = params["usermodels"]
-            ui.set_parameters(params["models"], usermodels)
-
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ParameterException, e, mtype)
-            return
 
-        try:
-            ui.set_model(params["models"])
+        # the session the client built up with spectrum.fit.set.* and
+        # earlier calls, brought up to date with what this call sends
+        ui = get_sessions().get(sender_id)
+        sent = params.keys()
+        params = ui.get_spec(params)
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ModelException, e, mtype)
-            return
+        with ui.lock:
+            try:
+                ui.update(params, sent,
+                          ("data", "parameters", "model"))
 
+            except sedexceptions.SEDException, e:
+                reply_error(msg_id, e.__class__, e, mtype)
+                return
 
-        fluxvals = []
-        try:
+            fluxvals = []
+            try:
 
-            # native Sherpa command
-            for id in ui.session.list_data_ids():
-                fluxfunc = ui.get_flux(params["type"])
-                fluxvals.append(fluxfunc(id=id))
+                # native Sherpa command
+                for id in ui.session.list_data_ids():
+                    fluxfunc = ui.get_flux(params["type"])
+                    fluxvals.append(fluxfunc(id=id))
 
-            fluxvals = encode_string(fluxvals)
+                fluxvals = encode_string(fluxvals)
 
-        except Exception, e:
-            reply_error(msg_id, sedexceptions.ModelException, e, mtype)
-            return
+            except Exception, e:
+                reply_error(msg_id, sedexceptions.ModelException, e, mtype)
+                return
 
         reply_success(msg_id, mtype, { 'results' : fluxvals})
 
@@ -989,18 +1167,19 @@ def spectrum_redshift_calc(private_key, sender_id, msg_id, mtype, params,
         info("spectrum_redshift_calc()")
         try:
             payload = DictionaryClass(params)
-            x = decode_string(payload.x)
-            y = decode_string(payload.y)
-            yerr = decode_string(payload.yerr)
+            transport = getattr(payload, "transport", None)
+            x = decode_array(payload.x)
+            y = decode_array(payload.y)
+            yerr = decode_array(payload.yerr)
             from_redshift = float(payload.from_redshift)
             to_redshift = float(payload.to_redshift)
 
-            sed = Sed(x, y, yerr, from_redshift)
+            sed = _sed.Sed(x, y, yerr, from_redshift)
             sed.redshift(to_redshift)
 
-            payload.x = encode_string(sed.wavelength)
-            payload.y = encode_string(sed.flux)
-            payload.yerr = encode_string(sed.err)
+            payload.x = encode_array(sed.wavelength, transport)
+            payload.y = encode_array(sed.flux, transport)
+            payload.yerr = encode_array(sed.err, transport)
 
             reply_success(msg_id, mtype, payload)
 
@@ -1024,16 +1203,16 @@ def spectrum_integrate(private_key, sender_id, msg_id, mtype, params,
         try:
             payload = DictionaryClass(params)
 
-            x = decode_string(payload.x)
-            y = decode_string(payload.y)
+            x = decode_array(payload.x)
+            y = decode_array(payload.y)
 
-            sed = Sed(x, y)
+            sed = _sed.Sed(x, y)
 
             response = dict()
             response['points'] = list()
 
             for curve in payload.curves:
-                pb = Passband(curve.file_name)
+                pb = _astsed.Passband(curve.file_name)
                 flux = sed.calcFlux(pb)
                 point = dict()
                 point['id'] = curve.id
@@ -1072,14 +1251,16 @@ def spectrum_interpolate(private_key, sender_id, msg_id, mtype, params,
     try:
         info("spectrum_interpolate()")
         try:
-            methods = {'Neville' : neville,
-                       'Linear' : linear_interp,
-                       'Nearest Neighbor' : nearest_interp,
-                       'Linear Spline' : interp1d,
+            methods = {'Neville' : _sherpa_utils.neville,
+                       'Linear' : _sherpa_utils.linear_interp,
+                       'Nearest Neighbor' : _sherpa_utils.nearest_interp,
+                       'Linear Spline' : _interpolation.interp1d,
+                       'Local Neville' : _interpolation.local_neville,
                        }
             payload = DictionaryClass(params)
-            x = decode_string(payload.x)
-            y = decode_string(payload.y)
+            transport = getattr(payload, "transport", None)
+            x = decode_array(payload.x)
+            y = decode_array(payload.y)
             x_min = max(float(payload.x_min), min(x))
             x_max = min(float(payload.x_max), max(x))
             method = methods[payload.method]
@@ -1088,24 +1269,51 @@ def spectrum_interpolate(private_key, sender_id, msg_id, mtype, params,
 
             log = payload.log=='true';
 
-            sed = Sed(x, y)
-            newSed = sed.interpolate(method, (x_min, x_max), n_bins, log);
-
-            filtered = False
-
-            if payload.smooth == "true":
+            sed = _sed.Sed(x, y)
+            smooth = payload.smooth == "true"
+            normalize = payload.normalize == "true"
+
+            if n_bins >= interpolate_stream_bins and x_min <= x_max:
+                info('interpolating in chunks')
+                if smooth or normalize:
+                    # NaNs are dropped on the way instead of by filter()
+                    wavelength, flux = sed.interpolate_into(
+                        method, (x_min, x_max), n_bins, log,
+                        cache=get_interpolants(), dropnan=True)
+                    newSed = _sed.Sed(wavelength, flux, presorted=True)
+                else:
+                    # straight into the arrays the reply is encoded from
+                    if transport in (None, "", "base64"):
+                        dtype = ">f8"
+                    else:
+                        dtype = float
+                    wavelength, flux = sed.interpolate_into(
+                        method, (x_min, x_max), n_bins, log,
+                        cache=get_interpolants(), dtype=dtype)
+                    newSed = None
+                filtered = True
+            else:
+                newSed = sed.interpolate(method, (x_min, x_max), n_bins, log,
+                                         cache=get_interpolants())
+                filtered = False
+
+            if smooth:
                 info('smoothing')
-                newSed = filter(newSed)
+                if not filtered:
+                    newSed = filter(newSed)
+                    filtered = True
                 newSed.smooth(int(payload.box_size))
 
-            if payload.normalize=="true":
+            if normalize:
                 info('normalizing')
                 if not filtered:
                     newSed = filter(newSed)
                 newSed.normalise()
 
-            payload.x = encode_string(newSed.wavelength)
-            payload.y = encode_string(newSed.flux)
+            if newSed is not None:
+                wavelength, flux = newSed.wavelength, newSed.flux
+            payload.x = encode_array(wavelength, transport)
+            payload.y = encode_array(flux, transport)
 
             reply_success(msg_id, mtype, payload)
             info("success")
@@ -1121,11 +1329,8 @@ def spectrum_interpolate(private_key, sender_id, msg_id, mtype, params,
 def filter(sed):
     x = sed.wavelength
     y = sed.flux
-    c = numpy.array((x,y)).T
-    c = c[~np.isnan(c).any(1)].T
-    x = c[0]
-    y = c[1]
-    return Sed(x,y)
+    keep = ~(np.isnan(x) | np.isnan(y))
+    return _sed.Sed(x[keep], y[keep], presorted=True)
 
 def stack_redshift(private_key, sender_id, msg_id, mtype, params,
                                       extra):
@@ -1133,23 +1338,24 @@ def stack_redshift(private_key, sender_id, msg_id, mtype, params,
         info("stack_redshift()")
         try:
             payload = DictionaryClass(params)
+            transport = getattr(payload, "transport", None)
             seds = []
             for segment in payload.segments:
-                x = decode_string(segment.x)
-                y = decode_string(segment.y)
-                yerr = decode_string(segment.yerr)
+                x = decode_array(segment.x, native=True)
+                y = decode_array(segment.y, native=True)
+                yerr = decode_array(segment.yerr, native=True)
                 z = float(segment.z)
                 id_ = str(segment.id)
-                seds.append(IrisSed(x=x, y=y, yerr=yerr, z=z, id=id_))
+                seds.append(_iris_sed.IrisSed(x=x, y=y, yerr=yerr, z=z, id=id_))
             z0 = float(payload.z0)
             correct_flux = payload.correct_flux == "true"
 
-            result = redshift(IrisStack(seds), z0, correct_flux)
+            result = _stacker_iris.redshift(_iris_sed.IrisStack(seds), z0, correct_flux)
 
             for i, segment in enumerate(payload.segments):
-                segment.x = encode_string(result[i].x)
-                segment.y = encode_string(result[i].y)
-                segment.yerr = encode_string(result[i].yerr)
+                segment.x = encode_array(result[i].x, transport)
+                segment.y = encode_array(result[i].y, transport)
+                segment.yerr = encode_array(result[i].yerr, transport)
 
             payload.excludeds = result.excluded
 
@@ -1168,20 +1374,21 @@ def stack_normalize(private_key, sender_id, msg_id, mtype, params,
         info("stack_normalize()")
         try:
             payload = DictionaryClass(params)
+            transport = getattr(payload, "transport", None)
             seds = []
             for segment in payload.segments:
-                x = decode_string(segment.x)
-                y = decode_string(segment.y)
-                yerr = decode_string(segment.yerr)
+                x = decode_array(segment.x, native=True)
+                y = decode_array(segment.y, native=True)
+                yerr = decode_array(segment.yerr, native=True)
                 id_ = str(segment.id)
-                seds.append(IrisSed(x=x, y=y, yerr=yerr, id=id_))
-            stack = IrisStack(seds)
+                seds.append(_iris_sed.IrisSed(x=x, y=y, yerr=yerr, id=id_))
+            stack = _iris_sed.IrisStack(seds)
 
-            result = normalize(stack, payload)
+            result = _stacker_iris.normalize(stack, payload)
             for i, segment in enumerate(payload.segments):
-                segment.x = encode_string(result[i].x)
-                segment.y = encode_string(result[i].y)
-                segment.yerr = encode_string(result[i].yerr)
+                segment.x = encode_array(result[i].x, transport)
+                segment.y = encode_array(result[i].y, transport)
+                segment.yerr = encode_array(result[i].yerr, transport)
                 segment.norm_constant = str(result[i].norm_constant)
             payload.excludeds = result.excluded
             reply_success(msg_id, mtype, payload.get_dict())
@@ -1199,13 +1406,14 @@ def stack_stack(private_key, sender_id, msg_id, mtype, params,
         info("stack_stack()")
         try:
             payload = DictionaryClass(params)
+            transport = getattr(payload, "transport", None)
             seds = []
             for segment in payload.segments:
-                x = decode_string(segment.x)
-                y = decode_string(segment.y)
-                yerr = decode_string(segment.yerr)
-                seds.append(IrisSed(x=x, y=y, yerr=yerr))
-            i_stack = IrisStack(seds)
+                x = decode_array(segment.x, native=True)
+                y = decode_array(segment.y, native=True)
+                yerr = decode_array(segment.yerr, native=True)
+                seds.append(_iris_sed.IrisSed(x=x, y=y, yerr=yerr))
+            i_stack = _iris_sed.IrisStack(seds)
 
             binsize = float(payload.binsize)
             statistic = str(payload.statistic)
@@ -1213,12 +1421,12 @@ def stack_stack(private_key, sender_id, msg_id, mtype, params,
             smooth_binsize = float(payload.smooth_binsize)
             logbin = payload.log_bin == "true"
 
-            result = sedstacker.sed.stack(i_stack, binsize, statistic, fill='remove', smooth=smooth, smooth_binsize=smooth_binsize, logbin=logbin)
+            result = _sedstacker.stack(i_stack, binsize, statistic, fill='remove', smooth=smooth, smooth_binsize=smooth_binsize, logbin=logbin)
 
-            payload.segments[0].x = encode_string(result.x)
-            payload.segments[0].y = encode_string(result.y)
-            payload.segments[0].yerr = encode_string(result.yerr)
-            payload.segments[0].counts = encode_string(result.counts)
+            payload.segments[0].x = encode_array(result.x, transport)
+            payload.segments[0].y = encode_array(result.y, transport)
+            payload.segments[0].yerr = encode_array(result.yerr, transport)
+            payload.segments[0].counts = encode_array(result.counts, transport)
             payload.segments = [payload.segments[0]]
             get_dict = payload.get_dict()
             reply_success(msg_id, mtype, payload.get_dict())
@@ -1234,6 +1442,65 @@ def stack_stack(private_key, sender_id, msg_id, mtype, params,
 def ping(private_key, sender_id, msg_id, mtype, params, extra):
     reply_success(msg_id, mtype, {})
 
+
+def _samp_value(value):
+    # SAMP only has strings, lists and maps
+    if isinstance(value, dict):
+        return dict((str(key), _samp_value(val))
+                    for key, val in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_samp_value(val) for val in value]
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _stats_extra():
+    return {"replies" : dict(_replies.stats, pending=_replies.pending()),
+            "lanes"   : {_dispatcher.cheap.name : _dispatcher.cheap.qsize(),
+                         _dispatcher.costly.name : _dispatcher.costly.qsize()},
+            "jobs"    : len(_jobs),
+            "interpolants" : _interpolant_stats()}
+
+
+def _interpolant_stats():
+    if _interpolants is None:
+        return {}
+    return {"hits"    : _interpolants.hits,
+            "misses"  : _interpolants.misses,
+            "entries" : len(_interpolants.cache),
+            "bytes"   : _interpolants.cache.nbytes}
+
+
+def get_stats():
+    """
+    The metrics of the calls, with the state of the lanes, the reply
+    queue and the jobs.
+    """
+    stats = _metrics.snapshot()
+    stats.update(_stats_extra())
+    return stats
+
+
+def sherpa_stats(private_key, sender_id, msg_id, mtype, params, extra):
+    """
+    sherpa_stats
+
+    Replies with the latency histograms (count, total, mean, p50, p95,
+    p99 and max, in seconds) of the queue, decode, compute, encode and
+    reply phases and the outcome counts of every mtype called so far.
+    With "reset" : "true" the metrics start over afterwards.
+    """
+    try:
+        stats = get_stats()
+        if params.get("reset") == "true":
+            _metrics.reset()
+        reply_success(msg_id, mtype, _samp_value(stats))
+
+    except Exception, e:
+        reply_error(msg_id, sedexceptions.SEDException, e, mtype)
+        return
+
 #
 ## SAMP MTypes
 #
@@ -1248,9 +1515,12 @@ _mtypes = {
     "spectrum.fit.set.method"     : spectrum_fit_set_method,
     "spectrum.fit.set.confidence" : spectrum_fit_set_confidence,
     "spectrum.fit.fit"            : spectrum_fit_fit,
+    "spectrum.fit.fit.batch"      : spectrum_fit_fit_batch,
     "spectrum.fit.fit.stop"       : spectrum_fit_fit_stop,
     "spectrum.fit.confidence"     : spectrum_fit_confidence,
     "spectrum.fit.confidence.stop": spectrum_fit_confidence_stop,
+    "spectrum.fit.job.stop"       : spectrum_fit_job_stop,
+    "spectrum.fit.job.list"       : spectrum_fit_job_list,
     "spectrum.fit.calc.statistic.value"  : spectrum_fit_calc_statistic_value,
     "spectrum.fit.calc.statistic.values" : spectrum_fit_calc_statistic_values,
     "spectrum.fit.calc.model.values"     : spectrum_fit_calc_model_values,
@@ -1262,84 +1532,207 @@ _mtypes = {
     "stack.normalize" : stack_normalize,
     "stack.stack" : stack_stack,
     "sherpa.ping" : ping,
+    "sherpa.stats" : sherpa_stats,
 }
 
+MTYPE_SPECTRUM_FIT_FIT_EVENT = "spectrum.fit.fit.event"
 MTYPE_SPECTRUM_FIT_CONFIDENCE_EVENT = "spectrum.fit.confidence.event"
+MTYPE_SPECTRUM_FIT_CONFIDENCE_PROGRESS = "spectrum.fit.confidence.progress"
+MTYPE_SPECTRUM_FIT_CALC_STATISTIC_VALUES_EVENT = "spectrum.fit.calc.statistic.values.event"
+
+# Grid points per chunk for spectrum.fit.calc.statistic.values
+_grid_chunksize = 1024
+
+# Mtypes that run on the expensive lane of the dispatcher, everything else
+# (pings, stop requests, SED tools, stacking) is served on the cheap lane.
+_expensive_mtypes = (
+    "load.table.fits",
+    "spectrum.fit.fit",
+    "spectrum.fit.fit.batch",
+    "spectrum.fit.confidence",
+    "spectrum.fit.calc.statistic.values",
+    "spectrum.fit.calc.flux.value",
+)
+
 
+def _reject(msg_id, mtype):
+    reply_error(msg_id, sedexceptions.SEDException,
+                Exception("Sherpa is busy, try again later"), mtype)
+
+
+_dispatcher = Dispatcher(expensive=_expensive_mtypes,
+                         cheap_threads=4,
+                         expensive_threads=multiprocessing.cpu_count(),
+                         on_reject=_reject,
+                         gate=_connected,
+                         on_receive=_metrics.received)
+
+_monitor = None
 
-__serving = True
 
 def stop():
-    global __serving
-    __serving = False
+    if _pool is not None:
+        _pool.close()
+    if _progress is not None:
+        _progress.close()
+    _replies.close(timeout=5.0)
+    if _monitor is not None:
+        _monitor.stop()
     _sig_handler(signal.SIGINT, None)
 
 
+def _receive_call(private_key, sender_id, msg_id, mtype, params, extra):
+    #print "receive_call()..."
+    pass
+
+
+def _receive_notification(private_key, sender_id, mtype, params, extra):
+    #print params
+    #print "receiving notification now..."
+    pass
+
+
+def _receive_response(private_key, sender_id, msg_id, response):
+    #print response
+    #print "receiving response now..."
+    pass
+
+
+# the dispatcher callback of each mtype, made once so that registering
+# again after a reconnection binds the very same functions
+_callbacks = {}
+
+
 def register():
     #
     ##  Register SAMP MTypes
     #
 
     for mtype in _mtypes:
-        cli.bindReceiveCall(mtype, _mtypes[mtype])
+        if not _callbacks.has_key(mtype):
+            _callbacks[mtype] = _dispatcher.wrap(
+                _metrics.instrument(_mtypes[mtype]))
+        cli.bindReceiveCall(mtype, _callbacks[mtype])
 
-    def receive_call(private_key, sender_id, msg_id, mtype, params, extra):
-        #print "receive_call()..."
-        pass
+    cli.bindReceiveCall("samp.hub.*", _receive_call)
+    cli.bindReceiveNotification("samp.hub.*", _receive_notification)
+    cli.bindReceiveResponse("samp.hub.*", _receive_response)
 
-    cli.bindReceiveCall("samp.hub.*", receive_call)
 
-    def receive_notification(private_key, sender_id, mtype, params, extra):
-        #print params
-        #print "receiving notification now..."
-        pass
-
-    cli.bindReceiveNotification("samp.hub.*", receive_notification)
+def _connect():
+    if cli.isConnected():
+        try:
+            cli.disconnect()
+        except Exception, e:
+            warn("could not disconnect cleanly: " + str(e))
+    info("trying connection")
+    cli.connect()
+    info("trying registration")
+    register()
+    connect_hub()
+    info("registered")
+    if prewarm_enabled:
+        _prewarm.start()
 
 
-    def receive_response(private_key, sender_id, msg_id, response):
-        #print response
-        #print "receiving response now..."
-        pass
+def _is_connected():
+    if not (cli.hub.getRunningHubs() and cli.isConnected()):
+        return False
+    if _hub is not None:
+        _hub.ping()
+    return True
 
-    cli.bindReceiveResponse("samp.hub.*", receive_response)
 
 
+def set_budgets(walltime=None, nfev=None, rss=None, mtypes=None):
+    """
+    Set the given limits of the jobs of mtypes, all of them by default.
+    """
+    if mtypes is None:
+        mtypes = _budgets.keys()
+    for mtype in mtypes:
+        budget = _budgets[mtype]
+        if walltime is not None:
+            budget.walltime = walltime
+        if nfev is not None:
+            budget.nfev = nfev
+        if rss is not None:
+            budget.rss = rss
+
+
+def _parse_budget(value):
+    # MTYPE:LIMIT=VALUE[,LIMIT=VALUE...]
+    types = {"walltime" : float, "nfev" : int, "rss" : float}
+    try:
+        mtype, limits = value.split(":", 1)
+        if not _budgets.has_key(mtype):
+            raise ValueError("no budget for mtype " + mtype)
+        kwargs = {}
+        for limit in limits.split(","):
+            name, val = limit.split("=", 1)
+            kwargs[name.strip()] = types[name.strip()](val)
+    except (ValueError, KeyError), e:
+        raise argparse.ArgumentTypeError("invalid budget '%s': %s" %
+                                         (value, str(e)))
+    return mtype, kwargs
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="sherpa-samp",
+                                     description=metadata["samp.description.text"])
+    parser.add_argument("--max-walltime", type=float, metavar="SECONDS",
+                        help="default wall time limit of fit, confidence and "
+                        "statistic grid jobs")
+    parser.add_argument("--max-nfev", type=int, metavar="N",
+                        help="default limit of statistic evaluations of a job")
+    parser.add_argument("--max-rss", type=float, metavar="MB",
+                        help="default limit of resident memory of a worker")
+    parser.add_argument("--budget", type=_parse_budget, action="append",
+                        default=[], metavar="MTYPE:LIMIT=VALUE[,...]",
+                        help="limits of one mtype, e.g. "
+                        "spectrum.fit.confidence:walltime=600,nfev=100000")
+    parser.add_argument("--stats-file", metavar="PATH",
+                        help="write the sherpa.stats metrics to PATH as JSON "
+                        "every --stats-interval seconds")
+    parser.add_argument("--stats-interval", type=float, default=60.0,
+                        metavar="SECONDS",
+                        help="interval of --stats-file (default 60)")
+    parser.add_argument("--no-prewarm", action="store_true",
+                        help="import Sherpa and the SED tools on first use "
+                        "only, instead of in the background once registered")
+    # unknown arguments are left alone, as they were before, except for
+    # misspelled limits which would otherwise be silently ignored
+    args, unknown = parser.parse_known_args(argv)
+    limits = [flag for action in parser._actions
+              for flag in action.option_strings
+              if flag.startswith(("--max-", "--budget"))]
+    misspelled = [arg for arg in unknown if arg.startswith("--") and
+                  difflib.get_close_matches(arg.split("=", 1)[0], limits, 1,
+                                            0.85)]
+    if misspelled:
+        parser.error("unrecognized arguments: " + " ".join(misspelled))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    set_budgets(args.max_walltime, args.max_nfev, args.max_rss)
+    for mtype, limits in args.budget:
+        set_budgets(mtypes=(mtype,), **limits)
 
-def main():
     info("Starting " + __name__)
-    global cli
+    global cli, _monitor, prewarm_enabled
+    prewarm_enabled = not args.no_prewarm
+    if args.stats_file:
+        _metrics.dump_every(args.stats_file, args.stats_interval,
+                            extra=_stats_extra)
     cli = samp.SAMPIntegratedClient(metadata, addr='localhost')
+    _monitor = HubMonitor(_connect, _is_connected, connected=_connected)
     try:
-        global __serving
-        last_ping = time.time()
-        while __serving:
-            try:
-                time.sleep(1.5)
-                if cli.hub.getRunningHubs() and cli.isConnected():
-                    if not connected:
-                        info("Successful ping at: "+str(last_ping))
-                    connected = True
-                    last_ping = time.time()
-                else:
-                    connected = False
-                if not connected:
-                    info("not connected")
-                    try:
-                        info("trying connection")
-                        cli.connect()
-                        info("trying registration")
-                        register()
-                        info("registered")
-                    except samp.SAMPHubError as e:
-                        warn("got SAMPHubError")
-                        logging.exception(e)
-                    if time.time() > last_ping + 60:
-                        warn("giving up")
-                        raise KeyboardInterrupt("Ping timeout")
-            except Exception, e:
-                warn("Got exception during main monitor thread")
-                logging.exception(e)
+        _monitor.run()
+    except Exception, e:
+        warn("Got exception during main monitor thread")
+        logging.exception(e)
     finally:
         info("stopping")
         stop()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import atexit
+import signal
+import threading
+import multiprocessing
+import Queue
+
+import logging
+logger = logging.getLogger(__name__)
+info = logger.info
+error = logger.error
+
+from sherpa_samp.utils import capture_exception
+
+__all__ = ('WorkerPool', 'JobError', 'JobCancelled')
+
+# Pipes are created and their child ends closed under this lock, so that a
+# worker forked from another thread never inherits somebody else's child
+# end (which would hide the EOF we rely on to notice a dead worker).
+_spawn_lock = threading.Lock()
+
+
+class JobError(Exception):
+    """
+    Raised in the caller when a job fails inside a worker process.
+    The formatted traceback from the worker is kept in `trace`, the class
+    name of the original exception in `name`.
+    """
+
+    def __init__(self, msg='', trace='', name='Exception'):
+        Exception.__init__(self, msg)
+        self.trace = trace
+        self.name = name
+
+
+class JobCancelled(Exception):
+
+    def __init__(self, msg=''):
+        Exception.__init__(self, msg)
+
+
+class _Task(object):
+
+    def __init__(self, key, func, args):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def get(self):
+        self.done.wait()
+        if self.cancelled:
+            raise JobCancelled("Job %s cancelled" % str(self.key))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _serve(conn, initializer):
+    # The parent owns signal handling (see mtypes._sig_handler), a worker
+    # only has to die quietly when it is terminated.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if initializer is not None:
+        initializer()
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, IOError):
+            break
+        if job is None:
+            break
+
+        func, args = job
+        try:
+            conn.send((True, func(*args)))
+        except Exception, e:
+            trace = capture_exception()
+            msg = str(trace)
+            if e.args:
+                msg = e.args[0]
+            conn.send((False, (type(e).__name__, msg, trace)))
+
+
+class _Worker(object):
+    """
+    One pre-forked process plus the parent-side thread that feeds it
+    tasks from the pool queue.
+    """
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.task = None
+        self.process = None
+        self.conn = None
+        self._spawn()
+
+        self.thread = threading.Thread(target=self._feed,
+                                       name="sherpa-worker-%d" % index)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _spawn(self):
+        with _spawn_lock:
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve,
+                                              args=(child_conn,
+                                                    self.pool.initializer))
+            process.start()
+            # Close our copy of the child end, so that recv() in the feeder
+            # sees EOF as soon as the worker goes away.
+            child_conn.close()
+        self.process = process
+        self.conn = parent_conn
+        info("started worker %d, pid %s" % (self.index, process.pid))
+
+    def _respawn(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        if not self.pool.closed:
+            self._spawn()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def _feed(self):
+        pool = self.pool
+        while True:
+            task = pool._tasks.get()
+            if task is None:
+                break
+
+            with pool._lock:
+                if task.cancelled:
+                    continue
+                self.task = task
+
+            if not self.process.is_alive():
+                self._respawn()
+
+            try:
+                self.conn.send((task.func, task.args))
+                ok, value = self.conn.recv()
+            except (EOFError, IOError, OSError):
+                with pool._lock:
+                    self.task = None
+                if not task.cancelled:
+                    error("worker %d died while running job %s" %
+                          (self.index, str(task.key)))
+                    task.error = JobError("Worker process died unexpectedly")
+                task.done.set()
+                self._respawn()
+                continue
+
+            with pool._lock:
+                self.task = None
+
+            if ok:
+                task.result = value
+            else:
+                name, msg, trace = value
+                error(trace)
+                task.error = JobError(msg, trace, name)
+            task.done.set()
+
+
+class WorkerPool(object):
+    """
+    A fixed set of long lived worker processes.  Workers are forked from
+    the server process, so they start with Sherpa and NumPy already
+    imported, and `initializer` runs once in each of them before the first
+    job (e.g., to warm up the model registry).
+
+    Jobs are module level functions with picklable arguments and results.
+    Every job carries a key (the SAMP sender and msg_id, see Job.key) so
+    that it can be cancelled; cancelling a running job terminates the
+    worker process running it and a fresh worker takes its place.
+    """
+
+    def __init__(self, size=None, initializer=None):
+        if size is None:
+            size = multiprocessing.cpu_count()
+        self.size = max(1, int(size))
+        self.initializer = initializer
+        self.closed = False
+        self._lock = threading.Lock()
+        self._tasks = Queue.Queue()
+        self._workers = [_Worker(self, ii) for ii in range(self.size)]
+        atexit.register(self.close)
+
+    def submit(self, func, args=(), key=None):
+        if self.closed:
+            raise JobError("Worker pool is closed")
+        task = _Task(key, func, args)
+        self._tasks.put(task)
+        return task
+
+    def apply(self, func, args=(), key=None):
+        return self.submit(func, args, key).get()
+
+    def map(self, func, argslist, key=None):
+        """
+        Run func over argslist in parallel, return a list of tasks in
+        the same order.  Callers collect each outcome with task.get().
+        """
+        tasks = [self.submit(func, args, key) for args in argslist]
+        for task in tasks:
+            task.done.wait()
+        return tasks
+
+    def cancel(self, key):
+        """
+        Cancel every queued or running job submitted with key.  Returns
+        the number of jobs that were cancelled.
+        """
+        count = 0
+        with self._lock:
+            for task in list(self._tasks.queue):
+                if task is not None and task.key == key and not task.cancelled:
+                    task.cancelled = True
+                    task.done.set()
+                    count += 1
+            for worker in self._workers:
+                task = worker.task
+                if task is not None and task.key == key:
+                    task.cancelled = True
+                    worker.kill()
+                    count += 1
+        return count
+
+    def pids(self, key):
+        """
+        Process ids of the workers running jobs submitted with key.
+        """
+        with self._lock:
+            return [worker.process.pid for worker in self._workers
+                    if worker.task is not None and worker.task.key == key]
+
+    def running(self):
+        with self._lock:
+            return [worker.task.key for worker in self._workers
+                    if worker.task is not None]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for worker in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.kill()
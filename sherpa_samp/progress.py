@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Progress of fits and confidence runs in the worker processes
+#
+## Workers write small records (iteration, statistic, thawed parameter
+## values, log messages) to a pipe shared with the server process.  The
+## write end is non-blocking and every record fits in PIPE_BUF bytes, so a
+## write is atomic.  Statistic updates never wait: when the pipe is full
+## the update is dropped, and only the latest dropped one is sent again by
+## Reporter.flush() at the end of the job.  Log messages wait for room in
+## the pipe.  Workers also throttle the updates they write.
+##
+## In the server, a ProgressBroadcaster thread reads the pipe, keeps only
+## the latest record of each job (log messages are accumulated) and hands
+## them to a send function at most maxrate times per second.
+#
+
+import os
+import time
+import errno
+import fcntl
+import select
+import struct
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+info = logger.info
+error = logger.error
+
+__all__ = ('open_channel', 'Reporter', 'ProgressHandler',
+           'ProgressBroadcaster')
+
+_pipe_buf = getattr(select, "PIPE_BUF", 512)
+_header = struct.Struct("!I")
+
+_read_fd = None
+_write_fd = None
+
+# records that must not be lost wait at most this many seconds for room in
+# the pipe, in case nothing is reading it
+_wait_timeout = 60.0
+
+
+def open_channel():
+    """
+    The read end of the progress pipe, created on first use.  It has to be
+    opened before the worker processes are forked so that they inherit the
+    write end.
+    """
+    global _read_fd, _write_fd
+    if _read_fd is None:
+        read_fd, write_fd = os.pipe()
+        flags = fcntl.fcntl(write_fd, fcntl.F_GETFL)
+        fcntl.fcntl(write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        _read_fd, _write_fd = read_fd, write_fd
+    return _read_fd
+
+
+def _write(record, timeout=None):
+    """
+    Write record to the pipe, if it is full wait up to timeout seconds for
+    room, or not at all if timeout is None.  Returns whether it was sent.
+    """
+    if _write_fd is None:
+        return False
+    data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    data = _header.pack(len(data)) + data
+    if len(data) > _pipe_buf:
+        # too many parameters to fit an atomic write, send it without them
+        record = dict(record)
+        record.pop("parnames", None)
+        record.pop("parvals", None)
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        data = _header.pack(len(data)) + data
+        if len(data) > _pipe_buf:
+            return False
+    if timeout is not None:
+        deadline = time.time() + timeout
+    while True:
+        try:
+            os.write(_write_fd, data)
+            return True
+        except OSError, e:
+            if e.errno != errno.EAGAIN or timeout is None:
+                return False
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            error("progress pipe full, record of %s lost" % str(record["key"]))
+            return False
+        select.select([], [_write_fd], [], remaining)
+
+
+class Reporter(object):
+    """
+    Worker side, sends the progress records of one job (key is the SAMP
+    msg_id).  Statistic updates are sent at most once every interval
+    seconds and may be dropped, log messages are not.
+    """
+
+    def __init__(self, key, kind, interval=0.1):
+        self.key = key
+        self.kind = kind
+        self.interval = interval
+        self.last = 0.0
+        self.dropped = None
+
+    def due(self):
+        return time.time() - self.last >= self.interval
+
+    def _record(self, fields):
+        fields["key"] = self.key
+        fields["kind"] = self.kind
+        return fields
+
+    def send(self, **fields):
+        """
+        A statistic update, dropped if the pipe is full.
+        """
+        self.last = time.time()
+        record = self._record(fields)
+        if _write(record):
+            self.dropped = None
+            return True
+        self.dropped = record
+        return False
+
+    def log(self, message):
+        return _write(self._record({"message": message}), _wait_timeout)
+
+    def flush(self):
+        """
+        Send the last statistic update again if it was dropped, waiting
+        for room in the pipe.
+        """
+        record, self.dropped = self.dropped, None
+        if record is None:
+            return True
+        return _write(record, _wait_timeout)
+
+
+class ProgressHandler(logging.Handler):
+    """
+    Forwards the INFO messages of the 'sherpa' logger, the lines printed
+    by conf/proj/covar, as progress records.
+    """
+
+    def __init__(self, reporter):
+        logging.Handler.__init__(self, logging.INFO)
+        self.reporter = reporter
+
+    def emit(self, record):
+        if record.name == 'sherpa' and record.levelname == 'INFO':
+            self.reporter.log(str(record.getMessage()))
+
+
+def _merge(pending, record):
+    messages = pending.get("messages", [])
+    if record.has_key("message"):
+        messages.append(record.pop("message"))
+    pending.update(record)
+    pending["messages"] = messages
+    return pending
+
+
+class ProgressBroadcaster(object):
+    """
+    Server side, reads the progress pipe and calls send(record) for each
+    job with news, at most maxrate times per second.  A record has the
+    "key" and "kind" of the Reporter, the latest "iteration", "statval",
+    "parnames" and "parvals" if any, and the "messages" logged since the
+    previous call.
+    """
+
+    def __init__(self, send, maxrate=2.0):
+        self.send = send
+        self.interval = 1.0 / maxrate
+        self.fd = open_channel()
+        self._pending = OrderedDict()
+        self._buffer = ''
+        self._running = True
+        self.thread = threading.Thread(target=self._run,
+                                       name="sherpa-progress")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        self._buffer += os.read(self.fd, 65536)
+        while len(self._buffer) >= _header.size:
+            size, = _header.unpack_from(self._buffer)
+            if len(self._buffer) < _header.size + size:
+                break
+            data = self._buffer[_header.size:_header.size + size]
+            self._buffer = self._buffer[_header.size + size:]
+            record = pickle.loads(data)
+            key = (record["key"], record["kind"])
+            self._pending[key] = _merge(self._pending.get(key, {}), record)
+
+    def _flush(self):
+        pending, self._pending = self._pending, OrderedDict()
+        for record in pending.values():
+            try:
+                self.send(record)
+            except Exception, e:
+                error("cannot send progress of %s: %s" %
+                      (str(record["key"]), str(e)))
+
+    def _run(self):
+        last = time.time()
+        while self._running:
+            wait = max(0.0, last + self.interval - time.time())
+            try:
+                self._read(wait)
+            except Exception, e:
+                error("cannot read progress: " + str(e))
+                self._buffer = ''
+            if time.time() - last >= self.interval:
+                if self._pending:
+                    self._flush()
+                last = time.time()
+
+    def close(self):
+        self._running = False
+        self.thread.join()
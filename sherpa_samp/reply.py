@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Outbound SAMP replies
+#
+## Handlers queue their replies and return; `threads` sender threads
+## deliver them, each over a hub connection of its own (see
+## sherpa_samp.hub).  Replies to one recipient are sent one at a time, in
+## the order they were queued.  A reply that fails with one of the
+## `retryable` errors is tried again after an exponential backoff with
+## full jitter, while the replies to other recipients go ahead, and is
+## dropped after `retries` further attempts.  While `gate` is clear, e.g.
+## during a reconnection to the hub, replies are held back.  on_sent, if
+## given, is called with the msg_id and the seconds from queueing to
+## delivery of each reply sent.
+#
+
+import time
+import random
+import threading
+from collections import deque, OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+info = logger.info
+warn = logger.warning
+error = logger.error
+
+__all__ = ('ReplySender',)
+
+
+class _Reply(object):
+
+    def __init__(self, msg_id, response):
+        self.msg_id = msg_id
+        self.response = response
+        self.attempts = 0
+        self.not_before = 0.0
+        self.queued = time.time()
+
+
+class ReplySender(object):
+
+    def __init__(self, send, retryable=(), retries=8, base=0.05, cap=5.0,
+                 threads=1, gate=None, on_sent=None):
+        self.send = send
+        self.gate = gate
+        self.on_sent = on_sent
+        self.threads = max(1, int(threads))
+        self.retryable = tuple(retryable)
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.stats = {"sent": 0, "retried": 0, "dropped": 0}
+        self._queues = OrderedDict()
+        self._busy = set()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._closed = False
+
+    def _start(self):
+        while len(self._threads) < self.threads:
+            thread = threading.Thread(target=self._run,
+                                      name="sherpa-replies-%d" %
+                                      len(self._threads))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, msg_id, response, recipient=None):
+        with self._cond:
+            self._start()
+            queue = self._queues.get(recipient)
+            if queue is None:
+                queue = self._queues[recipient] = deque()
+            queue.append(_Reply(msg_id, response))
+            self._cond.notify_all()
+
+    def pending(self):
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _next(self):
+        # the head of the recipient queue that is due first, and how long
+        # to wait for it, skipping recipients with a reply in flight
+        best = None
+        for recipient, queue in self._queues.iteritems():
+            if recipient in self._busy:
+                continue
+            if best is None or queue[0].not_before < best[1].not_before:
+                best = (recipient, queue[0])
+        if best is None:
+            return None, None
+        return best, max(0.0, best[1].not_before - time.time())
+
+    def _done(self, recipient):
+        self._busy.discard(recipient)
+        queue = self._queues[recipient]
+        queue.popleft()
+        if not queue:
+            del self._queues[recipient]
+        self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    best, wait = self._next()
+                    if best is None and self._closed and not self._queues:
+                        return
+                    if best is not None and wait == 0.0:
+                        break
+                    self._cond.wait(wait)
+                recipient, reply = best
+                self._busy.add(recipient)
+
+            if self.gate is not None:
+                self.gate.wait()
+
+            try:
+                self.send(reply.msg_id, reply.response)
+            except self.retryable, e:
+                reply.attempts += 1
+                with self._cond:
+                    if reply.attempts > self.retries:
+                        self.stats["dropped"] += 1
+                        error("dropped reply to %s after %d attempts: %s "
+                              "(%d replies dropped)" %
+                              (reply.msg_id, reply.attempts, str(e),
+                               self.stats["dropped"]))
+                        self._done(recipient)
+                        continue
+                    self.stats["retried"] += 1
+                    delay = min(self.cap, self.base * 2 ** reply.attempts)
+                    reply.not_before = time.time() + random.uniform(0, delay)
+                    self._busy.discard(recipient)
+                    self._cond.notify_all()
+                warn("cannot send reply to %s, retry %d: %s" %
+                     (reply.msg_id, reply.attempts, str(e)))
+                continue
+            except Exception, e:
+                with self._cond:
+                    self.stats["dropped"] += 1
+                    self._done(recipient)
+                error("dropped reply to %s: %s (%d replies dropped)" %
+                      (reply.msg_id, str(e), self.stats["dropped"]))
+                continue
+
+            with self._cond:
+                self.stats["sent"] += 1
+                self._done(recipient)
+            info("sent reply to " + str(reply.msg_id))
+            if self.on_sent is not None:
+                self.on_sent(reply.msg_id, time.time() - reply.queued)
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued reply has been sent or dropped, returns
+        whether it happened within timeout seconds.
+        """
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        with self._cond:
+            while self._queues:
+                if end is None:
+                    self._cond.wait()
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -23,7 +23,45 @@ __author__="olaurino"
 __date__ ="$Feb 4, 2013 5:05:26 PM$"
 
 from astLib.astSED import SED as astSed
-from numpy import trapz, array, logspace, linspace, ceil, floor, log10, nan
+from numpy import (trapz, array, asarray, arange, empty, power, ceil, floor, log10,
+                   isnan, nan)
+
+# Bins evaluated at a time by Sed.iter_interpolate
+chunk_size = 1 << 16
+
+
+def grid(interval, num_bins, log, start=0, stop=None):
+    """
+    Bins start to stop of the num_bins bins Sed.interpolate divides interval
+    into, the same values numpy.linspace or numpy.logspace give without
+    building the whole grid.  With log the interval is widened to whole
+    decades.
+    """
+    if log:
+        xmin = floor(log10(interval[0]))
+        xmax = ceil(log10(interval[1]))
+    else:
+        xmin = float(interval[0])
+        xmax = float(interval[1])
+    if stop is None:
+        stop = num_bins
+    bins = arange(start, stop, dtype=float)
+    if num_bins > 1:
+        step = (xmax - xmin) / (num_bins - 1)
+        if step == 0:
+            bins /= num_bins - 1
+            bins *= xmax - xmin
+        else:
+            bins *= step
+    else:
+        bins *= xmax - xmin
+    bins += xmin
+    if num_bins > 1 and stop == num_bins and stop > start:
+        bins[-1] = xmax
+    if log:
+        power(10.0, bins, out=bins)
+    return bins
+
 
 class Sed(astSed):
     """
@@ -34,24 +72,28 @@ class Sed(astSed):
     doesn't even attempt to be a comprehensive SED class.
     """
     
-    def __init__(self, wavelength, flux, err=None, z=0.0):
+    def __init__(self, wavelength, flux, err=None, z=0.0, presorted=False):
         """
         The difference between this constructor and the astLib one
         is that z has different semantics here, being the redhisft of the source,
         if any. If z is not provided, wavelength and flux are just passed to
         the parent class's constructor. Otherwise, the wavelength and flux are 
         shifted to the rest frame and passed to the parent's constructor along with z
+
+        presorted says the wavelengths are already in increasing order, so
+        they are not sorted again.
         """
         wavelength = array(wavelength)
         flux = array(flux)
         if err is not None:
             err = array(err)
         
-        si = wavelength.argsort()
-        wavelength.sort()
-        flux = flux[si]
-        if err is not None:
-            err = err[si]
+        if not presorted:
+            si = wavelength.argsort()
+            wavelength.sort()
+            flux = flux[si]
+            if err is not None:
+                err = err[si]
 
         if z==0.0:
             astSed.__init__(self, wavelength, flux)
@@ -69,24 +111,68 @@ class Sed(astSed):
         astSed.__init__(self, wavelength_z0, flux_z0, z)
         self.err = err
         
-    def interpolate(self, function, interval, num_bins, log):
+    def interpolate(self, function, interval, num_bins, log, cache=None):
         """
         Use function to interpolate this sed in a defined interval divided into
         num_bins bins.
         
         Function must take argument xout, xin, yin and return an yout array.
+        With a cache (sherpa_samp.interpolation.InterpolantCache) the
+        interpolant of this sed is reused by later calls that only change
+        the bins.
         """
         
         
-        if log:
-            xmin=floor(log10(interval[0]))
-            xmax=ceil(log10(interval[1]))
-            bins=logspace(xmin, xmax, num_bins, endpoint=True)
+        bins = grid(interval, num_bins, log)
+        if cache is not None:
+            interpolant = cache.get(function, log10(self.wavelength),
+                                    log10(self.flux))
+            flux = interpolant(log10(bins))
         else:
-            xmin=interval[0]
-            xmax=interval[1]
-            bins=linspace(xmin, xmax, num_bins, endpoint=True)
-        flux=function(log10(bins), log10(self.wavelength), log10(self.flux))
-        return Sed(bins, 10**flux)
-        
-    
+            flux=function(log10(bins), log10(self.wavelength), log10(self.flux))
+        # the grid is monotonic already, only a reversed interval needs sorting
+        return Sed(bins, 10**flux, presorted=bins.size < 2 or bins[0] <= bins[-1])
+
+    def iter_interpolate(self, function, interval, num_bins, log, cache=None,
+                         chunksize=None):
+        """
+        Like interpolate, but yield the (bins, flux) of chunksize bins at a
+        time instead of a new sed, so that very fine grids are never
+        evaluated, nor held in memory, all at once.
+        """
+        chunksize = chunksize or chunk_size
+        xin = log10(self.wavelength)
+        yin = log10(self.flux)
+        if cache is not None:
+            interpolant = cache.get(function, xin, yin)
+        else:
+            interpolant = lambda xout: function(xout, xin, yin)
+        for start in xrange(0, num_bins, chunksize):
+            bins = grid(interval, num_bins, log, start,
+                        min(start + chunksize, num_bins))
+            flux = asarray(interpolant(log10(bins)), dtype=float)
+            power(10.0, flux, out=flux)
+            yield bins, flux
+
+    def interpolate_into(self, function, interval, num_bins, log, cache=None,
+                         dtype=float, dropnan=False, chunksize=None):
+        """
+        Interpolate chunk by chunk straight into two arrays of dtype, e.g.
+        the big-endian doubles replies are encoded as, and return the
+        (bins, flux) arrays.  With dropnan the bins where either is NaN are
+        left out on the way, and the arrays returned are only as long as
+        needed.  The interval must be increasing for the bins to be.
+        """
+        x = empty(num_bins, dtype=dtype)
+        y = empty(num_bins, dtype=dtype)
+        size = 0
+        for bins, flux in self.iter_interpolate(function, interval, num_bins,
+                                                log, cache, chunksize):
+            if dropnan:
+                keep = ~(isnan(bins) | isnan(flux))
+                bins = bins[keep]
+                flux = flux[keep]
+            x[size:size + bins.size] = bins
+            y[size:size + flux.size] = flux
+            size += bins.size
+        return x[:size], y[:size]
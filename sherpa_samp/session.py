@@ -19,13 +19,19 @@
 #
 
 
+import copy
+import time
+import inspect
 import numpy
+import threading
+from collections import OrderedDict
 import sherpa.all
 
 # Override Sherpa's feature that binds model identifiers as local objects
 import sherpa.ui
 import sherpa.ui.utils
 sherpa.ui.utils._assign_obj_to_main = lambda name, obj: None
+from sherpa.ui.utils import ModelWrapper
 
 import sherpa.astro.all
 import sherpa.astro.ui as sherpaUI
@@ -34,9 +40,72 @@ import logging
 logger = logging.getLogger(__name__)
 info = logger.info
 
+import sherpa_samp.sedexceptions as sedexceptions
 from sherpa_samp.utils import encode_string, decode_string
-
-__all__ = ("SherpaSession", "check_for_nans")
+from sherpa_samp.transport import decode_array, write_array, remove_array
+
+__all__ = ("SherpaSession", "SessionCache", "check_for_nans", "copy_spec",
+           "share_spec", "release_spec", "get_model_types", "add_model_types")
+
+# The steps of SherpaSession.update(), in order: the spec keys that make a
+# step run again, and the exception its failures are raised as.  The data
+# is set again for a new statistic, which may have changed its errors.
+_update_steps = (
+    ("method", ("method",), sedexceptions.MethodException),
+    ("data", ("datasets", "stat"), sedexceptions.DataException),
+    ("parameters", ("models", "usermodels"), sedexceptions.ParameterException),
+    ("model", ("models", "usermodels"), sedexceptions.ModelException),
+    ("stat", ("stat",), sedexceptions.StatisticException),
+    )
+
+
+def _collect_arrays(obj, memo):
+    if isinstance(obj, numpy.ndarray):
+        memo[id(obj)] = obj
+    elif isinstance(obj, dict):
+        for value in obj.itervalues():
+            _collect_arrays(value, memo)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _collect_arrays(value, memo)
+
+
+def copy_spec(spec):
+    """
+    Deep copy of a session spec that shares, rather than copies, the
+    decoded data arrays.  Sessions never modify those in place.
+    """
+    memo = {}
+    _collect_arrays(spec, memo)
+    return copy.deepcopy(spec, memo)
+
+
+def share_spec(spec, transport="shm"):
+    """
+    Copy of a session spec for the worker processes, with the decoded
+    arrays of its datasets written to shared memory once and replaced by
+    references.  Workers map them copy-on-write instead of receiving and
+    decoding their own copies.  Returns the copy and the references, for
+    release_spec() once the job is done.  Arrays that cannot be shared are
+    sent as they are.
+    """
+    spec = copy_spec(spec)
+    refs = []
+    try:
+        for data in spec.get("datasets", []):
+            for key in data.keys():
+                if isinstance(data[key], numpy.ndarray):
+                    ref = write_array(data[key], transport)
+                    refs.append(ref)
+                    data[key] = ref
+    except (IOError, OSError), e:
+        info("cannot share data with the workers: " + str(e))
+    return spec, refs
+
+
+def release_spec(refs):
+    for ref in refs:
+        remove_array(ref)
 
 
 def check_for_nans(ui):
@@ -66,6 +135,60 @@ def check_for_nans(ui):
 
         session.set_filter(ii, mask, ignore=True)
 
+#
+## Model type registry
+#
+
+# The same modules Session._add_model_types() would be called with
+_model_modules = (
+    (sherpa.models.basic, (sherpa.models.ArithmeticModel,)),
+    (sherpa.models.template, (sherpa.models.ArithmeticModel,)),
+    (sherpa.astro.models, (sherpa.models.ArithmeticModel,)),
+    (sherpa.instrument, (sherpa.models.Model,)),
+    (sherpa.astro.instrument, (sherpa.models.ArithmeticModel,)),
+    (sherpa.astro.optical, (sherpa.models.ArithmeticModel,)),
+    #(sherpa.astro.xspec, (sherpa.astro.xspec.XSAdditiveModel,
+    #                      sherpa.astro.xspec.XSMultiplicativeModel)),
+    )
+
+_model_types = None
+_model_types_lock = threading.Lock()
+
+
+def _is_subclass(t1, t2):
+    return inspect.isclass(t1) and issubclass(t1, t2) and (t1 is not t2)
+
+
+def get_model_types():
+    """
+    The (name, class) pairs of every model type a session knows about.
+    Walking the model modules is done once per process.
+    """
+    global _model_types
+    with _model_types_lock:
+        if _model_types is None:
+            types = []
+            for module, baselist in _model_modules:
+                for name in module.__all__:
+                    cls = getattr(module, name)
+                    for base in baselist:
+                        if _is_subclass(cls, base):
+                            types.append((name.lower(), cls))
+                            break
+            _model_types = tuple(types)
+    return _model_types
+
+
+def add_model_types(session):
+    """
+    Equivalent to the Session._add_model_types() calls for all of
+    _model_modules, using the cached registry.
+    """
+    for name, cls in get_model_types():
+        session._model_types[name] = ModelWrapper(session, cls)
+    session._model_globals.update(session._model_types)
+
+
 #
 ## Sherpa Session Object
 #
@@ -74,20 +197,19 @@ class SherpaSession(object):
 
     def __init__(self, msg_id=None, mtype=None):
         session = sherpaUI.utils.Session()
-        session._add_model_types(sherpa.models.basic)
-        session._add_model_types(sherpa.models.template)
-        session._add_model_types(sherpa.astro.models)
-        session._add_model_types(sherpa.instrument,
-                                 baselist=(sherpa.models.Model,))
-        session._add_model_types(sherpa.astro.instrument)
-        session._add_model_types(sherpa.astro.optical)
-        #session._add_model_types(sherpa.astro.xspec,
-        #                         (sherpa.astro.xspec.XSAdditiveModel,
-        #                          sherpa.astro.xspec.XSMultiplicativeModel))
+        add_model_types(session)
         self.session = session
         self.msg_id = msg_id
         self.mtype = mtype
 
+        # What this session was built from, see get_spec(), and which of
+        # the steps of update() it is up to date with
+        self.spec = {}
+        self.applied = set()
+        self.filtered = False
+        self.lock = threading.RLock()
+        self.last_used = time.time()
+
         # max_rstat of 3 is unhelpful in SED fitting.
         self.session.set_conf_opt("max_rstat", 1.e+38)
 
@@ -100,10 +222,13 @@ class SherpaSession(object):
             raise TypeError("datamaps is not iterable")
         #keys = ["x", "y", "staterror", "syserror", "weights"]
         keys = ["x", "y", "staterror", "syserror"]
+        self.applied.discard("data")
         for ii, data in enumerate(datamaps):
             for key in keys:
+                # base64 strings, array references, or arrays from a
+                # cached spec that are already decoded
                 if data.has_key(key):
-                    data[key] = decode_string(data[key])
+                    data[key] = decode_array(data[key], native=True)
                     info('decoding' + key)
 
             self.session.set_data(ii, sherpa.data.Data1D(**data))
@@ -114,8 +239,21 @@ class SherpaSession(object):
             info("DataSet %i y: " % ii + numpy.array2string(d.y))
             info("DataSet %i staterror: " % ii + numpy.array2string(d.staterror))
 
+        # datasets left over from an earlier call
+        for ii in self.session.list_data_ids():
+            if ii not in range(len(datamaps)):
+                self.session.delete_data(ii)
+
+        self.spec["datasets"] = datamaps
+        self.applied.add("data")
+
+        # the statistic may change the errors of the data
+        self.applied.discard("stat")
+        self.filtered = False
+
 
     def set_model(self, modelmaps):
+        self.applied.discard("model")
         for ii, model in enumerate(modelmaps):
             if model["name"].strip() == '':
                 raise TypeError("Model expression not found")
@@ -123,8 +261,25 @@ class SherpaSession(object):
             self.session.set_model(ii, model["name"])
             info("Model: " + str(ii) + str(self.session.get_source(ii)))
 
+        # model expressions left over from an earlier call
+        for ii in self.session.list_model_ids():
+            if ii not in range(len(modelmaps)):
+                self.session.delete_model(ii)
+        self.applied.add("model")
+
 
     def set_parameters(self, modelmaps, usermodels):
+        # the parameter maps are consumed below, record them first
+        self.spec["models"] = copy_spec(modelmaps)
+        self.spec["usermodels"] = copy_spec(usermodels)
+
+        # Start from new model components, as a new session would.  The
+        # model expressions refer to the old ones until set_model().
+        self.applied.discard("parameters")
+        self.applied.discard("model")
+        for name in self.session.list_model_components():
+            self.session.delete_model_component(name)
+
         # If entries in usermodels dictionary, interpret them here
         for model_info in usermodels:
             # Check that model name is a string and can be split
@@ -236,9 +391,13 @@ class SherpaSession(object):
 
                 info(str(mdl))
 
+        self.applied.add("parameters")
+
 
     def set_stat(self, statmap):
+        self.applied.discard("stat")
         self.session.set_stat(statmap["name"])
+        self.spec["stat"] = copy_spec(statmap)
 
         # FIXME: A kludge when Specview passes all zeros for staterror
         # for NED SEDs.
@@ -253,10 +412,13 @@ class SherpaSession(object):
                     data.staterror = numpy.ones_like(data.y)
 
         info(statmap["name"] + ": " + self.session.get_stat_name())
+        self.applied.add("stat")
 
 
     def set_method(self, methodmap):
+        self.applied.discard("method")
         self.session.set_method(methodmap["name"])
+        self.spec["method"] = copy_spec(methodmap)
         info(methodmap["name"] + ": ")
         configdict = methodmap.get("config", None)
         if configdict is not None:
@@ -266,6 +428,7 @@ class SherpaSession(object):
                     configdict[key] = None
                 self.session.set_method_opt(key, configdict[key])
         info(str(self.session.get_method_opt()))
+        self.applied.add("method")
 
 
     def set_confidence(self, confidencemap):
@@ -288,6 +451,64 @@ class SherpaSession(object):
                 method_opt(key, val)
         method_opt = getattr(self.session, 'get_%s_opt' % methodname)
         info(str(method_opt()))
+        self.spec["confidence"] = copy_spec(confidencemap)
+
+
+    def get_spec(self, params=None):
+        """
+        A copy of the spec this session was built from, updated with
+        everything in params (entries sent with a call take precedence).
+        """
+        with self.lock:
+            spec = dict(self.spec)
+        if params is not None:
+            spec.update(params)
+        return copy_spec(spec)
+
+
+    def update(self, spec, sent=(), steps=("method", "data", "parameters",
+                                           "model", "stat"),
+               filter_nans=False):
+        """
+        Bring the Sherpa state of this session up to date with spec, the
+        result of get_spec(), for the given steps.  A step is only done
+        again if it failed or was never done, or if one of its keys is
+        in sent, the entries sent with the call.  NaNs are filtered out
+        of the data with filter_nans, and a filtered session otherwise
+        gets its data set again.  Failures are raised as the
+        sedexceptions class the handlers reply with.
+        """
+        with self.lock:
+            if self.filtered and not filter_nans:
+                self.applied.discard("data")
+
+            for name, keys, exception in _update_steps:
+                if name not in steps:
+                    continue
+                if (name in self.applied and
+                    not [key for key in keys if key in sent]):
+                    continue
+                try:
+                    if name == "method":
+                        self.set_method(spec["method"])
+                    elif name == "data":
+                        self.set_data(spec["datasets"])
+                    elif name == "parameters":
+                        self.set_parameters(spec["models"],
+                                            spec.get("usermodels", []))
+                    elif name == "model":
+                        self.set_model(spec["models"])
+                    elif name == "stat":
+                        self.set_stat(spec["stat"])
+                except Exception, e:
+                    raise exception(str(e))
+
+            if filter_nans:
+                try:
+                    check_for_nans(self)
+                except Exception, e:
+                    raise sedexceptions.StatisticException(str(e))
+                self.filtered = True
 
 
     def get_confidence(self, confidencemap):
@@ -301,10 +522,25 @@ class SherpaSession(object):
         return flux_func
 
 
-    def run_confidence(self, confidencemap):
+    def run_confidence(self, confidencemap, parameters=()):
         methodname = confidencemap["name"].strip().lower()
         method = getattr(self.session, methodname)
-        method()
+        method(*parameters)
+
+
+    def get_thawed_pars(self):
+        pars = []
+        parnames = []
+        for ii in self.session.list_data_ids():
+            for par in self.session.get_source(ii).pars:
+                if not par.frozen and par.fullname not in parnames:
+                    pars.append(par)
+                    parnames.append(par.fullname)
+        return pars
+
+
+    def get_thawed_parnames(self):
+        return [par.fullname for par in self.get_thawed_pars()]
 
 
     def get_confidence_results(self, confidencemap, confidence_results=None):
@@ -322,6 +558,22 @@ class SherpaSession(object):
         return results
 
 
+    @staticmethod
+    def merge_confidence_results(results_list):
+        """
+        Combine get_confidence_results() dicts computed for disjoint sets
+        of parameters into one, in the order given.
+        """
+        results = dict(results_list[0])
+        results["parnames"] = []
+        for key in ("parvals", "parmins", "parmaxes"):
+            arrays = [decode_string(res[key]) for res in results_list]
+            results[key] = encode_string(numpy.concatenate(arrays))
+        for res in results_list:
+            results["parnames"].extend(res["parnames"])
+        return results
+
+
     def get_fit_results(self, fit_results=None):
         if fit_results is None:
             fit_results = self.session.get_fit_results()
@@ -343,3 +595,56 @@ class SherpaSession(object):
 
         results["nfev"]      = str(int(fit_results.nfev))
         return results
+
+
+#
+## Per-client session cache
+#
+
+class SessionCache(object):
+    """
+    SherpaSession objects keyed by SAMP sender id, so that the
+    spectrum.fit.set.* mtypes can build up state that later fit,
+    confidence and calc calls reuse.  Least recently used sessions are
+    dropped beyond maxsize, and sessions idle for more than timeout
+    seconds are dropped altogether.
+
+    The handlers bring the cached session up to date with what a call
+    sends (SherpaSession.update) and use it under its lock, rather than
+    building a new one for every call.
+    """
+
+    def __init__(self, maxsize=16, timeout=3600.0):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        for key, ui in self._sessions.items():
+            if now - ui.last_used > self.timeout:
+                info("dropping idle session for " + str(key))
+                del self._sessions[key]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            ui = self._sessions.pop(key, None)
+            if ui is None:
+                ui = SherpaSession()
+            ui.last_used = now
+            self._sessions[key] = ui
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+        return ui
+
+    def discard(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, key):
+        return key in self._sessions
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Jobs executed by the worker processes of sherpa_samp.pool.WorkerPool.
+#
+## Each job receives a plain description of the session (the SAMP params
+## of the fit, with the datasets, models, stat and method maps), rebuilds a
+## SherpaSession from it inside the worker and returns picklable results.
+#
+
+import sherpa_samp.sedexceptions as sedexceptions
+from sherpa_samp.session import SherpaSession, check_for_nans
+from sherpa_samp.grid import calc_stat_grid
+from sherpa_samp.progress import Reporter, ProgressHandler
+from sherpa_samp.jobs import Budget, BudgetExceeded
+
+import logging
+
+__all__ = ('warm_up', 'build_session', 'watch_stat', 'fit_task',
+           'confidence_task', 'grid_task')
+
+
+def warm_up():
+    """
+    Worker initializer, pays for the first session construction before
+    any job arrives.
+    """
+    SherpaSession()
+
+
+def _step(exception, func, *args):
+    try:
+        return func(*args)
+    except sedexceptions.SEDException:
+        raise
+    except Exception, e:
+        raise exception(str(e))
+
+
+def build_session(spec, filter_nans=True):
+    """
+    Same steps as the spectrum.fit.fit handler, failures are raised as
+    the sedexceptions class the handler would have replied with.  The
+    calc handlers do not filter out NaNs, use filter_nans=False for them.
+    """
+    ui = SherpaSession()
+
+    if spec.has_key("method"):
+        _step(sedexceptions.MethodException, ui.set_method, spec["method"])
+
+    _step(sedexceptions.DataException, ui.set_data, spec["datasets"])
+
+    usermodels = []
+    if spec.has_key("usermodels"):
+        usermodels = spec["usermodels"]
+    _step(sedexceptions.ParameterException, ui.set_parameters,
+          spec["models"], usermodels)
+    _step(sedexceptions.ModelException, ui.set_model, spec["models"])
+
+    _step(sedexceptions.StatisticException, ui.set_stat, spec["stat"])
+    if filter_nans:
+        _step(sedexceptions.StatisticException, check_for_nans, ui)
+    return ui
+
+
+def watch_stat(ui, reporter=None, maxnfev=None, kind="fit"):
+    """
+    Wrap the calc_stat method of the current statistic of ui, so that
+    every evaluation made by fit, conf, proj or covar is counted, reported
+    as progress if reporter is given, and BudgetExceeded is raised once
+    there are more than maxnfev of them.
+    """
+    stat = ui.session.get_stat()
+    calc_stat = stat.calc_stat
+    count = [0]
+
+    # The fit sets the values of these parameters before each evaluation.
+    # What calc_stat is called with differs between Sherpa versions (arrays
+    # before 4.9, the data and model after), so it is not looked at.
+    thawed = ui.get_thawed_pars()
+    parnames = [par.fullname for par in thawed]
+
+    def wrapped(*args, **kwargs):
+        if maxnfev is not None and count[0] >= maxnfev:
+            raise BudgetExceeded(Budget.nfev_message(kind, maxnfev))
+        result = calc_stat(*args, **kwargs)
+        count[0] += 1
+        if reporter is not None and reporter.due():
+            statval = result
+            if isinstance(result, tuple):
+                statval = result[0]
+            reporter.send(iteration=count[0], statval=float(statval),
+                          parnames=parnames,
+                          parvals=[float(par.val) for par in thawed])
+        return result
+
+    stat.calc_stat = wrapped
+
+
+def fit_task(spec, progress=None, maxnfev=None):
+    """
+    Fit of spec, with progress records sent under the key progress if
+    given, and at most maxnfev evaluations of the statistic.
+    """
+    ui = build_session(spec)
+    reporter = None
+    if progress is not None:
+        reporter = Reporter(progress, "fit")
+    watch_stat(ui, reporter, maxnfev, "fit")
+    try:
+        ui.session.fit()
+    except Exception, e:
+        raise sedexceptions.FitException(str(e))
+    finally:
+        if reporter is not None:
+            reporter.flush()
+    return ui.get_fit_results()
+
+
+def confidence_task(spec, parname=None, progress=None, maxnfev=None):
+    """
+    Runs the confidence method of spec["confidence"], for all thawed
+    parameters or only for parname.  Progress records, including the
+    lines Sherpa logs, are sent under the key progress if given.
+    """
+    ui = build_session(spec)
+    cdict = spec["confidence"]
+    _step(sedexceptions.ConfidenceException, ui.set_confidence, cdict)
+
+    parameters = ()
+    if parname is not None:
+        parameters = (ui.session.get_par(parname),)
+
+    reporter = None
+    handler = None
+    logger = logging.getLogger('sherpa')
+    if progress is not None:
+        reporter = Reporter(progress, "confidence")
+        handler = ProgressHandler(reporter)
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+    watch_stat(ui, reporter, maxnfev, "confidence")
+    try:
+        ui.run_confidence(cdict, parameters)
+    except BudgetExceeded, e:
+        raise sedexceptions.ConfidenceException(str(e))
+    finally:
+        if handler is not None:
+            logger.removeHandler(handler)
+            reporter.flush()
+
+    return ui.get_confidence_results(cdict)
+
+
+def grid_task(spec, parnames, values):
+    """
+    Statistic values for a chunk of a spectrum.fit.calc.statistic.values
+    grid.
+    """
+    ui = build_session(spec, filter_nans=False)
+    return calc_stat_grid(ui, parnames, values)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## A local stand-in for a SAMP hub, for tests and benchmarks
+#
+## It serves the samp.hub.* methods a client needs to register and answer
+## calls over XML-RPC, with HTTP/1.1 keep-alive and one thread per
+## connection, and records the replies and notifications it gets.  Calls
+## to a registered client are made with StandInHub.call().
+#
+
+import os
+import time
+import uuid
+import tempfile
+import threading
+import xmlrpclib
+from SocketServer import ThreadingMixIn
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+__all__ = ('StandInHub',)
+
+
+class _RequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ()
+
+    def setup(self):
+        SimpleXMLRPCRequestHandler.setup(self)
+        self.server.hub._connected()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Client(object):
+
+    def __init__(self, private_key, public_id):
+        self.private_key = private_key
+        self.public_id = public_id
+        self.metadata = {}
+        self.subscriptions = {}
+        self.url = None
+
+
+class StandInHub(object):
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.secret = uuid.uuid4().hex
+        self.connections = 0
+        self.replies = {}
+        self.notifications = []
+        self.lockfile = None
+        self._clients = {}
+        self._local = threading.local()
+        self._lock = threading.Condition()
+        self._counter = 0
+
+        self.server = _Server((host, port), _RequestHandler,
+                              allow_none=True, logRequests=False)
+        self.server.hub = self
+        self.url = "http://%s:%d/" % self.server.server_address
+        self.id = "hub"
+
+        for name in ("ping", "register", "unregister", "declareMetadata",
+                     "declareSubscriptions", "setXmlrpcCallback",
+                     "getRegisteredClients", "getSubscribedClients",
+                     "getMetadata", "getSubscriptions", "notify", "notifyAll",
+                     "reply"):
+            self.server.register_function(getattr(self, "_" + name),
+                                          "samp.hub." + name)
+
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name="stand-in-hub")
+        self._thread.daemon = True
+
+    def start(self, lockfile=True):
+        """
+        Start serving, and write a lockfile for it, whose path is returned,
+        unless lockfile is False.
+        """
+        self._thread.start()
+        if lockfile:
+            fd, self.lockfile = tempfile.mkstemp(prefix="samp-")
+            with os.fdopen(fd, "w") as out:
+                out.write("samp.secret=%s\n" % self.secret)
+                out.write("samp.hub.xmlrpc.url=%s\n" % self.url)
+                out.write("samp.profile.version=1.2\n")
+                out.write("hub.label=stand-in hub\n")
+        return self.lockfile
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.lockfile is not None and os.path.exists(self.lockfile):
+            os.unlink(self.lockfile)
+
+    def _connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def _client(self, private_key):
+        client = self._clients.get(private_key)
+        if client is None:
+            raise xmlrpclib.Fault(1, "unknown private key")
+        return client
+
+    #
+    ## samp.hub.* methods
+    #
+
+    def _ping(self):
+        return ""
+
+    def _register(self, secret):
+        if secret != self.secret:
+            raise xmlrpclib.Fault(1, "wrong secret")
+        with self._lock:
+            self._counter += 1
+            client = _Client(uuid.uuid4().hex, "c%d" % self._counter)
+            self._clients[client.private_key] = client
+        return {"samp.private-key": client.private_key,
+                "samp.hub-id": self.id,
+                "samp.self-id": client.public_id}
+
+    def _unregister(self, private_key):
+        with self._lock:
+            self._clients.pop(private_key, None)
+        return ""
+
+    def _declareMetadata(self, private_key, metadata):
+        self._client(private_key).metadata = metadata
+        return ""
+
+    def _declareSubscriptions(self, private_key, subscriptions):
+        client = self._client(private_key)
+        with self._lock:
+            client.subscriptions = subscriptions
+            self._lock.notify_all()
+        return ""
+
+    def _setXmlrpcCallback(self, private_key, url):
+        client = self._client(private_key)
+        client.url = url
+        return ""
+
+    def _getRegisteredClients(self, private_key):
+        return [client.public_id for client in self._clients.values()
+                if client.private_key != private_key]
+
+    def _getSubscribedClients(self, private_key, mtype):
+        return dict((client.public_id, {}) for client in self._clients.values()
+                    if client.private_key != private_key)
+
+    def _getMetadata(self, private_key, client_id):
+        for client in self._clients.values():
+            if client.public_id == client_id:
+                return client.metadata
+        return {}
+
+    def _getSubscriptions(self, private_key, client_id):
+        for client in self._clients.values():
+            if client.public_id == client_id:
+                return client.subscriptions
+        return {}
+
+    def _notify(self, private_key, recipient_id, message):
+        self._client(private_key)
+        with self._lock:
+            self.notifications.append(message)
+            self._lock.notify_all()
+        return ""
+
+    def _notifyAll(self, private_key, message):
+        self._client(private_key)
+        with self._lock:
+            self.notifications.append(message)
+            self._lock.notify_all()
+        return []
+
+    def _reply(self, private_key, msg_id, response):
+        self._client(private_key)
+        with self._lock:
+            self.replies[msg_id] = response
+            self._lock.notify_all()
+        return ""
+
+    #
+    ## Driving the client under test
+    #
+
+    def register_client(self):
+        """
+        Register a client of our own, returns its private key, e.g. for
+        replying with sherpa_samp.hub.HubConnection.
+        """
+        return self._register(self.secret)["samp.private-key"]
+
+    def call(self, recipient_id, message, sender_id="c0"):
+        """
+        Send message to the registered client recipient_id as a call,
+        returns the msg_id that the reply will come with.
+        """
+        with self._lock:
+            self._counter += 1
+            msg_id = "msg-%d" % self._counter
+        for client in self._clients.values():
+            if client.public_id == recipient_id:
+                self._proxy(client).samp.client.receiveCall(
+                    client.private_key, sender_id, msg_id, message)
+                return msg_id
+        raise ValueError("no client " + recipient_id)
+
+    def _proxy(self, client):
+        # one proxy per client and calling thread, an xmlrpclib proxy
+        # cannot be shared between threads
+        proxies = getattr(self._local, "proxies", None)
+        if proxies is None:
+            proxies = self._local.proxies = {}
+        proxy = proxies.get(client.url)
+        if proxy is None:
+            proxy = proxies[client.url] = xmlrpclib.ServerProxy(client.url,
+                                                                allow_none=1)
+        return proxy
+
+    def wait_subscribed(self, timeout=None):
+        """
+        Wait for a client to declare its subscriptions, i.e. to be ready
+        for calls, returns its public id, or None after timeout seconds.
+        """
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        with self._lock:
+            while True:
+                for client in self._clients.values():
+                    if client.subscriptions:
+                        return client.public_id
+                if end is not None and time.time() >= end:
+                    return None
+                self._lock.wait(None if end is None else end - time.time())
+
+    def wait_reply(self, msg_id, timeout=None):
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        with self._lock:
+            while not self.replies.has_key(msg_id):
+                if end is not None and time.time() >= end:
+                    return None
+                self._lock.wait(None if end is None else end - time.time())
+            return self.replies.pop(msg_id)
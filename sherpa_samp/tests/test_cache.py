@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from sherpa_samp.utils import encode_string
+from sherpa_samp.cache import (LRUCache, FitResultCache, WarmStartStore,
+                               hash_spec)
+
+
+class CacheTester(unittest.TestCase):
+
+    spec = {'datasets': [{'name': 'sed', 'x': numpy.arange(5.0),
+                          'y': numpy.ones(5)}],
+            'models': [{'name': 'powlaw1d.p1', 'parts': []}],
+            'stat': {'name': 'chi2'},
+            'method': {'name': 'levmar'}}
+
+    results = {'parnames': ['p1.gamma'], 'parvals': [1.5], 'statval': 2.0}
+
+    def test_lru(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_lru_bytes(self):
+        cache = LRUCache(maxsize=10, maxbytes=100, sizeof=len)
+        cache.put('a', 'x' * 40)
+        cache.put('b', 'x' * 40)
+        self.assertEqual(cache.nbytes, 80)
+        cache.get('a')
+        cache.put('c', 'x' * 40)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.nbytes, 80)
+        # too large for the cache at all
+        cache.put('d', 'x' * 101)
+        self.assertFalse('d' in cache)
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_hash(self):
+        other = {'datasets': [{'name': 'sed', 'x': numpy.arange(5.0),
+                               'y': numpy.ones(5)}],
+                 'method': {'name': 'levmar'},
+                 'stat': {'name': 'chi2'},
+                 'models': [{'name': 'powlaw1d.p1', 'parts': []}],
+                 'confidence': {'name': 'conf'}}
+        self.assertEqual(hash_spec(self.spec), hash_spec(other))
+
+        other['datasets'][0]['y'] = numpy.ones(5) * 2
+        self.assertNotEqual(hash_spec(self.spec), hash_spec(other))
+
+    def test_results_are_copies(self):
+        cache = FitResultCache(maxsize=4)
+        key = cache.key(self.spec)
+        cache.put(key, self.results)
+        results = cache.get(key)
+        results['parvals'][0] = 0.0
+        self.assertEqual(cache.get(key), self.results)
+        self.assertEqual(cache.get('missing'), None)
+
+    def test_disk(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = FitResultCache(maxsize=4, directory=directory)
+            key = cache.key(self.spec)
+            cache.put(key, self.results)
+
+            # a new cache, as after a restart
+            cache = FitResultCache(maxsize=4, directory=directory)
+            self.assertEqual(cache.get(key), self.results)
+        finally:
+            shutil.rmtree(directory)
+
+    def models(self):
+        return [{'name': 'p1', 'parts': [{'name': 'powlaw1d.p1', 'pars': [
+            {'name': 'p1.gamma', 'val': '1.0', 'min': '-10', 'max': '10',
+             'frozen': '0'},
+            {'name': 'p1.ref', 'val': '1.0', 'min': '-10', 'max': '10',
+             'frozen': '1'},
+            {'name': 'p1.ampl', 'val': '1.0', 'min': '0', 'max': '10',
+             'frozen': '0'}]}]}]
+
+    def test_warm_start(self):
+        store = WarmStartStore()
+        results = {'succeeded': '1', 'parnames': ['p1.gamma', 'p1.ampl'],
+                   'parvals': encode_string(numpy.array([2.5, 20.0]))}
+        store.store('client', self.models(), results)
+
+        models = self.models()
+        self.assertFalse(store.seed('other-client', models))
+        self.assertTrue(store.seed('client', models))
+        pars = models[0]['parts'][0]['pars']
+        self.assertEqual([par['val'] for par in pars], ['2.5', '1.0', '10.0'])
+
+        # a different set of parameters is not seeded
+        models = self.models()
+        models[0]['parts'][0]['pars'].pop()
+        self.assertFalse(store.seed('client', models))
+
+        results['succeeded'] = '0'
+        store = WarmStartStore()
+        store.store('client', self.models(), results)
+        self.assertFalse(store.seed('client', self.models()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import threading
+import unittest
+
+from sherpa_samp.dispatcher import Dispatcher
+
+
+class DispatcherTester(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.replies = []
+        self.rejected = []
+        self.dispatcher = Dispatcher(expensive=("spectrum.fit.fit",),
+                                     cheap_threads=1, expensive_threads=1,
+                                     maxsize=1, on_reject=self.reject)
+
+    def tearDown(self):
+        self.release.set()
+        self.dispatcher.shutdown()
+
+    def reject(self, msg_id, mtype):
+        self.rejected.append(msg_id)
+
+    def slow_fit(self, private_key, sender_id, msg_id, mtype, params, extra):
+        self.release.wait(10)
+        self.replies.append(msg_id)
+
+    def ping(self, private_key, sender_id, msg_id, mtype, params, extra):
+        self.replies.append(msg_id)
+        params.set()
+
+    def test_cheap_calls_do_not_wait(self):
+        fit = self.dispatcher.wrap(self.slow_fit)
+        ping = self.dispatcher.wrap(self.ping)
+
+        fit("key", "c1", "fit-1", "spectrum.fit.fit", {}, {})
+        done = threading.Event()
+        ping("key", "c1", "ping-1", "sherpa.ping", done, {})
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(self.replies, ["ping-1"])
+
+    def test_full_lane_rejects(self):
+        fit = self.dispatcher.wrap(self.slow_fit)
+        # one running, one queued, the third does not fit
+        fit("key", "c1", "fit-1", "spectrum.fit.fit", {}, {})
+        while self.dispatcher.costly.qsize():
+            pass
+        fit("key", "c1", "fit-2", "spectrum.fit.fit", {}, {})
+        fit("key", "c1", "fit-3", "spectrum.fit.fit", {}, {})
+        self.assertEqual(self.rejected, ["fit-3"])
+
+    def test_sender_of(self):
+        ping = self.dispatcher.wrap(self.ping)
+        done = threading.Event()
+        ping("key", "c2", "ping-2", "sherpa.ping", done, {})
+        self.assertTrue(done.wait(5))
+        self.assertEqual(self.dispatcher.sender_of("ping-2"), "c2")
+        self.assertEqual(self.dispatcher.sender_of("ping-2", forget=True),
+                         "c2")
+        self.assertEqual(self.dispatcher.sender_of("ping-2"), None)
+
+    def test_wrap_keeps_name(self):
+        self.assertEqual(self.dispatcher.wrap(self.ping).__name__, "ping")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import time
+import unittest
+import numpy
+
+from sherpa_samp.utils import encode_string
+from sherpa_samp.grid import read_grid, fill_grid, split_grid, map_grid
+from sherpa_samp.pool import WorkerPool, JobError
+
+
+def chunk_task(secs):
+    if secs < 0:
+        raise ValueError("bad chunk")
+    time.sleep(secs)
+    return secs
+
+
+class GridTester(unittest.TestCase):
+
+    def test_list_of_maps(self):
+        params = {'params': [{'p1.gamma': '1.0', 'p1.ampl': '2.0'},
+                             {'p1.gamma': '1.5'},
+                             {'p1.ampl': '3.0'}]}
+        parnames, values = read_grid(params)
+        self.assertEqual(sorted(parnames), ['p1.ampl', 'p1.gamma'])
+
+        gamma = parnames.index('p1.gamma')
+        ampl = parnames.index('p1.ampl')
+        self.assertTrue(numpy.isnan(values[1, ampl]))
+
+        values = fill_grid(values, [0.0, 0.0])
+        self.assertEqual(list(values[:, gamma]), [1.0, 1.5, 1.5])
+        self.assertEqual(list(values[:, ampl]), [2.0, 2.0, 3.0])
+
+    def test_fill_from_initial(self):
+        values = numpy.array([[numpy.nan, 1.0], [2.0, numpy.nan]])
+        values = fill_grid(values, [5.0, 6.0])
+        self.assertEqual(values.tolist(), [[5.0, 1.0], [2.0, 1.0]])
+
+    def test_columns(self):
+        gamma = numpy.linspace(0.5, 2.5, 5)
+        ampl = numpy.linspace(1.0, 5.0, 5)
+        params = {'grid': {'parnames': ['p1.gamma', 'p1.ampl'],
+                           'values': [encode_string(gamma),
+                                      encode_string(ampl)]}}
+        parnames, values = read_grid(params)
+        self.assertEqual(parnames, ['p1.gamma', 'p1.ampl'])
+        self.assertEqual(values.shape, (5, 2))
+        self.assertTrue(numpy.array_equal(values[:, 0], gamma))
+        self.assertTrue(numpy.array_equal(values[:, 1], ampl))
+
+    def test_split(self):
+        values = numpy.arange(20.0).reshape(10, 2)
+        chunks = split_grid(values, 4)
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 2])
+        self.assertTrue(numpy.array_equal(numpy.concatenate(chunks), values))
+
+
+class MapGridTester(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(size=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_results(self):
+        results = map_grid(self.pool, "grid-1", chunk_task,
+                           [(0.0,), (0.01,), (0.02,)])
+        self.assertEqual(list(results), [0.0, 0.01, 0.02])
+
+    def test_failed_chunk_cancels_the_others(self):
+        tt = time.time()
+        results = map_grid(self.pool, "grid-2", chunk_task,
+                           [(-1.0,), (30.0,), (30.0,), (30.0,)])
+        self.assertRaises(JobError, list, results)
+        # the killed workers are replaced in the background
+        for ii in range(100):
+            if not self.pool.pids("grid-2"):
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.pool.pids("grid-2"), [])
+        self.assertTrue(time.time() - tt < 10)
+        self.assertEqual(self.pool.apply(chunk_task, (0.0,)), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
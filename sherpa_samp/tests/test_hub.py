@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import threading
+import unittest
+
+from sherpa_samp.hub import HubConnection
+from sherpa_samp.reply import ReplySender
+from sherpa_samp.tests.hub import StandInHub
+
+
+class HubConnectionTester(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = StandInHub()
+        self.hub.start(lockfile=False)
+        self.conn = HubConnection(self.hub.url, self.hub.register_client())
+
+    def tearDown(self):
+        self.conn.close()
+        self.hub.stop()
+
+    def test_keep_alive(self):
+        for ii in range(20):
+            self.conn.reply("msg-%d" % ii, {"samp.status": "samp.ok"})
+        self.assertEqual(len(self.hub.replies), 20)
+        self.assertEqual(self.hub.connections, 1)
+
+    def test_connection_per_thread(self):
+        def reply(index):
+            for ii in range(10):
+                self.conn.reply("msg-%d-%d" % (index, ii),
+                                {"samp.status": "samp.ok"})
+
+        threads = [threading.Thread(target=reply, args=(ii,))
+                   for ii in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.hub.replies), 40)
+        self.assertEqual(self.conn.connections(), 4)
+        self.assertEqual(self.hub.connections, 4)
+
+    def test_reconnect(self):
+        self.conn.reply("msg-1", {})
+        self.conn.close()
+        self.conn.reply("msg-2", {})
+        self.assertEqual(sorted(self.hub.replies.keys()), ["msg-1", "msg-2"])
+
+    def test_reply_sender(self):
+        sender = ReplySender(self.conn.reply, threads=4)
+        for ii in range(40):
+            sender.put("msg-%d" % ii, {"samp.status": "samp.ok"},
+                       "client-%d" % (ii % 8))
+        self.assertTrue(sender.flush(10))
+        self.assertEqual(len(self.hub.replies), 40)
+        self.assertEqual(sender.stats["sent"], 40)
+
+    def test_notify_all(self):
+        self.conn.notify_all({"samp.mtype": "x.y", "samp.params": {}})
+        self.assertEqual(self.hub.notifications[0]["samp.mtype"], "x.y")
+
+
+if __name__ == '__main__':
+    unittest.main()
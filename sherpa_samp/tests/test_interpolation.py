@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2013, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+import numpy
+
+from scipy import interpolate
+
+from sherpa_samp.interpolation import (interp1d, average_duplicates,
+                                       spline_interp, local_neville,
+                                       InterpolantCache)
+
+
+def reference_interp1d(xout, xin, yin):
+    # the list and dict based implementation interp1d replaced
+    pairs = sorted(zip(xin, yin), key=lambda pair: pair[0])
+    ds = {}
+    for x, y in pairs:
+        ds.setdefault(x, []).append(y)
+    x = sorted(ds.keys())
+    y = [numpy.mean(ds[key]) for key in x]
+    f = interpolate.interp1d(x, y, bounds_error=False, kind='linear')
+    return f(xout)
+
+
+class InterpolationTester(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(42)
+        # three segments on partly overlapping grids, i.e. with duplicates
+        self.x = numpy.concatenate([numpy.arange(0, 100, 1.0),
+                                    numpy.arange(50, 150, 1.0),
+                                    numpy.arange(0, 150, 3.0)])
+        self.y = rng.uniform(1, 2, self.x.size)
+        rng.shuffle(self.x)
+        self.xout = numpy.linspace(-10, 160, 500)
+
+    def test_average_duplicates(self):
+        x, y = average_duplicates([3, 1, 2, 1, 3, 3], [1, 2, 3, 4, 5, 9])
+        numpy.testing.assert_array_equal(x, [1, 2, 3])
+        numpy.testing.assert_array_equal(y, [3, 3, 5])
+
+    def test_no_duplicates(self):
+        x, y = average_duplicates([3, 1, 2], [30, 10, 20])
+        numpy.testing.assert_array_equal(x, [1, 2, 3])
+        numpy.testing.assert_array_equal(y, [10, 20, 30])
+
+    def test_same_as_reference(self):
+        expected = reference_interp1d(self.xout, self.x, self.y)
+        result = interp1d(self.xout, self.x, self.y)
+        numpy.testing.assert_array_equal(numpy.isnan(result),
+                                         numpy.isnan(expected))
+        numpy.testing.assert_allclose(result, expected, rtol=1.e-12)
+
+    def test_lists(self):
+        result = interp1d(list(self.xout), list(self.x), list(self.y))
+        numpy.testing.assert_allclose(
+            result, reference_interp1d(self.xout, self.x, self.y),
+            rtol=1.e-12)
+
+
+def reference_neville(xout, xin, yin):
+    # Neville's algorithm on all the points, like sherpa.utils.neville
+    result = []
+    for x in xout:
+        p = list(yin)
+        for j in range(1, len(xin)):
+            for i in range(len(xin) - j):
+                p[i] = (((x - xin[i + j]) * p[i] + (xin[i] - x) * p[i + 1]) /
+                        (xin[i] - xin[i + j]))
+        result.append(p[0])
+    return numpy.array(result)
+
+
+class LocalNevilleTester(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.x = numpy.sort(rng.uniform(0, 10, 200))
+        self.xout = numpy.linspace(-1, 11, 1000)
+
+    def test_cubic(self):
+        # exact for polynomials of degree below the order, also outside
+        cubic = lambda x: 0.5 * x ** 3 - 2 * x ** 2 + x - 3
+        result = local_neville(self.xout, self.x[::-1], cubic(self.x[::-1]))
+        numpy.testing.assert_allclose(result, cubic(self.xout), rtol=1.e-9)
+
+    def test_same_as_neville(self):
+        # with as many points as the order it is the full interpolation
+        x = numpy.array([1.0, 2.0, 4.0, 5.0, 7.0])
+        y = numpy.array([3.0, -1.0, 2.0, 0.5, 4.0])
+        xout = numpy.linspace(0, 8, 50)
+        numpy.testing.assert_allclose(local_neville(xout, x, y, order=5),
+                                      reference_neville(xout, x, y),
+                                      rtol=1.e-12)
+        numpy.testing.assert_allclose(local_neville(xout, x, y, order=9),
+                                      reference_neville(xout, x, y),
+                                      rtol=1.e-12)
+
+    def test_window(self):
+        y = numpy.sin(self.x)
+        xout = self.xout[100:900]
+        result = local_neville(xout, self.x, y)
+        for index in (0, 333, 799):
+            point = xout[index]
+            nearest = numpy.searchsorted(self.x, point) - 2
+            window = slice(nearest, nearest + 4)
+            self.assertAlmostEqual(
+                result[index],
+                reference_neville([point], self.x[window], y[window])[0],
+                places=12)
+
+    def test_duplicates(self):
+        x = numpy.concatenate([self.x, self.x])
+        y = numpy.concatenate([self.x ** 2 - 1, self.x ** 2 + 1])
+        numpy.testing.assert_allclose(local_neville(self.xout, x, y),
+                                      self.xout ** 2, rtol=1.e-9,
+                                      atol=1.e-9)
+
+
+class InterpolantCacheTester(unittest.TestCase):
+
+    def setUp(self):
+        self.x = numpy.linspace(0, 10, 200)
+        self.y = numpy.sin(self.x)
+
+    def linear(self, xout, xin, yin):
+        return numpy.interp(xout, xin, yin)
+
+    def test_reuse(self):
+        cache = InterpolantCache()
+        for function in (interp1d, spline_interp, local_neville,
+                         self.linear):
+            for nbins in (50, 100):
+                xout = numpy.linspace(1, 9, nbins)
+                result = cache.get(function, self.x, self.y)(xout)
+                numpy.testing.assert_allclose(
+                    result, function(xout, self.x, self.y), rtol=1.e-12)
+        self.assertEqual(cache.misses, 4)
+        self.assertEqual(cache.hits, 4)
+
+        # other data is another interpolant
+        cache.get(interp1d, self.x, self.y * 2)
+        self.assertEqual(cache.misses, 5)
+
+    def test_eviction(self):
+        # room for about two interpolants of this data
+        cache = InterpolantCache(maxbytes=5 * 200 * 8)
+        for scale in range(4):
+            cache.get(self.linear, self.x, self.y * scale)
+        self.assertEqual(len(cache.cache), 2)
+        self.assertTrue(cache.cache.nbytes <= 5 * 200 * 8)
+        cache.get(self.linear, self.x, self.y * 3)
+        self.assertEqual(cache.hits, 1)
+        cache.get(self.linear, self.x, self.y * 0)
+        self.assertEqual(cache.misses, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import time
+import unittest
+
+from sherpa_samp.pool import WorkerPool, JobCancelled
+from sherpa_samp.jobs import JobRegistry, Budget, DONE, STOPPED, get_rss
+
+
+def sleep(secs):
+    time.sleep(secs)
+    return secs
+
+
+def allocate(megabytes, secs):
+    data = 'x' * (megabytes * 1024 * 1024)
+    time.sleep(secs)
+    return len(data)
+
+
+class JobRegistryTester(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(size=2)
+        self.jobs = JobRegistry()
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_finish(self):
+        job = self.jobs.start('msg-1', 'client-1', 'spectrum.fit.fit', 'fit',
+                              self.pool)
+        self.assertEqual(self.pool.apply(sleep, (0.1,), job.key), 0.1)
+        self.assertTrue(self.jobs.finish(job))
+        self.assertEqual(job.state, DONE)
+        self.assertEqual(len(self.jobs), 0)
+        self.assertEqual(self.jobs.stop(msg_id='msg-1'), [])
+
+    def test_stop_one(self):
+        job1 = self.jobs.start('msg-1', 'client-1', 'spectrum.fit.fit', 'fit',
+                               self.pool)
+        job2 = self.jobs.start('msg-2', 'client-1', 'spectrum.fit.fit', 'fit',
+                               self.pool)
+        task1 = self.pool.submit(sleep, (30,), job1.key)
+        task2 = self.pool.submit(sleep, (0.5,), job2.key)
+        time.sleep(0.2)
+
+        self.assertEqual(job1.pids(), self.pool.pids(('client-1', 'msg-1')))
+        self.assertEqual(len(job1.pids()), 1)
+
+        # another client cannot stop it
+        self.assertEqual(self.jobs.stop('client-2', 'msg-1'), [])
+
+        stopped = self.jobs.stop('client-1', 'msg-1')
+        self.assertEqual(stopped, [job1])
+        job1.cancel()
+        self.assertRaises(JobCancelled, task1.get)
+        self.assertFalse(self.jobs.finish(job1))
+        self.assertEqual(job1.state, STOPPED)
+
+        # the other fit is untouched
+        self.assertEqual(task2.get(), 0.5)
+        self.assertTrue(self.jobs.finish(job2))
+
+    def test_same_msg_id(self):
+        # msg_ids are only unique for one client
+        job1 = self.jobs.start('msg-1', 'client-1', 'spectrum.fit.fit', 'fit',
+                               self.pool)
+        job2 = self.jobs.start('msg-1', 'client-2', 'spectrum.fit.fit', 'fit',
+                               self.pool)
+        self.assertEqual(len(self.jobs), 2)
+        task1 = self.pool.submit(sleep, (30,), job1.key)
+        task2 = self.pool.submit(sleep, (0.5,), job2.key)
+        time.sleep(0.2)
+
+        self.assertEqual(self.jobs.stop('client-1', 'msg-1', 'fit'), [job1])
+        job1.cancel()
+        self.assertRaises(JobCancelled, task1.get)
+
+        # the job of the other client is untouched
+        self.assertEqual(self.jobs.jobs(), [job2])
+        self.assertEqual(task2.get(), 0.5)
+        self.assertTrue(self.jobs.finish(job2))
+        self.assertEqual(len(self.jobs), 0)
+
+    def test_list(self):
+        self.jobs.start('msg-1', 'client-1', 'spectrum.fit.fit', 'fit',
+                        self.pool)
+        self.jobs.start('msg-2', 'client-2', 'spectrum.fit.confidence',
+                        'confidence', self.pool)
+        jobs = self.jobs.jobs('client-2')
+        self.assertEqual([job.msg_id for job in jobs], ['msg-2'])
+        self.assertEqual(jobs[0].describe()['kind'], 'confidence')
+        self.assertEqual(len(self.jobs.stop(kind='fit')), 1)
+        self.assertEqual(len(self.jobs), 1)
+
+    def test_walltime(self):
+        job = self.jobs.start('msg-1', 'client-1', 'spectrum.fit.fit', 'fit',
+                              self.pool, Budget(walltime=0.2))
+        task = self.pool.submit(sleep, (30,), job.key)
+        self.assertEqual(self.jobs.check(), [])
+
+        time.sleep(0.3)
+        stopped = self.jobs.check()
+        self.assertEqual(len(stopped), 1)
+        self.assertTrue(stopped[0][0] is job)
+        self.assertEqual(stopped[0][1],
+                         "Fit exceeded the wall time budget of 0.2 s")
+        job.cancel()
+        self.assertRaises(JobCancelled, task.get)
+        self.assertFalse(self.jobs.finish(job))
+
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "no /proc")
+    def test_rss(self):
+        self.assertTrue(get_rss(os.getpid()) > 0)
+
+        job = self.jobs.start('msg-1', 'client-1', 'spectrum.fit.confidence',
+                              'confidence', self.pool, Budget(rss=64))
+        task = self.pool.submit(allocate, (128, 30), job.key)
+        stopped = []
+        for ii in range(50):
+            stopped = self.jobs.check()
+            if stopped:
+                break
+            time.sleep(0.1)
+        self.assertEqual(stopped[0][1],
+                         "Confidence exceeded the memory budget of 64 MB")
+        job.cancel()
+        self.assertRaises(JobCancelled, task.get)
+
+    def test_watch(self):
+        exceeded = []
+        self.jobs.watch(lambda job, reason: exceeded.append(job.msg_id),
+                        interval=0.05)
+        self.jobs.start('msg-1', 'client-1', 'spectrum.fit.fit', 'fit',
+                        self.pool, Budget(walltime=0.1))
+        time.sleep(0.5)
+        self.assertEqual(exceeded, ['msg-1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
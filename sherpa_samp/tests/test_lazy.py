@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from sherpa_samp.lazy import LazyModule, Prewarm
+
+
+class LazyModuleTester(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, "lazy_example.py"), "w") as out:
+            out.write("value = 42\n")
+            out.write("def double(x):\n    return 2 * x\n")
+        sys.path.insert(0, self.dir)
+
+    def tearDown(self):
+        sys.path.remove(self.dir)
+        sys.modules.pop("lazy_example", None)
+        shutil.rmtree(self.dir)
+
+    def test_import_on_first_use(self):
+        module = LazyModule("lazy_example")
+        self.assertFalse(module.loaded)
+        self.assertFalse(sys.modules.has_key("lazy_example"))
+
+        self.assertEqual(module.double(3), 6)
+        self.assertTrue(module.loaded)
+        self.assertTrue(module.load() is sys.modules["lazy_example"])
+
+    def test_import_error(self):
+        module = LazyModule("no_such_module_here")
+        self.assertRaises(ImportError, getattr, module, "value")
+        self.assertFalse(module.loaded)
+
+    def test_prewarm(self):
+        module = LazyModule("lazy_example")
+        called = []
+        prewarm = Prewarm([LazyModule("no_such_module_here"), module,
+                           lambda: called.append(module.value)])
+        prewarm.start()
+        prewarm.start()
+        self.assertTrue(prewarm.wait(10))
+        self.assertTrue(module.loaded)
+        self.assertEqual(called, [42])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy
+
+from sherpa_samp.metrics import Histogram, Metrics
+from sherpa_samp.dispatcher import Dispatcher
+from sherpa_samp.reply import ReplySender
+from sherpa_samp.utils import encode_string
+from sherpa_samp.transport import decode_array, encode_array
+
+
+class HistogramTester(unittest.TestCase):
+
+    def test_percentiles(self):
+        hist = Histogram()
+        self.assertEqual(hist.percentile(50), 0.0)
+        for ii in range(99):
+            hist.add(0.001)
+        hist.add(2.0)
+        self.assertEqual(hist.count, 100)
+        self.assertTrue(0.001 <= hist.percentile(50) < 0.002)
+        self.assertTrue(0.001 <= hist.percentile(99) < 0.002)
+        self.assertEqual(hist.percentile(100), 2.0)
+        self.assertEqual(hist.max, 2.0)
+        self.assertAlmostEqual(hist.mean(), (0.099 + 2.0) / 100)
+
+
+class MetricsTester(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.x = numpy.arange(100000, dtype=float)
+
+    def handler(self, private_key, sender_id, msg_id, mtype, params, extra):
+        x = decode_array(params["x"])
+        time.sleep(0.05)
+        params["x"] = encode_array(x * 2)
+        if params.get("fail"):
+            self.metrics.outcome(mtype, "FitException")
+        else:
+            self.metrics.outcome(mtype)
+
+    def test_phases(self):
+        handler = self.metrics.instrument(self.handler)
+        self.metrics.received("msg-1", "spectrum.fit.fit")
+        time.sleep(0.02)
+        handler("key", "c1", "msg-1", "spectrum.fit.fit",
+                {"x": encode_string(self.x)}, {})
+        self.metrics.replied("msg-1", 0.01)
+        handler("key", "c1", "msg-2", "spectrum.fit.fit",
+                {"x": encode_string(self.x), "fail": True}, {})
+
+        stats = self.metrics.snapshot()["mtypes"]["spectrum.fit.fit"]
+        self.assertEqual(stats["calls"], {"ok": 1, "FitException": 1})
+        self.assertEqual(stats["queue"]["count"], 1)
+        self.assertTrue(stats["queue"]["total"] >= 0.02)
+        self.assertEqual(stats["reply"]["count"], 1)
+        self.assertEqual(stats["compute"]["count"], 2)
+        self.assertTrue(stats["compute"]["total"] >= 0.1)
+        self.assertTrue(stats["decode"]["total"] > 0.0)
+        self.assertTrue(stats["encode"]["total"] > 0.0)
+
+        # outside a handler nothing is recorded
+        encode_array(self.x)
+        stats = self.metrics.snapshot()["mtypes"]["spectrum.fit.fit"]
+        self.assertEqual(stats["encode"]["count"], 2)
+
+    def test_dispatcher_and_replies(self):
+        sent = threading.Event()
+
+        def send(msg_id, response):
+            pass
+
+        replies = ReplySender(send, on_sent=self.metrics.replied)
+
+        def ping(private_key, sender_id, msg_id, mtype, params, extra):
+            self.metrics.outcome(mtype)
+            replies.put(msg_id, {})
+            sent.set()
+
+        dispatcher = Dispatcher(on_receive=self.metrics.received)
+        dispatcher.wrap(self.metrics.instrument(ping))("key", "c1", "msg-1",
+                                                       "sherpa.ping", {}, {})
+        self.assertTrue(sent.wait(5))
+        self.assertTrue(replies.flush(5))
+        dispatcher.shutdown()
+
+        stats = self.metrics.snapshot()["mtypes"]["sherpa.ping"]
+        self.assertEqual(stats["calls"], {"ok": 1})
+        for phase in ("queue", "decode", "compute", "encode", "reply"):
+            self.assertEqual(stats[phase]["count"], 1)
+
+    def test_dump(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "stats.json")
+            self.metrics.observe("sherpa.ping", "compute", 0.5)
+            self.metrics.dump(path, {"jobs": 0})
+            with open(path) as stats:
+                stats = json.load(stats)
+            self.assertEqual(stats["jobs"], 0)
+            self.assertEqual(
+                stats["mtypes"]["sherpa.ping"]["compute"]["count"], 1)
+            self.assertEqual(os.listdir(directory), ["stats.json"])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_reset(self):
+        self.metrics.observe("sherpa.ping", "compute", 0.5)
+        self.metrics.outcome("sherpa.ping")
+        self.metrics.reset()
+        self.assertEqual(self.metrics.snapshot()["mtypes"], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
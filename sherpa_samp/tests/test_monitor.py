@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from sherpa_samp.monitor import HubMonitor, lockfile_path
+from sherpa_samp.dispatcher import Dispatcher
+from sherpa_samp.hub import HubConnection
+from sherpa_samp.tests.hub import StandInHub
+
+
+class FakeClient(object):
+    """
+    Connects whenever the lockfile exists.
+    """
+
+    def __init__(self, lockfile):
+        self.lockfile = lockfile
+        self.connects = 0
+        self.up = False
+
+    def connect(self):
+        if not os.path.exists(self.lockfile):
+            raise IOError("no hub")
+        self.connects += 1
+        self.up = True
+
+    def is_connected(self):
+        return self.up and os.path.exists(self.lockfile)
+
+
+class HubMonitorTester(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.lockfile = os.path.join(self.dir, ".samp")
+        self.client = FakeClient(self.lockfile)
+        self.monitor = HubMonitor(self.client.connect,
+                                  self.client.is_connected,
+                                  lockfile=self.lockfile, poll_interval=0.05,
+                                  check_interval=60.0, timeout=60.0,
+                                  base=0.05, cap=0.2)
+        self.thread = threading.Thread(target=self.monitor.run)
+        self.thread.daemon = True
+
+    def tearDown(self):
+        self.monitor.stop()
+        if self.thread.isAlive():
+            self.thread.join(5)
+        shutil.rmtree(self.dir)
+
+    def touch(self):
+        with open(self.lockfile, "w") as out:
+            out.write("samp.hub.xmlrpc.url=http://localhost:1/\n")
+
+    def test_connects_when_hub_appears(self):
+        self.thread.start()
+        time.sleep(0.3)
+        self.assertFalse(self.monitor.connected.is_set())
+
+        self.touch()
+        self.assertTrue(self.monitor.connected.wait(5))
+        self.assertEqual(self.client.connects, 1)
+
+    def test_lockfile_removal_wakes_the_monitor(self):
+        self.touch()
+        self.thread.start()
+        self.assertTrue(self.monitor.connected.wait(5))
+
+        # check_interval is long, only the lockfile change is noticed
+        os.unlink(self.lockfile)
+        for ii in range(100):
+            if not self.monitor.connected.is_set():
+                break
+            time.sleep(0.05)
+        self.assertFalse(self.monitor.connected.is_set())
+
+        self.touch()
+        self.assertTrue(self.monitor.connected.wait(5))
+        self.assertEqual(self.client.connects, 2)
+
+    def test_ping_keeps_the_connection(self):
+        hub = StandInHub()
+        hub.start(lockfile=False)
+        conn = HubConnection(hub.url, hub.register_client())
+
+        def is_connected():
+            conn.ping()
+            return self.client.is_connected()
+
+        self.monitor.is_connected = is_connected
+        self.monitor.check_interval = 0.05
+        self.touch()
+        try:
+            self.thread.start()
+            self.assertTrue(self.monitor.connected.wait(5))
+            time.sleep(0.5)
+            self.assertTrue(self.monitor.connected.is_set())
+            self.assertEqual(self.client.connects, 1)
+        finally:
+            conn.close()
+            hub.stop()
+
+    def test_gives_up(self):
+        self.monitor.timeout = 0.3
+        self.assertFalse(self.monitor.run())
+
+    def test_calls_wait_for_the_hub(self):
+        gate = threading.Event()
+        dispatcher = Dispatcher(gate=gate)
+        done = []
+
+        def ping(private_key, sender_id, msg_id, mtype, params, extra):
+            done.append(msg_id)
+
+        dispatcher.wrap(ping)("key", "c1", "ping-1", "sherpa.ping", {}, {})
+        time.sleep(0.2)
+        self.assertEqual(done, [])
+        gate.set()
+        for ii in range(100):
+            if done:
+                break
+            time.sleep(0.05)
+        self.assertEqual(done, ["ping-1"])
+        dispatcher.shutdown()
+
+    def test_lockfile_path(self):
+        os.environ["SAMP_HUB"] = "std-lockurl:file:///tmp/samp-hub"
+        try:
+            self.assertEqual(lockfile_path(), "/tmp/samp-hub")
+        finally:
+            del os.environ["SAMP_HUB"]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -170,6 +170,66 @@ def get_confidence():
 
 
 MTYPE_SPECTRUM_FIT_FIT = "spectrum.fit.fit"
+MTYPE_SPECTRUM_FIT_FIT_BATCH = "spectrum.fit.fit.batch"
+MTYPE_SPECTRUM_FIT_CONFIDENCE = "spectrum.fit.confidence"
+
+class SendProgressTester(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.broadcast = sherpa_samp.mtypes.broadcast
+        sherpa_samp.mtypes.broadcast = lambda mtype, params: \
+            self.sent.append((mtype, params))
+
+    def tearDown(self):
+        sherpa_samp.mtypes.broadcast = self.broadcast
+
+    def test_confidence(self):
+        send = sherpa_samp.mtypes.send_progress
+        send({"key": "conf-1", "kind": "confidence", "iteration": 3,
+              "statval": 1.5, "messages": []})
+        self.assertEqual([mtype for mtype, params in self.sent],
+                         ["spectrum.fit.confidence.progress"])
+
+        del self.sent[:]
+        send({"key": "conf-1", "kind": "confidence",
+              "messages": ["p1.gamma lower bound: -0.1"]})
+        self.assertEqual(self.sent,
+                         [("spectrum.fit.confidence.event",
+                           {"msg-id": "conf-1",
+                            "message": "p1.gamma lower bound: -0.1"})])
+
+    def test_fit(self):
+        sherpa_samp.mtypes.send_progress(
+            {"key": "fit-1", "kind": "fit", "iteration": 3, "statval": 1.5,
+             "parnames": ["p1.gamma"], "parvals": [2.0], "messages": []})
+        mtype, params = self.sent[0]
+        self.assertEqual(mtype, "spectrum.fit.fit.event")
+        self.assertEqual(params["iteration"], "3")
+        self.assertEqual(params["parnames"], ["p1.gamma"])
+
+
+class ParseArgsTester(unittest.TestCase):
+
+    def test_limits(self):
+        args = sherpa_samp.mtypes.parse_args(
+            ["--max-walltime", "60", "--budget",
+             "spectrum.fit.confidence:nfev=1000", "--unknown"])
+        self.assertEqual(args.max_walltime, 60.0)
+        self.assertEqual(args.budget,
+                         [("spectrum.fit.confidence", {"nfev": 1000})])
+
+    def test_misspelled_limit(self):
+        for argv in (["--max-walltme", "60"], ["--budgets", "x:nfev=1"],
+                     ["--maxrss=100"]):
+            self.assertRaises(SystemExit, sherpa_samp.mtypes.parse_args,
+                              argv)
+
+    def test_other_options(self):
+        # e.g. those of the test runner, when main() reads sys.argv
+        args = sherpa_samp.mtypes.parse_args(["--maxfail=1", "--boxed"])
+        self.assertEqual(args.max_walltime, None)
+
 
 class MTypeTester(unittest.TestCase):
 
@@ -195,7 +255,7 @@ class MTypeTester(unittest.TestCase):
 
         time.sleep(5)
 
-        thread.start_new_thread(sherpa_samp.mtypes.main, ())
+        thread.start_new_thread(sherpa_samp.mtypes.main, ([],))
         cls.cli = samp.SAMPIntegratedClient()
         cls.cli.connect()
 
@@ -364,6 +424,113 @@ class MTypeTester(unittest.TestCase):
         self._test_tablemodel()
         self._test_usermodel()
 
+    def test_spectrum_fit_fit_warmstart_cached(self):
+
+        params = {
+            'datasets'  : [get_data()],
+            'models'    : [get_model()],
+            'stat'      : get_stat(),
+            'method'    : get_method(),
+            'warmstart' : 'true',
+            }
+
+        hits = []
+        cache = sherpa_samp.mtypes._fit_cache
+        get = cache.get
+        def counting_get(key):
+            results = get(key)
+            hits.append(results is not None)
+            return results
+        cache.get = counting_get
+
+        try:
+            responses = [self.cli.callAndWait(
+                             sherpa_samp.mtypes.cli.getPublicId(),
+                             {'samp.mtype'  : MTYPE_SPECTRUM_FIT_FIT,
+                              'samp.params' : params},
+                             "10")
+                         for ii in range(2)]
+        finally:
+            del cache.get
+
+        for response in responses:
+            assert response['samp.status'] == 'samp.ok'
+
+        # the second fit starts from the results of the first, but is
+        # looked up by what the client sent
+        assert hits[-1]
+        parvals = [decode_string(response['samp.result']['parvals'])
+                   for response in responses]
+        assert numpy.allclose(parvals[0], parvals[1], 1.e-7, 1.e-7)
+
+    def test_spectrum_fit_fit_batch(self):
+
+        bad = get_data()
+        del bad['y']
+        params = {
+            'datasets' : [get_data(), bad, get_data()],
+            'models'   : [get_model()],
+            'stat'     : get_stat(),
+            'method'   : get_method(),
+            }
+        response = self.cli.callAndWait(
+            sherpa_samp.mtypes.cli.getPublicId(),
+            {'samp.mtype'  : MTYPE_SPECTRUM_FIT_FIT_BATCH,
+             'samp.params' : params},
+            "20")
+
+        assert response['samp.status'] == 'samp.ok'
+
+        results = response['samp.result']['results']
+        assert len(results) == 3
+
+        assert results[1]['status'] == 'error'
+        assert results[1]['exception'] == 'DataException'
+
+        for results in (results[0], results[2]):
+            assert results['status'] == 'ok'
+            parvals = decode_string(results['parvals'])
+            assert numpy.allclose(self._fit_results_bench['parvals'], parvals,
+                                  1.e-7, 1.e-7)
+            assert numpy.allclose(self._fit_results_bench['statval'],
+                                  float(results['statval']), 1.e-7, 1.e-7)
+
+    def test_spectrum_fit_confidence_parallel(self):
+
+        # start from the best fit, so that both runs search the same limits
+        model = get_model()
+        parvals = dict(zip(self._fit_results_bench['parnames'],
+                           self._fit_results_bench['parvals']))
+        for part in model['parts']:
+            for par in part['pars']:
+                if par['name'] in parvals:
+                    par['val'] = float(parvals[par['name']])
+
+        results = []
+        for parallel in ('false', 'true'):
+            confidence = get_confidence()
+            confidence['parallel'] = parallel
+            params = {
+                'datasets'   : [get_data()],
+                'models'     : [model],
+                'stat'       : get_stat(),
+                'method'     : get_method(),
+                'confidence' : confidence,
+                }
+            response = self.cli.callAndWait(
+                sherpa_samp.mtypes.cli.getPublicId(),
+                {'samp.mtype'  : MTYPE_SPECTRUM_FIT_CONFIDENCE,
+                 'samp.params' : params},
+                "60")
+            assert response['samp.status'] == 'samp.ok'
+            results.append(response['samp.result'])
+
+        serial, parallel = results
+        assert serial['parnames'] == parallel['parnames']
+        for key in ('parvals', 'parmins', 'parmaxes'):
+            assert numpy.allclose(decode_string(serial[key]),
+                                  decode_string(parallel[key]), 1.e-5, 1.e-5)
+
     def test_convert_underscores_to_hyphens(self):
         params = {}
         segment1 = {'x': [], 'y': [], 'yerr': [], 'norm_constant': 1.0}
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import time
+import unittest
+
+from sherpa_samp.pool import WorkerPool, JobError, JobCancelled
+
+
+def square(x):
+    return x * x
+
+
+def getpid():
+    return os.getpid()
+
+
+def fail(msg):
+    raise ValueError(msg)
+
+
+def sleep(secs):
+    time.sleep(secs)
+    return secs
+
+
+class WorkerPoolTester(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(size=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_apply(self):
+        self.assertEqual(self.pool.apply(square, (7,)), 49)
+
+    def test_workers_are_reused(self):
+        pids = set(self.pool.apply(getpid) for ii in range(10))
+        self.assertTrue(len(pids) <= 2)
+        self.assertFalse(os.getpid() in pids)
+
+    def test_map(self):
+        tasks = self.pool.map(square, [(ii,) for ii in range(8)])
+        self.assertEqual([task.get() for task in tasks],
+                         [ii * ii for ii in range(8)])
+
+    def test_error(self):
+        try:
+            self.pool.apply(fail, ("bad model",))
+        except JobError, e:
+            self.assertEqual(str(e), "bad model")
+            self.assertEqual(e.name, "ValueError")
+            self.assertTrue("ValueError" in e.trace)
+        else:
+            self.fail("JobError not raised")
+
+    def test_cancel_replaces_worker(self):
+        task = self.pool.submit(sleep, (30,), key="msg-1")
+        time.sleep(0.5)
+        self.assertEqual(self.pool.running(), ["msg-1"])
+        self.assertEqual(self.pool.cancel("msg-1"), 1)
+        self.assertRaises(JobCancelled, task.get)
+
+        # the pool is still at full strength
+        tasks = self.pool.map(square, [(ii,) for ii in range(4)])
+        self.assertEqual([t.get() for t in tasks], [0, 1, 4, 9])
+
+    def test_cancel_leaves_other_jobs(self):
+        keep = self.pool.submit(sleep, (1,), key="msg-2")
+        stop = self.pool.submit(sleep, (30,), key="msg-3")
+        time.sleep(0.5)
+        self.pool.cancel("msg-3")
+        self.assertRaises(JobCancelled, stop.get)
+        self.assertEqual(keep.get(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
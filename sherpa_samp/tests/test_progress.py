@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import time
+import fcntl
+import Queue
+import threading
+import unittest
+
+import sherpa_samp.progress as progress
+from sherpa_samp.pool import WorkerPool
+from sherpa_samp.progress import Reporter, ProgressBroadcaster
+
+
+def iterate(key, niter):
+    reporter = Reporter(key, "fit", interval=0.0)
+    for ii in range(niter):
+        reporter.send(iteration=ii + 1, statval=float(niter - ii),
+                      parnames=['p1.gamma'], parvals=[float(ii)])
+    reporter.flush()
+    reporter.log("done")
+    return niter
+
+
+class ProgressTester(unittest.TestCase):
+
+    def setUp(self):
+        self.records = Queue.Queue()
+        self.broadcaster = ProgressBroadcaster(self.records.put, maxrate=5.0)
+
+    def tearDown(self):
+        self.broadcaster.close()
+
+    def collect(self, key):
+        # wait for the last iteration of key, records may be coalesced
+        records = []
+        while True:
+            record = self.records.get(timeout=5)
+            if record["key"] != key:
+                continue
+            records.append(record)
+            if record["messages"]:
+                return records
+
+    def test_coalesced(self):
+        tt = time.time()
+        iterate("msg-1", 1000)
+        records = self.collect("msg-1")
+        self.assertEqual(records[-1]["iteration"], 1000)
+        self.assertEqual(records[-1]["parvals"], [999.0])
+        self.assertEqual(records[-1]["messages"], ["done"])
+        # at most maxrate broadcasts per second
+        self.assertTrue(len(records) <= (time.time() - tt) * 5.0 + 1)
+
+    def test_workers(self):
+        pool = WorkerPool(size=2)
+        try:
+            self.assertEqual(pool.apply(iterate, ("msg-2", 10)), 10)
+            records = self.collect("msg-2")
+            self.assertEqual(records[-1]["kind"], "fit")
+            self.assertEqual(records[-1]["iteration"], 10)
+        finally:
+            pool.close()
+
+    def test_throttle(self):
+        reporter = Reporter("msg-3", "fit", interval=60.0)
+        self.assertTrue(reporter.due())
+        reporter.send(iteration=1)
+        self.assertFalse(reporter.due())
+
+    def test_full_pipe(self):
+        # a pipe of its own that nobody reads until the reporter is done
+        read_fd, write_fd = os.pipe()
+        flags = fcntl.fcntl(write_fd, fcntl.F_GETFL)
+        fcntl.fcntl(write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        saved, progress._write_fd = progress._write_fd, write_fd
+        received = []
+
+        def drain():
+            time.sleep(0.2)
+            while True:
+                data = os.read(read_fd, 65536)
+                if not data:
+                    break
+                received.append(data)
+
+        thread = threading.Thread(target=drain)
+        thread.daemon = True
+        try:
+            reporter = Reporter("msg-4", "fit", interval=0.0)
+            sent = [reporter.send(iteration=ii + 1) for ii in range(10000)]
+            # updates are dropped, and the latest is kept for flush()
+            self.assertFalse(all(sent))
+            self.assertEqual(reporter.dropped["iteration"], 10000)
+
+            # these wait for the reader
+            thread.start()
+            self.assertTrue(reporter.flush())
+            self.assertTrue(reporter.log("done"))
+            self.assertTrue(reporter.dropped is None)
+        finally:
+            progress._write_fd = saved
+            os.close(write_fd)
+            thread.join(5)
+            os.close(read_fd)
+        self.assertTrue("done" in "".join(received))
+
+
+if __name__ == '__main__':
+    unittest.main()
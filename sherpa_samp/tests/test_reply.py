@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import unittest
+from httplib import CannotSendRequest
+
+from sherpa_samp.reply import ReplySender
+
+
+class Hub(object):
+    """
+    Records the replies it gets, after failing `failures[msg_id]` times.
+    """
+
+    def __init__(self, failures=None, error=CannotSendRequest):
+        self.failures = failures or {}
+        self.error = error
+        self.replies = []
+
+    def reply(self, msg_id, response):
+        if self.failures.get(msg_id, 0) > 0:
+            self.failures[msg_id] -= 1
+            raise self.error()
+        self.replies.append(msg_id)
+
+
+class ReplySenderTester(unittest.TestCase):
+
+    def sender(self, hub, retries=3):
+        return ReplySender(hub.reply, retryable=(CannotSendRequest,),
+                           retries=retries, base=0.01, cap=0.05)
+
+    def test_order_per_recipient(self):
+        hub = Hub({'a1': 2})
+        sender = self.sender(hub)
+        sender.put('a1', {}, 'client-a')
+        sender.put('b1', {}, 'client-b')
+        sender.put('a2', {}, 'client-a')
+        self.assertTrue(sender.flush(5))
+
+        # a2 waits for a1, b1 does not
+        self.assertTrue(hub.replies.index('a1') < hub.replies.index('a2'))
+        self.assertEqual(hub.replies[0], 'b1')
+        self.assertEqual(sender.stats, {'sent': 3, 'retried': 2,
+                                        'dropped': 0})
+
+    def test_bounded_retries(self):
+        hub = Hub({'a1': 100})
+        sender = self.sender(hub, retries=3)
+        sender.put('a1', {}, 'client-a')
+        sender.put('a2', {}, 'client-a')
+        self.assertTrue(sender.flush(5))
+        self.assertEqual(hub.replies, ['a2'])
+        self.assertEqual(sender.stats['dropped'], 1)
+        self.assertEqual(sender.stats['retried'], 3)
+
+    def test_other_errors_are_not_retried(self):
+        hub = Hub({'a1': 1}, error=ValueError)
+        sender = self.sender(hub)
+        sender.put('a1', {})
+        sender.close(5)
+        self.assertEqual(hub.replies, [])
+        self.assertEqual(sender.stats['dropped'], 1)
+        self.assertEqual(sender.stats['retried'], 0)
+        self.assertEqual(sender.pending(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,7 +20,7 @@ import unittest
 import numpy as np
 
 from sherpa_samp.utils import DictionaryClass
-from sherpa_samp.sed import Sed
+from sherpa_samp.sed import Sed, grid
 
 class  Sed_TestCase(unittest.TestCase):
     #def setUp(self):
@@ -86,6 +86,48 @@ class  Sed_TestCase(unittest.TestCase):
         # In this case, the constant is 0.5.
         np.testing.assert_array_equal(s.err, s.flux * 0.5)
 
+    def test_grid(self):
+        for log in (True, False):
+            for num_bins in (0, 1, 2, 7, 1000):
+                interval = (3.e3, 4.e5)
+                if log:
+                    expected = np.logspace(3, 6, num_bins)
+                else:
+                    expected = np.linspace(3.e3, 4.e5, num_bins)
+                np.testing.assert_array_equal(
+                    grid(interval, num_bins, log), expected)
+                if num_bins > 4:
+                    np.testing.assert_array_equal(
+                        grid(interval, num_bins, log, 3, num_bins),
+                        expected[3:])
+
+    def test_iter_interpolate(self):
+        # starts past the lower end of the grids, so some bins are NaN
+        x = np.logspace(3.5, 5, 50)
+        y = (x / 5000.) ** -1.5
+        s = Sed(x, y)
+        linear = lambda xout, xin, yin: np.interp(xout, xin, yin,
+                                                  left=np.nan, right=np.nan)
+        for log in (True, False):
+            expected = s.interpolate(linear, (2.e3, 1.e5), 1001, log)
+            chunks = list(s.iter_interpolate(linear, (2.e3, 1.e5), 1001, log,
+                                             chunksize=100))
+            self.assertEqual(len(chunks), 11)
+            np.testing.assert_array_equal(
+                np.concatenate([bins for bins, flux in chunks]),
+                expected.wavelength)
+            np.testing.assert_array_equal(
+                np.concatenate([flux for bins, flux in chunks]),
+                expected.flux)
+
+            bins, flux = s.interpolate_into(linear, (2.e3, 1.e5), 1001, log,
+                                            dtype='>f8', dropnan=True,
+                                            chunksize=100)
+            keep = ~np.isnan(expected.flux)
+            self.assertEqual(bins.dtype, np.dtype('>f8'))
+            np.testing.assert_array_equal(bins, expected.wavelength[keep])
+            np.testing.assert_array_equal(flux, expected.flux[keep])
+
 
 if __name__ == '__main__':
     unittest.main()
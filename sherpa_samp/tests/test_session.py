@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import time
+import unittest
+import numpy
+
+from sherpa_samp.session import (SessionCache, copy_spec, share_spec,
+                                 release_spec)
+from sherpa_samp.transport import decode_array, is_reference
+from sherpa_samp.utils import encode_string
+
+
+class SessionCacheTester(unittest.TestCase):
+
+    def test_same_client_same_session(self):
+        cache = SessionCache()
+        self.assertTrue(cache.get("c1") is cache.get("c1"))
+        self.assertFalse(cache.get("c1") is cache.get("c2"))
+
+    def test_lru_eviction(self):
+        cache = SessionCache(maxsize=2)
+        cache.get("c1")
+        cache.get("c2")
+        cache.get("c1")
+        cache.get("c3")
+        self.assertTrue("c1" in cache)
+        self.assertFalse("c2" in cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_idle_timeout(self):
+        cache = SessionCache(timeout=0.1)
+        cache.get("c1")
+        time.sleep(0.2)
+        cache.get("c2")
+        self.assertFalse("c1" in cache)
+
+    def test_spec_accumulates(self):
+        cache = SessionCache()
+        ui = cache.get("c1")
+        x = numpy.arange(1.0, 11.0)
+        ui.set_data([{'x': encode_string(x), 'y': encode_string(x),
+                      'staterror': encode_string(numpy.ones(10))}])
+        ui.set_stat({'name': 'leastsq'})
+
+        spec = cache.get("c1").get_spec({'stat': {'name': 'chi2'},
+                                         'params': []})
+        self.assertEqual(spec['stat']['name'], 'chi2')
+        self.assertEqual(spec['params'], [])
+        self.assertTrue(numpy.allclose(spec['datasets'][0]['x'], x))
+
+    def get_spec(self, ndata=1, gamma=1.0):
+        x = numpy.arange(1.0, 11.0)
+        data = {'x': encode_string(x), 'y': encode_string(x ** -1.5),
+                'staterror': encode_string(numpy.ones(10))}
+        p1 = {'name': 'powlaw1d.p1',
+              'pars': [{'name': 'p1.gamma', 'val': gamma, 'min': -10.0,
+                        'max': 10.0, 'frozen': False}]}
+        return {'datasets': [dict(data) for ii in range(ndata)],
+                'models': [{'name': 'powlaw1d.p1', 'parts': [p1]}],
+                'stat': {'name': 'chi2'},
+                'method': {'name': 'levmar'}}
+
+    def test_update_only_what_was_sent(self):
+        ui = SessionCache().get("c1")
+        ui.update(ui.get_spec(self.get_spec()))
+        data = ui.session.get_data(0)
+
+        sent = {'models': self.get_spec(gamma=2.0)['models']}
+        ui.update(ui.get_spec(sent), sent.keys())
+        self.assertTrue(ui.session.get_data(0) is data)
+        self.assertEqual(ui.session.get_par('p1.gamma').val, 2.0)
+
+        sent = {'datasets': self.get_spec()['datasets']}
+        ui.update(ui.get_spec(sent), sent.keys())
+        self.assertFalse(ui.session.get_data(0) is data)
+        self.assertEqual(ui.session.get_par('p1.gamma').val, 2.0)
+
+    def test_update_drops_left_over_datasets(self):
+        ui = SessionCache().get("c1")
+        spec = self.get_spec(ndata=2)
+        ui.update(ui.get_spec(spec), spec.keys())
+        self.assertEqual(list(ui.session.list_data_ids()), [0, 1])
+
+        spec = self.get_spec()
+        ui.update(ui.get_spec(spec), spec.keys())
+        self.assertEqual(list(ui.session.list_data_ids()), [0])
+
+    def test_copy_spec_shares_arrays(self):
+        x = numpy.arange(10.0)
+        spec = {'datasets': [{'x': x}], 'stat': {'name': 'leastsq'}}
+        copied = copy_spec(spec)
+        self.assertTrue(copied['datasets'][0]['x'] is x)
+        self.assertFalse(copied['stat'] is spec['stat'])
+
+    def test_share_spec(self):
+        x = numpy.arange(10.0)
+        spec = {'datasets': [{'x': x, 'name': 'sed'}],
+                'stat': {'name': 'leastsq'}}
+        shared, refs = share_spec(spec, "file")
+        try:
+            ref = shared['datasets'][0]['x']
+            self.assertTrue(is_reference(ref))
+            self.assertEqual(refs, [ref])
+            self.assertTrue(numpy.array_equal(decode_array(ref, native=True),
+                                              x))
+            self.assertEqual(shared['datasets'][0]['name'], 'sed')
+            self.assertTrue(spec['datasets'][0]['x'] is x)
+        finally:
+            release_spec(refs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import Queue
+import unittest
+import numpy
+
+import sherpa_samp.sedexceptions as sedexceptions
+from sherpa_samp.tasks import (fit_task, confidence_task, grid_task,
+                               build_session)
+from sherpa_samp.grid import calc_stat_grid
+from sherpa_samp.progress import ProgressBroadcaster
+from sherpa_samp.utils import encode_string
+
+
+def get_spec():
+    x = numpy.linspace(1.0, 10.0, 50)
+    y = 3.0 * x ** -1.5
+    data = {'name' : 'power law',
+            'x' : encode_string(x),
+            'y' : encode_string(y),
+            'staterror' : encode_string(y * 0.1)}
+    p1 = {'name' : 'powlaw1d.p1',
+          'pars' : [{'name' : 'p1.gamma', 'val' : 1.0, 'min' : -10.0,
+                     'max' : 10.0, 'frozen' : False},
+                    {'name' : 'p1.ref', 'val' : 1.0, 'min' : -1.e10,
+                     'max' : 1.e10, 'frozen' : True},
+                    {'name' : 'p1.ampl', 'val' : 1.0, 'min' : 0.0,
+                     'max' : 1.e10, 'frozen' : False}]}
+    return {'datasets' : [data],
+            'models' : [{'name' : 'powlaw1d.p1', 'parts' : [p1]}],
+            'stat' : {'name' : 'chi2'},
+            'method' : {'name' : 'levmar'},
+            'confidence' : {'name' : 'conf',
+                            'config' : {'numcores' : 1}}}
+
+
+class TasksTester(unittest.TestCase):
+    """
+    The tasks run in the test process, against a real Sherpa.
+    """
+
+    def test_fit_progress(self):
+        records = Queue.Queue()
+        broadcaster = ProgressBroadcaster(records.put, maxrate=10.0)
+        try:
+            results = fit_task(get_spec(), "fit-1")
+            self.assertEqual(results["succeeded"], "1")
+            record = records.get(timeout=5)
+        finally:
+            broadcaster.close()
+        self.assertEqual(record["key"], "fit-1")
+        self.assertEqual(record["kind"], "fit")
+        self.assertEqual(record["parnames"], ["p1.gamma", "p1.ampl"])
+        self.assertEqual(len(record["parvals"]), 2)
+        self.assertTrue(record["iteration"] >= 1)
+
+    def test_fit_nfev_budget(self):
+        try:
+            fit_task(get_spec(), None, 5)
+        except sedexceptions.FitException, e:
+            self.assertTrue("budget of 5 function evaluations" in str(e))
+        else:
+            self.fail("the fit was not stopped")
+
+    def test_confidence_nfev_budget(self):
+        try:
+            confidence_task(get_spec(), maxnfev=3)
+        except sedexceptions.ConfidenceException, e:
+            self.assertTrue("budget of 3 function evaluations" in str(e))
+        else:
+            self.fail("confidence was not stopped")
+
+    def test_grid_same_as_calc_stat(self):
+        parnames = ["p1.gamma", "p1.ampl"]
+        gamma, ampl = numpy.meshgrid(numpy.linspace(0.5, 2.5, 7),
+                                     numpy.linspace(1.0, 5.0, 6))
+        values = numpy.column_stack([gamma.ravel(), ampl.ravel()])
+
+        # what spectrum.fit.calc.statistic.values used to do, point by point
+        ui = build_session(get_spec(), filter_nans=False)
+        expected = []
+        for parvals in values:
+            for name, val in zip(parnames, parvals):
+                ui.session.set_par(name, val)
+            expected.append(ui.session.calc_stat())
+
+        ui = build_session(get_spec(), filter_nans=False)
+        numpy.testing.assert_allclose(calc_stat_grid(ui, parnames, values),
+                                      expected, rtol=1.e-12)
+        numpy.testing.assert_allclose(grid_task(get_spec(), parnames, values),
+                                      expected, rtol=1.e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
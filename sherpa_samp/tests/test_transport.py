@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import os
+import unittest
+import numpy
+
+from sherpa_samp.utils import DictionaryClass, encode_string
+from sherpa_samp.transport import (decode_array, encode_array, is_reference,
+                                   remove_array)
+
+
+class TransportTester(unittest.TestCase):
+
+    x = numpy.linspace(1000, 10000, num=1000)
+
+    def check_reference(self, transport):
+        ref = encode_array(self.x, transport)
+        try:
+            self.assertTrue(is_reference(ref))
+            self.assertTrue(numpy.array_equal(decode_array(ref), self.x))
+
+            native = decode_array(ref, native=True)
+            self.assertTrue(native.flags.writeable)
+            native[0] = -1.0
+            # copy-on-write, the referenced data is untouched
+            self.assertEqual(decode_array(ref)[0], self.x[0])
+        finally:
+            remove_array(ref)
+
+    def test_file(self):
+        self.check_reference("file")
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "no /dev/shm")
+    def test_shm(self):
+        self.check_reference("shm")
+
+    def test_base64(self):
+        encoded = encode_array(self.x)
+        self.assertEqual(encoded, encode_string(self.x))
+        self.assertTrue(numpy.array_equal(decode_array(encoded), self.x))
+
+    def test_reference_in_payload(self):
+        ref = encode_array(self.x, "file")
+        try:
+            payload = DictionaryClass({'x': ref, 'transport': 'file'})
+            self.assertTrue(numpy.array_equal(decode_array(payload.x), self.x))
+        finally:
+            remove_array(ref)
+
+    def test_offset_and_dtype(self):
+        ref = encode_array(numpy.arange(10.0), "file")
+        try:
+            ref['offset'] = str(8 * 4)
+            ref['shape'] = ['3']
+            self.assertEqual(list(decode_array(ref)), [4.0, 5.0, 6.0])
+        finally:
+            remove_array(ref)
+
+    def test_arrays_pass_through(self):
+        self.assertTrue(decode_array(self.x) is self.x)
+
+    def test_bad_reference(self):
+        self.assertRaises(ValueError, decode_array, {'url': 'http://x/y'})
+        self.assertRaises(ValueError, decode_array, {'url': 'shm://../etc'})
+
+
+if __name__ == '__main__':
+    unittest.main()
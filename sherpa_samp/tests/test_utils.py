@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+import base64
+import struct
+import unittest
+import numpy
+
+from sherpa_samp.utils import encode_string, decode_string
+
+
+def wire(values):
+    # reference encoding, independent of numpy
+    return base64.b64encode(struct.pack(">%dd" % len(values), *values))
+
+
+class CodecTester(unittest.TestCase):
+
+    values = [0.0, 1.5, -2.25, 1.e-300, 3.e+300, 42.0]
+
+    def test_encode_matches_wire_format(self):
+        self.assertEqual(encode_string(self.values), wire(self.values))
+        self.assertEqual(encode_string(numpy.array(self.values)),
+                         wire(self.values))
+        self.assertEqual(encode_string(numpy.array(self.values, dtype=">f8")),
+                         wire(self.values))
+
+    def test_encode_non_contiguous(self):
+        x = numpy.arange(10.0)
+        self.assertEqual(encode_string(x[::2]), wire(list(x[::2])))
+
+    def test_encode_integers(self):
+        self.assertEqual(encode_string(numpy.arange(4)),
+                         wire([0.0, 1.0, 2.0, 3.0]))
+
+    def test_encode_buffer_reuse(self):
+        first = encode_string(numpy.arange(100.0))
+        second = encode_string(numpy.arange(3.0))
+        self.assertEqual(second, wire([0.0, 1.0, 2.0]))
+        self.assertEqual(decode_string(first).size, 100)
+
+    def test_decode_view(self):
+        array = decode_string(wire(self.values))
+        self.assertEqual(array.dtype, numpy.dtype(">f8"))
+        self.assertFalse(array.flags.writeable)
+        self.assertEqual(list(array), self.values)
+
+    def test_decode_native(self):
+        array = decode_string(wire(self.values), native=True)
+        self.assertTrue(array.dtype.isnative)
+        self.assertTrue(array.flags.writeable)
+        self.assertEqual(list(array), self.values)
+
+    def test_round_trip(self):
+        x = numpy.random.normal(size=1000)
+        self.assertTrue(numpy.array_equal(decode_string(encode_string(x)), x))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2011, 2015  Smithsonian Astrophysical Observatory
+#
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program; if not, write to the Free Software Foundation, Inc.,
+#  51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+#
+## Out-of-band array transport
+#
+## Any array field of a payload (x, y, staterror, yerr, ...) may hold,
+## instead of a base64 string, a reference map such as
+##
+##   { "url"    : "file:///tmp/sed-x.bin",  or  "shm://sed-x",
+##     "dtype"  : "<f8",
+##     "shape"  : ["100000"],
+##     "offset" : "0" }
+##
+## "shm://name" is a POSIX shared memory object, i.e. /dev/shm/name on
+## Linux.  Referenced data is memory mapped rather than copied.  Clients
+## may ask for replies in the same form by sending "transport" : "file"
+## or "shm" with the call; the files named in such a reply belong to the
+## client, which removes them once read.
+#
+
+import os
+import uuid
+import tempfile
+import numpy
+
+from sherpa_samp.utils import encode_string, decode_string, DictionaryClass
+from sherpa_samp.metrics import timed
+
+__all__ = ('is_reference', 'decode_array', 'encode_array', 'write_array',
+           'remove_array')
+
+_shm_dir = "/dev/shm"
+
+
+def _path(url):
+    if url.startswith("file://"):
+        return url[len("file://"):]
+    if url.startswith("shm://"):
+        name = url[len("shm://"):].lstrip("/")
+        if not name or "/" in name:
+            raise ValueError("invalid shared memory name '%s'" % name)
+        return os.path.join(_shm_dir, name)
+    raise ValueError("unsupported array reference '%s'" % url)
+
+
+def is_reference(value):
+    if isinstance(value, DictionaryClass):
+        value = value.__dict__
+    return isinstance(value, dict) and value.has_key("url")
+
+
+@timed("decode")
+def decode_array(value, native=False):
+    """
+    Array from a base64 string, a reference map or an array.  Referenced
+    data is memory mapped read-only, or copy-on-write when native is
+    requested and the data is already in native byte order.
+    """
+    if isinstance(value, numpy.ndarray):
+        if native and not value.dtype.isnative:
+            value = value.astype(value.dtype.newbyteorder("="))
+        return value
+
+    if not is_reference(value):
+        return decode_string(value, native=native)
+
+    if isinstance(value, DictionaryClass):
+        value = value.__dict__
+    dtype = numpy.dtype(str(value.get("dtype", ">f8")))
+    offset = int(value.get("offset", 0))
+    shape = value.get("shape", None)
+    if shape is not None:
+        if isinstance(shape, (list, tuple)):
+            shape = tuple(int(dim) for dim in shape)
+        else:
+            shape = (int(shape),)
+
+    mode = "r"
+    if native and dtype.isnative:
+        mode = "c"
+    array = numpy.memmap(_path(str(value["url"])), dtype=dtype, mode=mode,
+                         offset=offset, shape=shape)
+    if native and not dtype.isnative:
+        array = array.astype(dtype.newbyteorder("="))
+    return array
+
+
+def write_array(array, transport):
+    """
+    Write array to a new file or shared memory object and return the
+    reference map for it.
+    """
+    array = numpy.ascontiguousarray(array, dtype=numpy.float64)
+    if transport == "shm":
+        name = "sherpa-samp-" + uuid.uuid4().hex
+        path = os.path.join(_shm_dir, name)
+        url = "shm://" + name
+    elif transport == "file":
+        fd, path = tempfile.mkstemp(prefix="sherpa-samp-", suffix=".bin")
+        os.close(fd)
+        url = "file://" + path
+    else:
+        raise ValueError("unsupported array transport '%s'" % transport)
+
+    array.tofile(path)
+    return {"url": url,
+            "dtype": array.dtype.str,
+            "shape": [str(dim) for dim in array.shape],
+            "offset": "0"}
+
+
+@timed("encode")
+def encode_array(array, transport=None):
+    """
+    Encode array for a reply, as a base64 string unless an out-of-band
+    transport ("file" or "shm") was asked for.
+    """
+    if transport in (None, "", "base64"):
+        return encode_string(array)
+    return write_array(array, transport)
+
+
+def remove_array(ref):
+    try:
+        os.unlink(_path(str(ref["url"])))
+    except OSError:
+        pass
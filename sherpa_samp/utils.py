@@ -20,10 +20,13 @@
 
 import numpy
 import base64
+import threading
 import traceback
 import cStringIO
 import re
 
+from sherpa_samp.metrics import timed
+
 
 __all__ = ('decode_string', 'encode_string', 'capture_exception', 'DictionaryClass')
 
@@ -36,19 +39,56 @@ def convert(name):
     return all_cap_re.sub(r'\1_\2', s1).lower()
 
 
-def decode_string(encoded_string, dtype="<f8"):
+# Arrays travel over SAMP as base64 encoded big-endian doubles
+_wire_dtype = numpy.dtype(">f8")
+
+# Encode buffers larger than this are not kept around between calls
+_max_buffer_size = 1 << 22
+
+_buffers = threading.local()
+
 
+def _encode_buffer(size):
+    buf = getattr(_buffers, "encode", None)
+    if buf is None or buf.size < size:
+        buf = numpy.empty(size, dtype=_wire_dtype)
+        if size <= _max_buffer_size:
+            _buffers.encode = buf
+    return buf[:size]
+
+
+@timed("decode")
+def decode_string(encoded_string, dtype=">f8", native=False):
+    """
+    Decode a base64 string of doubles.  By default the result is a
+    read-only view in wire (big-endian) byte order on the decoded bytes,
+    so nothing is copied.  With native=True a writable, native byte order
+    array is returned instead, which is what compiled code like Sherpa's
+    wants.
+    """
     decoded_string = base64.b64decode(encoded_string)
-    array = numpy.fromstring(decoded_string, dtype=numpy.float64).byteswap()
-    # array = numpy.ndarray(shape, dtype, decoded_string)
+    array = numpy.frombuffer(decoded_string, dtype=numpy.dtype(dtype))
+    if native:
+        array = array.astype(array.dtype.newbyteorder("="))
     return array
 
-def encode_string(array, dtype="<f8"):
-
-    array = numpy.asarray(array, dtype=numpy.float64)
-    decoded_string = array.byteswap().tostring()
-    encoded_string = base64.b64encode(decoded_string)
-    return encoded_string
+@timed("encode")
+def encode_string(array, dtype=">f8"):
+    """
+    Encode an array as a base64 string of big-endian doubles.  Arrays
+    that are not already contiguous big-endian doubles are converted
+    through a per-thread buffer that is reused between calls.
+    """
+    array = numpy.asarray(array)
+    wire = numpy.dtype(dtype)
+    if array.dtype != wire or not array.flags.c_contiguous:
+        if wire == _wire_dtype:
+            buf = _encode_buffer(array.size)
+        else:
+            buf = numpy.empty(array.size, dtype=wire)
+        buf[:] = array.ravel()
+        array = buf
+    return base64.b64encode(array.data)
 
 def capture_exception():
     trace = cStringIO.StringIO()